@@ -1,10 +1,32 @@
+import threading
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from starlette.middleware.base import BaseHTTPMiddleware
 from app.routers import index, product, api
+from app.src.spark.data.loader import flush_interactions, get_readiness, warm_up
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # load the model and environment in the background, the server accepts requests straight away and /healthz reports when it is ready
+    threading.Thread(target=warm_up, name="recommender-warm-up", daemon=True).start()
+    yield
+    # write interactions still waiting in the write-behind queue before exiting
+    flush_interactions()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+@app.get("/healthz")
+async def healthz():
+    """Readiness probe: 200 once the recommender is loaded, 503 while it is loading or if loading failed."""
+    readiness = get_readiness()
+    status = "ok" if readiness["ready"] else "error" if readiness["error"] else "starting"
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content={"status": status, **readiness})
 
 
 # no cache response to prevent stale content
@@ -1,18 +1,25 @@
 # api.py
 
+import asyncio
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import JSONResponse
-from typing import Optional
+from typing import List, Optional
+from app import services
 from app.src.spark.data.loader import (
     load_product,
-    load_products,
-    load_customer,
-    load_customers,
     save_interaction,
-    get_recommendations,
+    get_recommendations_batch,
+    get_recommendation_batcher_stats,
+    get_recommendation_cache_stats,
     set_current_user,
-    get_current_user,
     get_next_interaction_id,
+    get_interaction_queue_stats,
+    get_model_registry_stats,
+    reload_model,
+    set_product_available,
+    get_unavailable_products,
+    is_ready,
+    RecommenderNotReady,
 )
 from app.src.spark.data.models import InteractionType
 from datetime import datetime
@@ -21,10 +28,15 @@ from pydantic import BaseModel
 router = APIRouter()
 
 
+def _not_ready_response() -> JSONResponse:
+    """503 for requests that need the model while it is loading, so they never wait for it on the event loop."""
+    return JSONResponse(content={"error": "Recommender is not ready yet"}, status_code=503)
+
+
 @router.get("/api/currentUser")
 async def fetch_current_user():
     """Fetch the current user from the client-side or server-side variable."""
-    user_id = get_current_user()
+    user_id = services.current_user()
     return JSONResponse(content={"user_id": user_id})
 
 
@@ -38,71 +50,24 @@ async def set_current_user_endpoint(user_id: int):
 @router.get("/api/user")
 async def get_user(user_id: int):
     """Fetch user profile and interaction history."""
-    customer = load_customer(user_id)
-    if not customer:
+    user_data = services.user(user_id)
+    if not user_data:
         return JSONResponse(content={"error": "User not found"}, status_code=404)
 
-    user_data = {
-        "id": int(customer.idx),
-        "zip_code": customer.zip_code,
-        "city": customer.city,
-        "state": customer.state,
-        "interactions": [
-            {
-                "id": interaction.idx,
-                "timestamp": interaction.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                "product_id": int(interaction.product_idx),
-                "type": interaction.type.value,
-                "value": f"{interaction.value:.2f}" if interaction.value is not None else "N/A",
-                "review_score": interaction.review_score if interaction.review_score is not None else "N/A",
-            }
-            for interaction in customer.interactions
-        ],
-    }
     return JSONResponse(content=user_data)
 
 
 @router.get("/api/users")
 async def get_users():
     """Fetch all users and their interaction history."""
-    customers = load_customers()
-    user_data = [
-        {
-            "id": int(customer.idx),
-            "zip_code": customer.zip_code,
-            "city": customer.city,
-            "state": customer.state,
-            "interactions": [
-                {
-                    "id": interaction.idx,
-                    "timestamp": interaction.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                    "product_id": int(interaction.product_idx),
-                    "type": interaction.type.value,
-                    "value": f"{interaction.value:.2f}" if interaction.value is not None else "N/A",
-                    "review_score": interaction.review_score if interaction.review_score is not None else "N/A",
-                }
-                for interaction in customer.interactions
-            ],
-        }
-        for customer in customers
-    ]
-    return JSONResponse(content=user_data)
+    return JSONResponse(content=services.users())
 
 
 @router.get("/api/product")
 async def get_product(product_id: int):
     """Fetch a specific product by its ID."""
-    product = load_product(product_id)
-    if product:
-        product_data = {
-            "id": int(product.idx),
-            "name": product.name,
-            "price": f"{product.price:.2f}",
-            "desc": product.desc,
-            "long_desc": product.long_desc,
-            "image": "product_image.png",
-            "category": {"id": product.category.idx, "name": product.category.name, "desc": product.category.desc} if product.category else None,
-        }
+    product_data = services.product(product_id)
+    if product_data:
         return JSONResponse(content=product_data)
     else:
         return JSONResponse(content={"error": "Product not found"}, status_code=404)
@@ -111,42 +76,33 @@ async def get_product(product_id: int):
 @router.get("/api/products")
 async def get_products():
     """Fetch all products available in the catalog."""
-    products = load_products()
-    product_data = [
-        {
-            "id": p.idx,
-            "name": p.name,
-            "price": f"{p.price:.2f}",
-            "desc": p.desc,
-            "image": f"{p.category.name}.jpeg" if p.category else "product_image.png",
-            "category": {"id": p.category.idx, "name": p.category.name, "desc": p.category.desc} if p.category else None,
-        }
-        for p in products
-    ]
-    return JSONResponse(content=product_data)
+    return JSONResponse(content=services.products())
 
 
-@router.get("/api/catalogue")
-async def get_catalogue(category_id: Optional[int] = None):
-    """Fetch products by category if category_id is specified, otherwise all products."""
-    products = load_products()
+class ProductAvailabilityRequest(BaseModel):
+    product_id: int
+    available: bool
+
 
-    # Filter products based on the category_id if provided
-    filtered_products = [p for p in products if p.category and p.category.idx == category_id] if category_id else products
+@router.get("/api/product/availability")
+async def fetch_unavailable_products():
+    """Fetch the ids of the products that are not recommended, e.g. out of stock."""
+    return JSONResponse(content={"unavailable_products": sorted(get_unavailable_products())})
 
-    catalogue_data = [
-        {
-            "cat_id": p.category.idx if p.category else None,
-            "id": p.idx,
-            "name": p.name,
-            "price": f"{p.price:.2f}",
-            "desc": p.desc,
-            "image": f"{p.category.name}.jpeg" if p.category else "default.jpeg",
-        }
-        for p in filtered_products
-    ]
 
-    return JSONResponse(content=catalogue_data)
+@router.post("/api/product/availability")
+async def update_product_availability(request: ProductAvailabilityRequest):
+    """Allow or stop recommending a product."""
+    if not load_product(request.product_id):
+        raise HTTPException(status_code=404, detail="Product not found")
+    set_product_available(request.product_id, request.available)
+    return JSONResponse(content={"unavailable_products": sorted(get_unavailable_products())})
+
+
+@router.get("/api/catalogue")
+async def get_catalogue(category_id: Optional[int] = None):
+    """Fetch products by category if category_id is specified, otherwise all products."""
+    return JSONResponse(content=services.catalogue(category_id))
 
 
 class InteractionData(BaseModel):
@@ -163,6 +119,10 @@ class InteractionData(BaseModel):
 @router.post("/api/interaction")
 async def push_interaction(interaction: InteractionData):
     """Save a new interaction to user.json."""
+    # saving updates the env's observation, which is not loaded until the warm-up finishes
+    if not is_ready():
+        return _not_ready_response()
+
     try:
         interaction_type_enum = InteractionType(interaction.interaction_type)
     except ValueError:
@@ -196,13 +156,78 @@ async def push_interaction(interaction: InteractionData):
     return JSONResponse(content={"message": "Interaction saved successfully"})
 
 
+@router.get("/api/interaction/queue")
+async def fetch_interaction_queue():
+    """Fetch the depth and counters of the interaction write queue."""
+    return JSONResponse(content=get_interaction_queue_stats())
+
+
 @router.get("/api/recommendations")
 async def fetch_recommendations(user_id: int):
     """Generate product recommendations for a specific user."""
     try:
-        recommendations_list = get_recommendations(user_id)
+        recommendations_list = await services.recommendations(user_id)
         if recommendations_list is None:
             return JSONResponse(content={"error": "No recommendations available"}, status_code=404)
         return JSONResponse(content=recommendations_list)
+    except RecommenderNotReady:
+        return _not_ready_response()
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@router.get("/api/recommendations/stats")
+async def fetch_recommendation_stats():
+    """Fetch batch-size and queue-wait histograms of the recommendation micro-batcher."""
+    return JSONResponse(content=get_recommendation_batcher_stats())
+
+
+@router.get("/api/recommendations/cache")
+async def fetch_recommendation_cache_stats():
+    """Fetch hit/miss/eviction counters of the recommendation cache."""
+    return JSONResponse(content=get_recommendation_cache_stats())
+
+
+class RecommendationBatchRequest(BaseModel):
+    user_ids: Optional[List[int]] = None
+    category_ids: Optional[List[int]] = None  # only recommend products from these categories
+
+
+@router.post("/api/recommendations/batch")
+async def fetch_recommendations_batch(request: RecommendationBatchRequest):
+    """Generate product recommendations for many users at once, or for every user if no ids are given."""
+    if not is_ready():
+        return _not_ready_response()
+    try:
+        # one forward pass over up to every user, run off the event loop so other requests keep being served
+        recommendations = await asyncio.to_thread(get_recommendations_batch, request.user_ids, category_ids=request.category_ids)
+        return JSONResponse(content={str(user_id): products for user_id, products in recommendations.items()})
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
+@router.get("/api/models")
+async def fetch_models():
+    """Fetch the serving models, the model versions on disk and the state of the last reload."""
+    return JSONResponse(content=get_model_registry_stats())
+
+
+class ModelReloadRequest(BaseModel):
+    name: Optional[str] = None  # model file name without .zip, defaults to the pinned model
+    candidate: Optional[str] = None  # model served to candidate_share of the users for A/B tests
+    candidate_share: float = 0.0
+
+
+@router.post("/api/models/reload")
+async def reload_models(request: ModelReloadRequest):
+    """Load and warm up a model version in the background, then swap it in without interrupting requests."""
+    if not 0.0 <= request.candidate_share <= 1.0:
+        raise HTTPException(status_code=400, detail="candidate_share must be between 0 and 1")
+    # a reload checks the new model against the env's observation space, which is not loaded until the warm-up finishes
+    if not is_ready():
+        return _not_ready_response()
+    try:
+        reload_model(request.name, request.candidate, request.candidate_share)
+        return JSONResponse(content={"message": "Model reload started"}, status_code=202)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
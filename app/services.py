@@ -0,0 +1,116 @@
+# services.py
+
+from typing import Dict, List, Optional
+from app.src.spark.data.models import Customer, Product
+from app.src.spark.data.loader import (
+    load_product,
+    load_products,
+    load_category_products,
+    load_customer,
+    load_customers,
+    get_recommendations_async,
+    get_current_user,
+    RecommenderNotReady,
+)
+
+
+def _customer_data(customer: Customer) -> Dict:
+    return {
+        "id": int(customer.idx),
+        "zip_code": customer.zip_code,
+        "city": customer.city,
+        "state": customer.state,
+        "interactions": [
+            {
+                "id": interaction.idx,
+                "timestamp": interaction.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
+                "product_id": int(interaction.product_idx),
+                "type": interaction.type.value,
+                "value": f"{interaction.value:.2f}" if interaction.value is not None else "N/A",
+                "review_score": interaction.review_score if interaction.review_score is not None else "N/A",
+            }
+            for interaction in customer.interactions
+        ],
+    }
+
+
+def current_user() -> int:
+    """Fetch the current user ID."""
+    return get_current_user()
+
+
+def user(user_id: int) -> Optional[Dict]:
+    """Fetch user profile and interaction history, or None if the user does not exist."""
+    customer = load_customer(user_id)
+    return _customer_data(customer) if customer else None
+
+
+def users() -> List[Dict]:
+    """Fetch all users and their interaction history."""
+    return [_customer_data(customer) for customer in load_customers()]
+
+
+def product(product_id: int) -> Optional[Dict]:
+    """Fetch a specific product by its ID, or None if the product does not exist."""
+    product = load_product(product_id)
+    if not product:
+        return None
+
+    return {
+        "id": int(product.idx),
+        "name": product.name,
+        "price": f"{product.price:.2f}",
+        "desc": product.desc,
+        "long_desc": product.long_desc,
+        "image": "product_image.png",
+        "category": {"id": product.category.idx, "name": product.category.name, "desc": product.category.desc} if product.category else None,
+    }
+
+
+def products() -> List[Dict]:
+    """Fetch all products available in the catalog."""
+    return [
+        {
+            "id": p.idx,
+            "name": p.name,
+            "price": f"{p.price:.2f}",
+            "desc": p.desc,
+            "image": f"{p.category.name}.jpeg" if p.category else "product_image.png",
+            "category": {"id": p.category.idx, "name": p.category.name, "desc": p.category.desc} if p.category else None,
+        }
+        for p in load_products()
+    ]
+
+
+def catalogue(category_id: Optional[int] = None) -> List[Dict]:
+    """Fetch products by category if category_id is specified, otherwise all products."""
+    # Filter products based on the category_id if provided
+    filtered_products: List[Product] = load_category_products(category_id) if category_id else load_products()
+
+    return [
+        {
+            "cat_id": p.category.idx if p.category else None,
+            "id": p.idx,
+            "name": p.name,
+            "price": f"{p.price:.2f}",
+            "desc": p.desc,
+            "image": f"{p.category.name}.jpeg" if p.category else "default.jpeg",
+        }
+        for p in filtered_products
+    ]
+
+
+async def recommendations(user_id: int) -> Optional[List[Dict]]:
+    """Generate product recommendations for a specific user, or None if none are available.
+
+    Raises RecommenderNotReady while the model is still loading.
+    """
+    return await get_recommendations_async(user_id)
+
+
+async def page_recommendations(user_id: int) -> Optional[List[Dict]]:
+    """Recommendations for rendering a page, None while the model is still loading so the page renders without them."""
+    try:
+        return await recommendations(user_id)
+    except RecommenderNotReady:
+        return None
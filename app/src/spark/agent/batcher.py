@@ -0,0 +1,127 @@
+# batcher.py
+
+import time
+import queue
+import asyncio
+import threading
+import traceback
+from bisect import bisect_left
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+_STOP = object()
+
+
+class Histogram:
+    """Fixed-bucket histogram; each value is counted in the first bucket whose upper bound is >= value."""
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = list(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last bucket is +inf
+        self.total = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.counts[bisect_left(self.bounds, value)] += 1
+            self.total += 1
+            self.sum += value
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            buckets = {f"le_{bound:g}": count for bound, count in zip(self.bounds, self.counts)}
+            buckets["le_inf"] = self.counts[-1]
+            return {"count": self.total, "mean": self.sum / self.total if self.total else 0.0, "buckets": buckets}
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-item requests into batched calls on a dedicated worker thread.
+
+    Requests arriving within max_wait seconds of the first queued request, up to max_batch_size,
+    are passed together to batch_fn, which must return one result per item in the same order.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 64, max_wait: float = 0.002, name: str = "micro-batcher"):
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256])
+        self.queue_wait_ms = Histogram([0.1, 0.5, 1, 2, 5, 10, 25, 50, 100, 250])
+
+        self._queue: queue.Queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue an item and return a future resolved with its result."""
+        future = Future()
+        self._queue.put((item, future, time.perf_counter()))
+        return future
+
+    async def infer(self, item: Any) -> Any:
+        """Queue an item and await its result without blocking the event loop."""
+        return await asyncio.wrap_future(self.submit(item))
+
+    def depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict:
+        return {
+            "depth": self.depth(),
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_wait_ms": self.queue_wait_ms.snapshot(),
+        }
+
+    def close(self, timeout: Optional[float] = None):
+        self._queue.put(_STOP)
+        self._thread.join(timeout=timeout)
+
+    def _collect(self, first) -> Tuple[List, bool]:
+        batch = [first]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is _STOP:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run_batch(self, batch: List):
+        started = time.perf_counter()
+        for _, _, enqueued in batch:
+            self.queue_wait_ms.observe((started - enqueued) * 1000)
+        self.batch_sizes.observe(len(batch))
+
+        # skip requests whose caller has already gone away
+        batch = [request for request in batch if request[1].set_running_or_notify_cancel()]
+        if not batch:
+            return
+
+        try:
+            results = self.batch_fn([item for item, _, _ in batch])
+        except Exception as e:
+            tb = traceback.format_exc()
+            print(f"Error running batch of {len(batch)}: {e}\n{tb}")
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            future.set_result(result)
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            request = self._queue.get()
+            if request is _STOP:
+                break
+            batch, stopped = self._collect(request)
+            self._run_batch(batch)
@@ -1,41 +1,84 @@
 # environment.py
 
 import gymnasium as gym
-from gym import spaces
+from gymnasium import spaces
 import numpy as np
 import random
+import itertools
 from datetime import datetime
-from typing import List
-from app.src.spark.data.models import Customer, Product, Category, Interaction, InteractionType
-from app.src.spark import utils
+from typing import Dict, List, Optional
+from app.src.spark.data.models import Customer, Product, Category, Interaction, InteractionBatch, InteractionType, TYPE_CODES
+
+OBSERVATION_MODES = ('dense', 'compact')
+
+# interaction types by index in InteractionType, flagging the ones that touch a product
+PRODUCT_TYPES = np.array([t in (InteractionType.VIEW, InteractionType.LIKE, InteractionType.BUY, InteractionType.RATE) for t in InteractionType])
+RATE_TYPE = TYPE_CODES[InteractionType.RATE]
+
+# arrays making up the env's numeric state, see RecommendationEnv.state_arrays
+STATE_ARRAYS = ('views', 'likes', 'buys', 'ratings', 'product_prefs', 'category_prefs', 'product_categories', 'category_members', 'category_sizes')
 
 class RecommendationEnv(gym.Env):
-    def __init__(self, users:List[Customer], products:List[Product], categories:List[Category], top_k:int):
+    def __init__(self, users:List[Customer], products:List[Product], categories:List[Category], top_k:int, observation_mode:str='dense', top_n:int=32,
+                 state:Optional[Dict[str, np.ndarray]]=None):
+        """
+        state: arrays from state_arrays() of an env over the same users, products and categories, used as they are
+        instead of counting the users' interactions (e.g. memory-mapped by shared_state.SharedEnvState)
+        """
         super().__init__()
         
+        if observation_mode not in OBSERVATION_MODES:
+            raise ValueError(f"Unknown observation mode {observation_mode!r}, expected one of {OBSERVATION_MODES}")
+        
         self.users = users                  # list of users as states
         self.products = products            # products as actions, potential recommendations
         self.categories = categories
         self.top_k = top_k                  # number of recommendations
+        self.observation_mode = observation_mode    # 'dense' vectors over the catalog, or 'compact' top_n interacted products
+        self.top_n = top_n                  # number of interacted products in a compact observation
         self.user_idx = 0                   # index of users list, not user_id
         self.current_step = 0               # step is also the interactions list index
+        self.state_versions = {}            # user idx -> version, bumped whenever the user's counters change
+        
+        # contiguous (num_users, num_products) counter matrices owned by the env, each user's counters are row views
+        if state is None:
+            self.views = np.zeros((len(users), len(products)), dtype=np.int16)
+            self.likes = np.zeros((len(users), len(products)), dtype=np.int16)
+            self.buys = np.zeros((len(users), len(products)), dtype=np.int16)
+            self.ratings = np.zeros((len(users), len(products)), dtype=np.int16)
+        else:
+            for name in STATE_ARRAYS:
+                setattr(self, name, state[name])
+        self.user_rows = {}                 # user idx -> row in the counter matrices
         
-        for user in users:
-            user.views = np.zeros(len(products), dtype=np.int16)
-            user.likes = np.zeros(len(products), dtype=np.int16)
-            user.buys = np.zeros(len(products), dtype=np.int16)
-            user.ratings = np.zeros(len(products), dtype=np.int16)
-            for interaction in user.interactions:
-                i_type = interaction.type.value    
-                product_idx = interaction.product_idx  
-                if i_type == InteractionType.VIEW.value:
-                    user.views[product_idx] += 1
-                elif i_type == InteractionType.LIKE.value:
-                    user.likes[product_idx] += 1
-                elif i_type == InteractionType.BUY.value:
-                    user.buys[product_idx] += 1
-                elif i_type == InteractionType.RATE.value:
-                    user.ratings[product_idx] = interaction.value
+        for row, user in enumerate(users):
+            self.user_rows[user.idx] = row
+            user.views = self.views[row]
+            user.likes = self.likes[row]
+            user.buys = self.buys[row]
+            user.ratings = self.ratings[row]
+                    
+        if state is None:
+            self._count_interactions(users)
+            
+            # product -> category index, and per category its products in ascending order padded with -1
+            self.product_categories = np.array([product.category.idx for product in products], dtype=np.int64)
+            self.category_sizes = np.bincount(self.product_categories, minlength=len(categories))
+            self.category_members = np.full((len(categories), max(self.category_sizes.max(initial=0), 1)), -1, dtype=np.int64)
+            order = np.argsort(self.product_categories, kind='stable')
+            self.category_members[self.product_categories[order], np.arange(len(order)) - np.repeat(np.cumsum(self.category_sizes) - self.category_sizes, self.category_sizes)] = order
+            
+            # cached preferences per user row, kept in step with the counters by _refresh_preferences
+            self._recompute_preferences()
+        
+        # per user row the products with any interaction, so compact observations never scan the catalog
+        self._index_interacted_products()
+        
+        # one-hot buffers reused by every single-user observation
+        self._no_product = np.zeros(len(products), dtype=np.int16)
+        self._no_product.setflags(write=False)
+        self._product_one_hot = np.zeros(len(products), dtype=np.uint8)
+        self._interaction_one_hot = np.zeros(len(InteractionType), dtype=np.uint8)
                     
         # define action space to return top_k recommended product ids.    
         self.action_space = spaces.MultiDiscrete([len(products)] * top_k) 
@@ -45,6 +88,10 @@ class RecommendationEnv(gym.Env):
         # Users list will keep track of unique users
         # States include subset of features including product, interaction, ratings, and time in one-hot-encoding format
         # States exclude user_ids for policy network generalisation. But internal users list will be used as reference        
+        if observation_mode == 'compact':
+            self.observation_space = self._compact_observation_space()
+            return
+        
         self.observation_space = spaces.Dict({
             'pref_prod': spaces.Box(low=0, high=1, shape=(len(self.products),), dtype=np.float32),
             'pref_cat': spaces.Box(low=0, high=1, shape=(len(self.categories),), dtype=np.float32),
@@ -56,6 +103,22 @@ class RecommendationEnv(gym.Env):
             'interaction': spaces.Box(low=0, high=1, shape=(len(list(InteractionType)),), dtype=np.uint8),
             'rating': spaces.Discrete(6)
             }) 
+    
+    def _compact_observation_space(self):
+        """
+        Observation sized by top_n instead of the catalog. Products are indices, len(products) marks an empty slot
+        or no product, item_stats rows are views, likes, buys, rating and preference of the product in the same items slot.
+        Use with agent.features.CompactFeaturesExtractor.
+        """
+        num_products = len(self.products)
+        return spaces.Dict({
+            'items': spaces.Box(low=0, high=num_products, shape=(self.top_n,), dtype=np.int64),
+            'item_stats': spaces.Box(low=-np.inf, high=np.inf, shape=(self.top_n, 5), dtype=np.float32),
+            'pref_cat': spaces.Box(low=0, high=1, shape=(len(self.categories),), dtype=np.float32),
+            'product': spaces.Box(low=0, high=num_products, shape=(1,), dtype=np.int64),
+            'interaction': spaces.Box(low=0, high=1, shape=(len(list(InteractionType)),), dtype=np.uint8),
+            'rating': spaces.Discrete(6)
+            })
         
         
     def reset(self, seed=None, options=None):
@@ -120,13 +183,25 @@ class RecommendationEnv(gym.Env):
             user.buys[interaction.product_idx] += 1
         elif interaction.type == InteractionType.RATE:
             user.ratings[interaction.product_idx] = interaction.value
+        
+        if interaction.type in (InteractionType.VIEW, InteractionType.LIKE, InteractionType.BUY, InteractionType.RATE):
+            self._refresh_preference(self.user_rows[user.idx], interaction.product_idx)
+            self.bump_state_version(user)
             
-        product_obs = np.zeros(len(self.products), dtype=np.int16)
+        return self._build_observation(user, interaction)
+    
+    def _build_observation(self, user:Customer, interaction:Interaction):
+        """ observation for the user after the interaction, without changing the user's counters """
+        if self.observation_mode == 'compact':
+            return self._compact_observation(user, interaction)
+        
+        # the one-hot arrays are shared buffers, valid until the next observation is built
+        product_obs = self._no_product
         if interaction.type == InteractionType.VIEW \
             or interaction.type == InteractionType.LIKE  \
             or interaction.type == InteractionType.BUY \
             or interaction.type == InteractionType.RATE:
-                product_obs = utils.one_hot_encode(interaction.product_idx, len(self.products))
+                product_obs = self._one_hot(self._product_one_hot, interaction.product_idx)
         
         # update observation based on new data  
         obs = {
@@ -145,8 +220,78 @@ class RecommendationEnv(gym.Env):
     
     def update_observation(self, user:Customer, interaction:Interaction):
         return self._update_observation(user, interaction)
+    
+    def _count_interactions(self, users:List[Customer]):
+        """Fill the counter matrices from the users' interactions: views, likes and buys counted, the latest rating kept."""
+        batches = [user.interactions for user in users]
+        records = InteractionBatch.concat(batches).records
+        rows = np.repeat(np.arange(len(users)), [len(batch) for batch in batches])
+        products = records['product_idx']
+        
+        for counter, inter_type in ((self.views, InteractionType.VIEW), (self.likes, InteractionType.LIKE), (self.buys, InteractionType.BUY)):
+            selected = records['type'] == TYPE_CODES[inter_type]
+            np.add.at(counter, (rows[selected], products[selected]), 1)
+        
+        # a later rating of a product replaces the user's earlier ones, so keep the last of each (row, product)
+        rated = np.flatnonzero(records['type'] == RATE_TYPE)[::-1]
+        _, latest = np.unique(rows[rated] * self.ratings.shape[1] + products[rated], return_index=True)
+        rated = rated[latest]
+        self.ratings[rows[rated], products[rated]] = records['value'][rated]
+    
+    def state_arrays(self):
+        """ the env's counters, cached preferences and product -> category lookups, enough to rebuild it with state= """
+        return {name: getattr(self, name) for name in STATE_ARRAYS}
+    
+    def get_user(self, user_idx:int):
+        """ user with the given idx (user_id), or None """
+        row = self.user_rows.get(user_idx)
+        return self.users[row] if row is not None else None
+    
+    def get_state_version(self, user:Customer):
+        return self.state_versions.get(user.idx, 0)
+    
+    def bump_state_version(self, user:Customer):
+        self.state_versions[user.idx] = self.state_versions.get(user.idx, 0) + 1
+    
+    def get_observations(self, users:List[Customer], interactions:List[Interaction]):
+        """ stack the observations of several users into one batched observation dict, keys shaped (n, ...) """
+        rows = np.array([self.user_rows[user.idx] for user in users], dtype=np.int64)
+        if self.observation_mode == 'compact':
+            return self._compact_observations(rows, *self._interaction_arrays(interactions))
+        
+        buys = self.buys[rows]
+        views = self.views[rows]
+        likes = self.likes[rows]
+        ratings = self.ratings[rows]
+        product_prefs = self.product_prefs[rows]
+        cat_prefs = self.category_prefs[rows]
+        
+        product_obs = np.zeros((len(users), len(self.products)), dtype=np.uint8)
+        interaction_obs = np.zeros((len(users), len(InteractionType)), dtype=np.uint8)
+        rating_obs = np.zeros(len(users), dtype=np.int64)
+        for row, interaction in enumerate(interactions):
+            if interaction.type in (InteractionType.VIEW, InteractionType.LIKE, InteractionType.BUY, InteractionType.RATE) \
+                and interaction.product_idx < len(self.products):
+                    product_obs[row, interaction.product_idx] = 1
+            interaction_obs[row, TYPE_CODES[interaction.type]] = 1
+            if interaction.type == InteractionType.RATE:
+                rating_obs[row] = interaction.value
+        
+        return {
+                'pref_prod': product_prefs,
+                'pref_cat': cat_prefs,
+                'buys': buys,
+                'views': views,
+                'likes': likes,
+                'ratings': ratings,
+                'product': product_obs,
+                'interaction': interaction_obs,
+                'rating': rating_obs
+            }
 
     def _get_observation(self, user:Customer): 
+        if self.observation_mode == 'compact':
+            return self._compact_observation(user)
         
         obs = {
                 'pref_prod': self._get_product_preferences(user),
@@ -162,19 +307,144 @@ class RecommendationEnv(gym.Env):
         
         return obs
         
+    def _compact_observation(self, user:Customer, interaction:Interaction=None):
+        """ compact observation of a single user, optionally after an interaction """
+        interactions = self._interaction_arrays([interaction]) if interaction else (None, None, None)
+        obs = self._compact_observations(np.array([self.user_rows[user.idx]]), *interactions)
+        
+        obs = {key: value[0] for key, value in obs.items()}
+        obs['rating'] = int(obs['rating'])
+        return obs
+    
+    def _interaction_arrays(self, interactions:List[Interaction]):
+        """ product index, interaction type index and rating per interaction """
+        products = np.array([interaction.product_idx for interaction in interactions], dtype=np.int64)
+        types = np.array([TYPE_CODES[interaction.type] for interaction in interactions], dtype=np.int64)
+        ratings = np.array([interaction.value if interaction.type == InteractionType.RATE else 0 for interaction in interactions], dtype=np.int64)
+        return products, types, ratings
+    
+    def _compact_observations(self, rows, products=None, types=None, ratings=None):
+        """
+        batched compact observations for the users at rows of the counter matrices. After one scan of the counters
+        everything is gathered for the users' interacted products only, ranked by number of interactions
+        (ties by product index) and cut to top_n.
+        """
+        num_users = len(rows)
+        num_products = len(self.products)
+        user_products = [self.interacted_products[row] for row in rows]
+        counts = np.fromiter(map(len, user_products), dtype=np.int64, count=num_users)
+        user_pos = np.repeat(np.arange(num_users), counts)
+        product_idx = np.fromiter(itertools.chain.from_iterable(user_products), dtype=np.int64, count=counts.sum())
+        
+        # a product rated 0 after its only interaction has no activity left
+        user_rows = rows[user_pos]
+        activity = self.views[user_rows, product_idx] + self.likes[user_rows, product_idx] + self.buys[user_rows, product_idx] \
+            + (self.ratings[user_rows, product_idx] > 0)
+        active = activity > 0
+        user_pos, product_idx, user_rows, activity = user_pos[active], product_idx[active], user_rows[active], activity[active]
+        item_views = self.views[user_rows, product_idx]
+        item_likes = self.likes[user_rows, product_idx]
+        item_buys = self.buys[user_rows, product_idx]
+        item_ratings = self.ratings[user_rows, product_idx]
+        item_prefs = self.product_prefs[user_rows, product_idx]
+        cat_prefs = self.category_prefs[rows]
+        
+        # rank each user's products by activity, keep the first top_n
+        order = np.lexsort((product_idx, -activity, user_pos))
+        user_pos, product_idx = user_pos[order], product_idx[order]
+        rank = np.arange(len(order)) - np.searchsorted(user_pos, user_pos)
+        keep = rank < self.top_n
+        
+        items = np.full((num_users, self.top_n), num_products, dtype=np.int64)
+        items[user_pos[keep], rank[keep]] = product_idx[keep]
+        item_stats = np.zeros((num_users, self.top_n, 5), dtype=np.float32)
+        item_stats[user_pos[keep], rank[keep]] = np.stack([item_views, item_likes, item_buys, item_ratings, item_prefs], axis=1)[order][keep]
+        
+        product_obs = np.full((num_users, 1), num_products, dtype=np.int64)
+        interaction_obs = np.zeros((num_users, len(InteractionType)), dtype=np.uint8)
+        rating_obs = np.zeros(num_users, dtype=np.int64)
+        if types is not None:
+            touched = PRODUCT_TYPES[types] & (products < num_products)
+            product_obs[touched, 0] = products[touched]
+            interaction_obs[np.arange(num_users), types] = 1
+            rating_obs = np.where(types == RATE_TYPE, ratings, 0)
+        
+        return {
+                'items': items,
+                'item_stats': item_stats,
+                'pref_cat': cat_prefs,
+                'product': product_obs,
+                'interaction': interaction_obs,
+                'rating': rating_obs
+            }
+    
     def _get_interaction_observation(self, interaction:Interaction):
-        idx = list(InteractionType).index(interaction.type)
-        size = len(InteractionType)
+        return self._one_hot(self._interaction_one_hot, TYPE_CODES[interaction.type])
+    
+    @staticmethod
+    def _one_hot(buffer, index):
+        """ same values as utils.one_hot_encode, written into a reused buffer """
+        buffer[:] = 0
+        if index < len(buffer):
+            buffer[index] = 1
+        return buffer
+    
+    def _recompute_preferences(self):
+        """ rebuild the cached preferences of all users from the counters, needed after writing the counters directly """
+        self.product_prefs = self._product_preferences(self.views, self.buys, self.likes, self.ratings)
+        positive_prefs = np.where(self.product_prefs > 0, self.product_prefs, 0)
+        category_bins = (np.arange(len(self.users))[:, None] * len(self.categories) + self.product_categories).ravel()
+        self.category_prefs = np.bincount(category_bins, weights=positive_prefs.ravel(), minlength=len(self.users) * len(self.categories)) \
+            .reshape(len(self.users), len(self.categories)).astype(np.float32) / 5
+    
+    def _index_interacted_products(self):
+        """ rebuild interacted_products from the counters, needed after writing the counters directly """
+        user_pos, product_idx = np.nonzero((self.views != 0) | (self.likes != 0) | (self.buys != 0) | (self.ratings != 0))
+        splits = np.searchsorted(user_pos, np.arange(1, len(self.users)))
+        self.interacted_products = [set(products.tolist()) for products in np.split(product_idx, splits)]
+    
+    def _refresh_preferences(self, rows, products):
+        """
+        update the cached preferences after the counters of (rows[i], products[i]) changed. Each product preference is
+        recomputed from its counters, each touched category from its members with a sequential cumsum, which adds in
+        the same order as the bincount over the whole catalog so results stay bit-identical to a full recompute.
+        """
+        for row, product_idx in zip(rows.tolist(), products.tolist()):
+            self.interacted_products[row].add(product_idx)
+        self.product_prefs[rows, products] = self._product_preferences(self.views[rows, products], self.buys[rows, products],
+                                                                       self.likes[rows, products], self.ratings[rows, products])
         
-        return utils.one_hot_encode(idx, size)
+        rows, categories = np.unique(np.stack([rows, self.product_categories[products]]), axis=1)
+        members = self.category_members[categories]
+        member_prefs = self.product_prefs[rows[:, None], members]
+        member_prefs = np.where((members >= 0) & (member_prefs > 0), member_prefs, 0)
+        self.category_prefs[rows, categories] = np.cumsum(member_prefs, axis=1)[:, -1].astype(np.float32) / 5
+    
+    def _refresh_preference(self, row:int, product_idx:int):
+        """ _refresh_preferences for a single (row, product) """
+        self.interacted_products[row].add(product_idx)
+        # same float64 operations in the same order as _product_preferences
+        rating = int(self.ratings[row, product_idx])
+        product_prefs = self.product_prefs[row]
+        product_prefs[product_idx] = int(self.views[row, product_idx]) / 20 + int(self.buys[row, product_idx]) \
+            + int(self.likes[row, product_idx]) / 15 + (rating - 2 if rating > 0 else rating)
+        
+        category = self.product_categories[product_idx]
+        member_prefs = product_prefs[self.category_members[category, :self.category_sizes[category]]]
+        self.category_prefs[row, category] = np.cumsum(np.where(member_prefs > 0, member_prefs, 0))[-1].astype(np.float32) / 5
     
     # calculate preferences based on past interactions
     def _get_product_preferences(self, user:Customer):
-        view_prefs = user.views / 20
-        purchase_prefs = user.buys
-        like_prefs = user.likes / 15
+        return self.product_prefs[self.user_rows[user.idx]].copy()
+    
+    @staticmethod
+    def _product_preferences(views, buys, likes, ratings):
+        """ preference per product from interaction counters, for one user (P,) or a batch of users (N, P) """
+        view_prefs = views / 20
+        purchase_prefs = buys
+        like_prefs = likes / 15
 
-        rating_prefs = user.ratings.copy()
+        rating_prefs = ratings.copy()
         rating_prefs[rating_prefs > 0] -= 2
         
         product_prefs = view_prefs + purchase_prefs + like_prefs+ rating_prefs
@@ -183,16 +453,13 @@ class RecommendationEnv(gym.Env):
         
         return product_prefs    # calculate preferences based on past interactions
     
-    def _get_category_preferences(self, user:Customer):
-        prod_prefs = self._get_product_preferences(user)
-        cat_prefs = np.zeros(len(self.categories), np.float32)
-        
-        for idx, prod_pref in enumerate(prod_prefs):
-            if prod_pref > 0:
-                product = self.products[idx]
-                cat_idx = product.category.idx
-                cat_prefs[cat_idx] += prod_pref # accumulation of fav products for this cat
-                # print(f"added pf {prod_pref} to cat {cat_idx}")
+    def _get_category_preferences(self, user:Customer, product_prefs=None):
+        if product_prefs is None:
+            return self.category_prefs[self.user_rows[user.idx]].copy()
+        
+        # accumulation of fav products per category, only positive preferences count
+        positive_prefs = np.where(product_prefs > 0, product_prefs, 0)
+        cat_prefs = np.bincount(self.product_categories, weights=positive_prefs, minlength=len(self.categories)).astype(np.float32)
                 
         cat_prefs = cat_prefs / 5 # reduce space     
            
@@ -220,7 +487,7 @@ class RecommendationEnv(gym.Env):
     
         # Ensure the probabilities sum to 1 for a valid probability distribution
         if np.max(prod_scores) > 0: # probability selection based on prefernces
-            product_probs = np.array(prod_scores) / sum(prod_scores)
+            product_probs = np.array(prod_scores) / prod_scores.sum(dtype=np.float64) # uint8 sum would wrap around
 
         # Randomly select a product based on the defined probabilities
         selected_product_id = np.random.choice(product_ids, p=product_probs)
@@ -0,0 +1,145 @@
+# export.py
+#
+# Export the actor of a trained model to NumPy weights for serving without stable-baselines3 or torch:
+#
+#   python -m app.src.spark.agent.export app/src/spark/agent/models/a2c_recommender.zip
+#
+# writes app/src/spark/agent/models/a2c_recommender_numpy.npz next to it and checks it against model.predict.
+
+import os
+import json
+import argparse
+import numpy as np
+from typing import Dict
+from torch import nn
+from gymnasium import spaces
+import stable_baselines3
+from stable_baselines3.common.base_class import BaseAlgorithm
+from stable_baselines3.common.torch_layers import CombinedExtractor
+from app.src.spark.agent.features import CompactFeaturesExtractor
+from app.src.spark.agent.inference import NumpyPolicy
+from app.src.spark.agent.registry import ALGORITHMS
+
+ACTIVATION_NAMES = {nn.Tanh: "tanh", nn.ReLU: "relu", nn.Identity: "identity"}
+
+
+def _space_spec(space: spaces.Space) -> Dict:
+    if isinstance(space, spaces.Discrete):
+        return {"n": int(space.n)}
+    if isinstance(space, spaces.Box):
+        return {"shape": list(space.shape)}
+    raise ValueError(f"Cannot export policies over {type(space).__name__} observations")
+
+
+def policy_weights(model: BaseAlgorithm) -> Dict[str, np.ndarray]:
+    """The actor of a MultiInputPolicy with a MultiDiscrete action space as NumPy arrays, in NumpyPolicy's format."""
+    policy = model.policy
+    extractor = policy.features_extractor if policy.share_features_extractor else policy.pi_features_extractor
+    if not isinstance(model.action_space, spaces.MultiDiscrete):
+        raise ValueError("Only MultiDiscrete action spaces can be exported")
+
+    weights = {}
+    if isinstance(extractor, CompactFeaturesExtractor):
+        features = "compact"
+        weights["embedding.weight"] = extractor.embedding.weight
+        weights["item_net.weight"] = extractor.item_net[0].weight
+        weights["item_net.bias"] = extractor.item_net[0].bias
+    elif isinstance(extractor, CombinedExtractor) and all(isinstance(module, nn.Flatten) for module in extractor.extractors.values()):
+        features = "flatten"
+    else:
+        raise ValueError(f"Cannot export features extractor {type(extractor).__name__}")
+
+    # policy_net alternates Linear layers and activations
+    activations = []
+    for module in policy.mlp_extractor.policy_net:
+        if isinstance(module, nn.Linear):
+            weights[f"policy_net.{len(activations)}.weight"] = module.weight
+            weights[f"policy_net.{len(activations)}.bias"] = module.bias
+            activations.append("identity")
+        elif type(module) in ACTIVATION_NAMES and activations and activations[-1] == "identity":
+            activations[-1] = ACTIVATION_NAMES[type(module)]
+        else:
+            raise ValueError(f"Cannot export policy_net layer {module}")
+    weights["action_net.weight"] = policy.action_net.weight
+    weights["action_net.bias"] = policy.action_net.bias
+
+    meta = {
+        "features": features,
+        "keys": sorted(model.observation_space.spaces),
+        "spaces": {key: _space_spec(space) for key, space in model.observation_space.spaces.items()},
+        "action_dims": [int(n) for n in model.action_space.nvec],
+        "activations": activations,
+        "algorithm": type(model).__name__.lower(),
+    }
+    arrays = {name: tensor.detach().cpu().numpy().astype(np.float32) for name, tensor in weights.items()}
+    arrays["meta"] = np.array(json.dumps(meta))
+    return arrays
+
+
+def export_policy(model: BaseAlgorithm, path: str) -> NumpyPolicy:
+    """Write the model's actor to an .npz file and return it loaded as a NumpyPolicy."""
+    np.savez(path, **policy_weights(model))
+    return NumpyPolicy.load(path)
+
+
+def check_parity(model: BaseAlgorithm, policy: NumpyPolicy, num_observations: int = 256, seed: int = 0, atol: float = 1e-3) -> Dict:
+    """Compare the exported policy with the model on random observations: log-probs and deterministic actions.
+
+    Actions that differ from model.predict only count as mismatches if the model rates the exported policy's
+    choice more than atol below its own; closer than that they are ties decided by float rounding.
+    """
+    import torch
+
+    observation_space = model.observation_space
+    observation_space.seed(seed)
+    samples = [observation_space.sample() for _ in range(num_observations)]
+    obs = {key: np.stack([sample[key] for sample in samples]) for key in samples[0]}
+
+    with torch.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(obs)
+        distribution = model.policy.get_distribution(obs_tensor)
+        expected_log_probs = torch.stack([slot.logits for slot in distribution.distribution], dim=1).cpu().numpy()
+    log_probs = np.stack(policy._slot_log_probs(policy.logits(obs)), axis=1)
+
+    expected_actions, _ = model.predict(obs, deterministic=True)
+    actions, _ = policy.predict(obs, deterministic=True)
+    gap = np.take_along_axis(expected_log_probs, expected_actions[..., None], axis=2) - np.take_along_axis(expected_log_probs, actions[..., None], axis=2)
+    return {
+        "observations": num_observations,
+        "max_log_prob_error": float(np.abs(log_probs - expected_log_probs).max()),
+        "action_agreement": float((actions == expected_actions).mean()),
+        "mismatches": int((gap[..., 0] > atol).sum()),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Export a trained recommender policy to NumPy weights.")
+    parser.add_argument("model", help="path to the stable-baselines3 .zip")
+    parser.add_argument("--algo", choices=ALGORITHMS, default=None, help="defaults to the model file name prefix")
+    parser.add_argument("--out", default=None, help="defaults to <model>_numpy.npz next to the model")
+    parser.add_argument("--parity-observations", type=int, default=256, help="random observations to check the export on, 0 to skip")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    stem = os.path.splitext(args.model)[0]
+    algorithm = args.algo or os.path.basename(stem).split("_", 1)[0].lower()
+    if algorithm not in ALGORITHMS:
+        raise SystemExit(f"Cannot tell the algorithm of {args.model}, pass --algo")
+
+    model = getattr(stable_baselines3, algorithm.upper()).load(args.model, device="cpu")
+    out = args.out or f"{stem}_numpy.npz"
+    policy = export_policy(model, out)
+    print(f"exported {args.model} to {out} ({os.path.getsize(out) / 2**20:.1f} MiB)")
+
+    if args.parity_observations > 0:
+        parity = check_parity(model, policy, args.parity_observations)
+        print(f"parity on {parity['observations']} observations: max log-prob error {parity['max_log_prob_error']:.2e}, "
+              f"action agreement {parity['action_agreement']:.2%}, {parity['mismatches']} mismatches beyond ties")
+        if parity["mismatches"]:
+            raise SystemExit("exported policy disagrees with model.predict")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,43 @@
+# features.py
+
+import torch
+from torch import nn
+from gymnasium import spaces
+from stable_baselines3.common.torch_layers import BaseFeaturesExtractor
+
+
+class CompactFeaturesExtractor(BaseFeaturesExtractor):
+    """
+    Features extractor for RecommendationEnv observations in 'compact' mode.
+
+    Every product id in 'items' and 'product' is looked up in a shared embedding table with a padding row
+    for empty slots. The item embeddings are concatenated with their stats, passed through a small layer
+    and mean-pooled over the non-empty slots. The policy input width depends on embed_dim, top_n and the
+    number of categories, but not on the number of products.
+
+    Use with MultiInputPolicy:
+        policy_kwargs=dict(features_extractor_class=CompactFeaturesExtractor, features_extractor_kwargs=dict(embed_dim=32))
+    """
+
+    def __init__(self, observation_space: spaces.Dict, embed_dim: int = 32):
+        num_stats = observation_space["item_stats"].shape[-1]
+        num_categories = observation_space["pref_cat"].shape[0]
+        num_interactions = observation_space["interaction"].shape[0]
+        num_ratings = observation_space["rating"].n
+        super().__init__(observation_space, features_dim=2 * embed_dim + num_categories + num_interactions + num_ratings)
+
+        self.num_products = int(observation_space["items"].high.max())  # also the padding index
+        self.embedding = nn.Embedding(self.num_products + 1, embed_dim, padding_idx=self.num_products)
+        self.item_net = nn.Sequential(nn.Linear(embed_dim + num_stats, embed_dim), nn.Tanh())
+
+    def forward(self, observations) -> torch.Tensor:
+        # stable-baselines3 casts Box observations to float and one-hot encodes the Discrete rating
+        items = observations["items"].long()
+        mask = (items != self.num_products).unsqueeze(-1).float()
+
+        item_features = self.item_net(torch.cat([self.embedding(items), observations["item_stats"]], dim=-1)) * mask
+        pooled = item_features.sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        product = self.embedding(observations["product"].long().flatten(1)[:, 0])
+        rating = observations["rating"].flatten(1)
+
+        return torch.cat([pooled, product, observations["pref_cat"], observations["interaction"], rating], dim=1)
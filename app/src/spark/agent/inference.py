@@ -0,0 +1,119 @@
+# inference.py
+
+import json
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+# activation functions the exporter knows how to write, by name
+ACTIVATIONS = {
+    "tanh": np.tanh,
+    "relu": lambda x: np.maximum(x, 0),
+    "identity": lambda x: x,
+}
+
+
+def logsumexp(x: np.ndarray, axis: int, keepdims: bool = False) -> np.ndarray:
+    peak = x.max(axis=axis, keepdims=True)
+    result = np.log(np.exp(x - peak).sum(axis=axis, keepdims=True)) + peak
+    return result if keepdims else result.squeeze(axis)
+
+
+class NumpyPolicy:
+    """
+    Actor of a MultiInputPolicy exported by export.py, evaluated with NumPy only.
+
+    Takes the observation dicts of RecommendationEnv, single or batched, and applies the same preprocessing
+    as stable-baselines3: Box observations cast to float32, Discrete ones one-hot encoded, and the keys in
+    the sorted order of the observation space. Supports the default flattening features extractor and
+    CompactFeaturesExtractor. The critic, optimizer state and rollout machinery are not exported.
+    """
+
+    def __init__(self, weights: Dict[str, np.ndarray]):
+        self.meta = json.loads(str(weights["meta"]))
+        self.features = self.meta["features"]
+        self.keys: List[str] = self.meta["keys"]
+        self.spaces: Dict[str, Dict] = self.meta["spaces"]
+        self.action_dims: List[int] = self.meta["action_dims"]
+        self.activations = [ACTIVATIONS[name] for name in self.meta["activations"]]
+
+        self.layers = [(weights[f"policy_net.{i}.weight"].T.copy(), weights[f"policy_net.{i}.bias"]) for i in range(len(self.activations))]
+        self.action_weight = weights["action_net.weight"].T.copy()
+        self.action_bias = weights["action_net.bias"]
+        if self.features == "compact":
+            self.embedding = weights["embedding.weight"]
+            self.item_weight = weights["item_net.weight"].T.copy()
+            self.item_bias = weights["item_net.bias"]
+            self.num_products = self.embedding.shape[0] - 1  # the last row is the padding row
+
+    @classmethod
+    def load(cls, path: str) -> "NumpyPolicy":
+        with np.load(path, allow_pickle=False) as weights:
+            return cls(dict(weights))
+
+    def matches(self, observation_space) -> bool:
+        """Whether observations from observation_space have the keys and shapes the policy was exported for."""
+        if sorted(observation_space.spaces) != self.keys:
+            return False
+        for key, space in observation_space.spaces.items():
+            spec = self.spaces[key]
+            if ("n" in spec) != hasattr(space, "n") or ("n" in spec and int(space.n) != spec["n"]):
+                return False
+            if "shape" in spec and list(space.shape) != spec["shape"]:
+                return False
+        return True
+
+    def _batch(self, observation: Dict) -> Tuple[Dict[str, np.ndarray], bool]:
+        """The observation with a leading batch axis, and whether it was a single observation."""
+        key = self.keys[0]
+        spec = self.spaces[key]
+        single = np.ndim(observation[key]) == (0 if "n" in spec else len(spec["shape"]))
+        if single:
+            return {key: np.asarray(value)[None] for key, value in observation.items()}, True
+        return {key: np.asarray(value) for key, value in observation.items()}, False
+
+    def _preprocess(self, key: str, value: np.ndarray) -> np.ndarray:
+        spec = self.spaces[key]
+        if "n" in spec:
+            return np.eye(spec["n"], dtype=np.float32)[value.reshape(len(value)).astype(np.int64)]
+        return value.reshape(len(value), -1).astype(np.float32, copy=False)
+
+    def _features(self, obs: Dict[str, np.ndarray]) -> np.ndarray:
+        if self.features == "flatten":
+            return np.concatenate([self._preprocess(key, obs[key]) for key in self.keys], axis=1)
+
+        # CompactFeaturesExtractor: masked mean of the item embeddings joined with their stats
+        items = obs["items"].astype(np.int64)
+        mask = (items != self.num_products)[..., None].astype(np.float32)
+        item_features = np.concatenate([self.embedding[items], obs["item_stats"].astype(np.float32)], axis=-1)
+        item_features = np.tanh(item_features @ self.item_weight + self.item_bias) * mask
+        pooled = item_features.sum(axis=1) / np.maximum(mask.sum(axis=1), 1)
+        product = self.embedding[obs["product"].reshape(len(items), -1)[:, 0].astype(np.int64)]
+        return np.concatenate([pooled, product, self._preprocess("pref_cat", obs["pref_cat"]),
+                               self._preprocess("interaction", obs["interaction"]), self._preprocess("rating", obs["rating"])], axis=1)
+
+    def logits(self, observation: Dict) -> np.ndarray:
+        """Unnormalized action logits, shaped (n, sum(action_dims)) for a batch."""
+        obs, _ = self._batch(observation)
+        latent = self._features(obs)
+        for (weight, bias), activation in zip(self.layers, self.activations):
+            latent = activation(latent @ weight + bias)
+        return latent @ self.action_weight + self.action_bias
+
+    def _slot_log_probs(self, logits: np.ndarray) -> List[np.ndarray]:
+        slots = np.split(logits, np.cumsum(self.action_dims)[:-1], axis=1)
+        return [slot - logsumexp(slot, axis=1, keepdims=True) for slot in slots]
+
+    def predict(self, observation: Dict, deterministic: bool = True, rng: Optional[np.random.Generator] = None) -> Tuple[np.ndarray, None]:
+        """Actions like BaseAlgorithm.predict: each slot's argmax, or a sample from it when not deterministic."""
+        obs, single = self._batch(observation)
+        slots = np.split(self.logits(obs), np.cumsum(self.action_dims)[:-1], axis=1)
+        if not deterministic:
+            rng = rng or np.random.default_rng()
+            slots = [slot + rng.gumbel(size=slot.shape) for slot in slots]  # Gumbel-max samples from softmax(slot)
+        actions = np.stack([slot.argmax(axis=1) for slot in slots], axis=1)
+        return (actions[0] if single else actions), None
+
+    def product_scores(self, observation: Dict) -> np.ndarray:
+        """Per-product scores as in ranking.product_scores, for policies whose slots all range over the products."""
+        obs, _ = self._batch(observation)
+        return logsumexp(np.stack(self._slot_log_probs(self.logits(obs)), axis=1), axis=1)
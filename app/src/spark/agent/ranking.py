@@ -0,0 +1,67 @@
+# ranking.py
+
+import numpy as np
+from typing import TYPE_CHECKING, Iterable, Optional, Union
+from app.src.spark.agent.environment import RecommendationEnv
+from app.src.spark.agent.inference import NumpyPolicy
+
+if TYPE_CHECKING:
+    from stable_baselines3.common.base_class import BaseAlgorithm
+
+
+def product_scores(model: Union["BaseAlgorithm", NumpyPolicy], obs) -> np.ndarray:
+    """Per-product scores from the policy for a batch of observations, shaped (n, num_products).
+
+    Each action slot is a categorical distribution over all products; a product's score is the log of its
+    summed probability over the slots, i.e. the expected number of slots that would pick it.
+    """
+    if isinstance(model, NumpyPolicy):
+        return model.product_scores(obs)
+
+    # torch is only imported for stable-baselines3 models, NumPy policies serve without it
+    import torch
+
+    with torch.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(obs)
+        distribution = model.policy.get_distribution(obs_tensor)
+        slot_log_probs = torch.stack([slot.logits for slot in distribution.distribution], dim=1)
+        return torch.logsumexp(slot_log_probs, dim=1).cpu().numpy()
+
+
+def recommendation_mask(env: RecommendationEnv, rows: np.ndarray, exclude_purchased: bool = True,
+                        unavailable: Optional[Iterable[int]] = None, categories: Optional[Iterable[int]] = None) -> np.ndarray:
+    """Boolean (len(rows), num_products) mask of products that may be recommended to the users at rows of the env."""
+    mask = np.ones((len(rows), len(env.products)), dtype=bool)
+    if exclude_purchased:
+        mask &= env.buys[rows] == 0
+    if unavailable:
+        mask[:, np.fromiter(unavailable, dtype=np.int64)] = False
+    if categories is not None:
+        mask &= np.isin(env.product_categories, np.fromiter(categories, dtype=np.int64))
+    return mask
+
+
+def top_k_batch(scores: np.ndarray, k: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """Indices of the k highest-scoring allowed products per row, best first, shaped (n, k).
+
+    Selection is O(num_products) per row with argpartition, only the k winners are sorted.
+    Rows with fewer than k allowed products are padded with -1.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+
+    num_products = scores.shape[1]
+    k_available = min(k, num_products)
+    top = np.argpartition(-scores, k_available - 1, axis=1)[:, :k_available]
+    top = np.take_along_axis(top, np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable"), axis=1)
+    top[np.isneginf(np.take_along_axis(scores, top, axis=1))] = -1
+
+    if k_available < k:
+        top = np.hstack([top, np.full((len(top), k - k_available), -1, dtype=top.dtype)])
+    return top
+
+
+def top_k(scores: np.ndarray, k: int, mask: Optional[np.ndarray] = None) -> np.ndarray:
+    """top_k_batch for a single row of scores."""
+    return top_k_batch(scores[None, :], k, None if mask is None else mask[None, :])[0]
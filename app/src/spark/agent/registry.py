@@ -0,0 +1,280 @@
+# registry.py
+
+import os
+import json
+import zlib
+import hashlib
+import threading
+import traceback
+import numpy as np
+from datetime import datetime
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from app.src.spark.agent.inference import NumpyPolicy
+
+# algorithm by model file prefix, as saved by train.py: <algo>_recommender.zip, <algo>_recommender_<steps>_steps.zip
+ALGORITHMS = ("ppo", "a2c")
+
+# stable-baselines3 models, and policies exported to NumPy weights by export.py
+MODEL_EXTENSIONS = (".zip", ".npz")
+
+# file in the model directory naming the model to serve, written only when a model is activated by name
+MANIFEST_NAME = "serving.json"
+
+
+class ModelVersion:
+    """A model file in the registry directory, identified by the sha256 of its contents."""
+
+    def __init__(self, name: str, path: str, algorithm: str, sha256: str, size: int, modified: float):
+        self.name = name
+        self.path = path
+        self.algorithm = algorithm
+        self.sha256 = sha256
+        self.size = size
+        self.modified = modified
+
+    @property
+    def version(self) -> str:
+        return self.sha256[:12]
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "algorithm": self.algorithm,
+            "version": self.version,
+            "sha256": self.sha256,
+            "size": self.size,
+            "modified": datetime.fromtimestamp(self.modified).isoformat(),
+        }
+
+
+class LoadedModel:
+    """A registry version together with its deserialized stable-baselines3 model or NumpyPolicy."""
+
+    def __init__(self, version: ModelVersion, model: Any):
+        self.version = version
+        self.model = model
+
+
+class ServingModels:
+    """The models requests are served with: a primary and optionally a candidate taking a share of the users.
+
+    Never modified once built; the registry swaps in a new instance, so a request that took a reference keeps
+    using the same models until it finishes.
+    """
+
+    def __init__(self, primary: LoadedModel, candidate: Optional[LoadedModel] = None, candidate_share: float = 0.0):
+        self.primary = primary
+        self.candidate = candidate if candidate_share > 0 else None
+        self.candidate_share = candidate_share if candidate is not None else 0.0
+
+    def model_for(self, user_id: int) -> LoadedModel:
+        """The model serving a user, users always land in the same bucket of the split."""
+        if self.candidate is not None and ab_bucket(user_id) < self.candidate_share:
+            return self.candidate
+        return self.primary
+
+    def assign(self, user_ids: List[int]) -> List[Tuple[LoadedModel, np.ndarray]]:
+        """Group positions in user_ids by the model serving them."""
+        if self.candidate is None:
+            return [(self.primary, np.arange(len(user_ids)))]
+        on_candidate = np.array([ab_bucket(user_id) < self.candidate_share for user_id in user_ids], dtype=bool)
+        groups = [(self.primary, np.flatnonzero(~on_candidate)), (self.candidate, np.flatnonzero(on_candidate))]
+        return [(loaded, positions) for loaded, positions in groups if len(positions)]
+
+    def to_dict(self) -> Dict:
+        return {
+            "primary": self.primary.version.to_dict(),
+            "candidate": self.candidate.version.to_dict() if self.candidate is not None else None,
+            "candidate_share": self.candidate_share,
+        }
+
+
+def ab_bucket(user_id: int) -> float:
+    """Stable position of a user in [0, 1) for traffic splitting, the same in every worker process."""
+    return zlib.crc32(int(user_id).to_bytes(8, "little", signed=True)) / 2**32
+
+
+def file_sha256(path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """
+    Versions of the models saved in a directory, and the models currently serving recommendations.
+
+    Every .zip, or .npz policy exported by export.py, in the directory is a version, named by its file name
+    without the extension and identified by its sha256, so a retrained model saved under the same name is a
+    new version. Checksums are only recomputed for files whose size or modification time changed since the
+    last scan.
+
+    The model served when no name is given is pinned, never the newest file, so checkpoints or partial saves
+    landing in the directory are not picked up: the name in serving.json, written when a model is activated
+    by name, otherwise default_model.
+
+    reload() loads a model on a background thread, checks it against the serving observation space,
+    runs it on a few synthetic observations and only then swaps it in with a single assignment. Requests
+    already running finish on the models they started with.
+    """
+
+    def __init__(self, model_dir: str, default_model: Optional[str] = None, warm_up_observations: int = 4):
+        self.model_dir = model_dir
+        self.default_model = default_model
+        self.warm_up_observations = warm_up_observations
+        self._versions: Dict[str, ModelVersion] = {}
+        self._loaded: Dict[str, LoadedModel] = {}  # by sha256, so A/B and rollbacks reuse a loaded model
+        self._serving: Optional[ServingModels] = None
+        self._lock = threading.Lock()  # scans and the loaded-model cache
+        self._reload_lock = threading.Lock()  # one reload at a time
+        self.reloading: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.swaps = 0
+
+    def scan(self) -> List[ModelVersion]:
+        """Versions in the model directory, newest first."""
+        with self._lock:
+            versions = {}
+            for file_name in os.listdir(self.model_dir) if os.path.isdir(self.model_dir) else []:
+                name, extension = os.path.splitext(file_name)
+                algorithm = name.split("_", 1)[0].lower()
+                if extension not in MODEL_EXTENSIONS or algorithm not in ALGORITHMS:
+                    continue
+                path = os.path.join(self.model_dir, file_name)
+                stat = os.stat(path)
+                known = self._versions.get(name)
+                if known is not None and known.size == stat.st_size and known.modified == stat.st_mtime:
+                    versions[name] = known
+                else:
+                    versions[name] = ModelVersion(name, path, algorithm, file_sha256(path), stat.st_size, stat.st_mtime)
+            self._versions = versions
+            return sorted(versions.values(), key=lambda version: version.modified, reverse=True)
+
+    def pinned_model(self) -> Optional[str]:
+        """Name of the model to serve when none is given: the one in serving.json, else default_model."""
+        manifest_path = os.path.join(self.model_dir, MANIFEST_NAME)
+        if os.path.isfile(manifest_path):
+            with open(manifest_path) as f:
+                return json.load(f)["primary"]
+        return self.default_model
+
+    def _pin(self, name: str):
+        manifest_path = os.path.join(self.model_dir, MANIFEST_NAME)
+        with open(f"{manifest_path}.tmp", "w") as f:
+            json.dump({"primary": name, "pinned": datetime.now().isoformat()}, f)
+        os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    def get_version(self, name: Optional[str] = None) -> ModelVersion:
+        """The current version of a model by name, or of the pinned model when no name is given."""
+        name = name or self.pinned_model()
+        if name is None:
+            raise FileNotFoundError(f"No model named and none pinned in {os.path.join(self.model_dir, MANIFEST_NAME)} or by default_model")
+        for version in self.scan():
+            if version.name == name:
+                return version
+        raise FileNotFoundError(f"No model named {name} in {self.model_dir}")
+
+    def load(self, version: ModelVersion, observation_space=None) -> LoadedModel:
+        """Deserialize a version (once per checksum), check its observation space and warm it up."""
+        with self._lock:
+            loaded = self._loaded.get(version.sha256)
+        if loaded is not None:
+            return loaded
+
+        if version.path.endswith(".npz"):
+            model = NumpyPolicy.load(version.path)
+            compatible = observation_space is None or model.matches(observation_space)
+        else:
+            # stable_baselines3 pulls in torch, so it is only imported once a model is actually loaded
+            import stable_baselines3
+
+            model = getattr(stable_baselines3, version.algorithm.upper()).load(version.path, device="cpu")
+            compatible = observation_space is None or model.observation_space == observation_space
+        if not compatible:
+            raise ValueError(f"Model {version.name} was trained on a different observation space than the environment serves")
+        self._warm_up(model, observation_space if observation_space is not None else getattr(model, "observation_space", None))
+
+        loaded = LoadedModel(version, model)
+        with self._lock:
+            self._loaded[version.sha256] = loaded
+        return loaded
+
+    def _warm_up(self, model, observation_space):
+        """Run the policy on a batch of random observations, so the first request does not pay for lazy setup."""
+        if self.warm_up_observations <= 0 or observation_space is None:
+            return
+        samples = [observation_space.sample() for _ in range(self.warm_up_observations)]
+        obs = {key: np.stack([sample[key] for sample in samples]) for key in samples[0]}
+        model.predict(obs, deterministic=True)
+
+    def serving(self) -> Optional[ServingModels]:
+        """The models to serve with, take one reference per request."""
+        return self._serving
+
+    def activate(self, name: Optional[str] = None, observation_space=None, candidate: Optional[str] = None,
+                 candidate_share: float = 0.0) -> ServingModels:
+        """Load the named models and swap them in, blocking until done.
+
+        name None serves the pinned model; a named primary is pinned in serving.json, so it is also served after a restart.
+        """
+        if not 0.0 <= candidate_share <= 1.0:
+            raise ValueError("candidate_share must be between 0 and 1")
+        with self._reload_lock:
+            self.reloading = name or "pinned"
+            try:
+                primary = self.load(self.get_version(name), observation_space)
+                challenger = self.load(self.get_version(candidate), observation_space) if candidate is not None else None
+                serving = ServingModels(primary, challenger, candidate_share)
+                if name is not None:
+                    self._pin(name)
+                self._serving = serving
+                self.swaps += 1
+                self.last_error = None
+                self._release_unused()
+                return serving
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                self.reloading = None
+
+    def reload(self, name: Optional[str] = None, observation_space=None, candidate: Optional[str] = None,
+               candidate_share: float = 0.0, on_swap: Optional[Callable[[ServingModels], None]] = None) -> Future:
+        """activate() on a background thread; the returned future resolves to the new ServingModels."""
+        future = Future()
+
+        def _run():
+            try:
+                serving = self.activate(name, observation_space, candidate, candidate_share)
+                if on_swap is not None:
+                    on_swap(serving)
+                future.set_result(serving)
+            except Exception as e:
+                tb = traceback.format_exc()
+                print(f"Error reloading model {name or 'pinned'}: {e}\n{tb}")
+                future.set_exception(e)
+
+        threading.Thread(target=_run, name="model-reload", daemon=True).start()
+        return future
+
+    def _release_unused(self):
+        """Drop loaded models no longer serving; in-flight requests still hold their own references."""
+        serving = self._serving
+        keep = {serving.primary.version.sha256}
+        if serving.candidate is not None:
+            keep.add(serving.candidate.version.sha256)
+        with self._lock:
+            self._loaded = {sha256: loaded for sha256, loaded in self._loaded.items() if sha256 in keep}
+
+    def stats(self) -> Dict:
+        return {
+            "serving": self._serving.to_dict() if self._serving is not None else None,
+            "pinned": self.pinned_model(),
+            "versions": [version.to_dict() for version in self.scan()],
+            "reloading": self.reloading,
+            "last_error": self.last_error,
+            "swaps": self.swaps,
+        }
@@ -0,0 +1,58 @@
+# shared_state.py
+
+import os
+import shutil
+import tempfile
+import numpy as np
+from typing import Dict, List, Optional
+from app.src.spark.agent.environment import RecommendationEnv, STATE_ARRAYS
+from app.src.spark.data.models import Customer, Product, Category
+
+# lookups no env ever writes to are mapped read-only, counters and preferences copy-on-write
+READ_ONLY_ARRAYS = ("product_categories", "category_members", "category_sizes")
+
+
+class SharedEnvState:
+    """State of a RecommendationEnv written once to .npy files and memory-mapped by every training worker.
+
+    Counter and preference matrices are mapped copy-on-write: all workers read the same pages, and a worker only
+    gets private copies of the pages its episodes change. Memory per worker therefore grows with the users it
+    touches instead of with the whole customer base. Pickling sends only the directory path.
+    """
+
+    def __init__(self, directory: str, owner: bool = False):
+        self.directory = directory
+        self.owner = owner  # only the creating process removes the files
+
+    @classmethod
+    def create(cls, env: RecommendationEnv, directory: Optional[str] = None) -> "SharedEnvState":
+        """Write the env's state arrays, to a new directory in /dev/shm (or the temp dir) unless one is given."""
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="spark-env-", dir="/dev/shm" if os.path.isdir("/dev/shm") else None)
+        for name, array in env.state_arrays().items():
+            np.save(os.path.join(directory, f"{name}.npy"), array)
+        return cls(directory, owner=True)
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """Map the state arrays into this process."""
+        arrays = {}
+        for name in STATE_ARRAYS:
+            mapped = np.load(os.path.join(self.directory, f"{name}.npy"), mmap_mode="r" if name in READ_ONLY_ARRAYS else "c")
+            arrays[name] = np.asarray(mapped)  # plain ndarray over the mapping, so slices and observations are not memmaps
+        return arrays
+
+    def make_env(self, users: List[Customer], products: List[Product], categories: List[Category], **env_kwargs) -> RecommendationEnv:
+        """RecommendationEnv over the mapped state, users must be in the same order as in the env the state was created from."""
+        return RecommendationEnv(users, products, categories, state=self.arrays(), **env_kwargs)
+
+    @staticmethod
+    def customer_stubs(customers: List[Customer]) -> List[Customer]:
+        """Customers without their interactions, which an env built from shared state does not read."""
+        return [Customer(idx=customer.idx, zip_code=customer.zip_code, city=customer.city, state=customer.state) for customer in customers]
+
+    def close(self):
+        if self.owner:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __getstate__(self):
+        return {"directory": self.directory, "owner": False}
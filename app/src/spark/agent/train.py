@@ -0,0 +1,204 @@
+# train.py
+#
+# Train the recommender on simulated interactions with several environment workers:
+#
+#   python -m app.src.spark.agent.train --algo ppo --num-envs 8 --total-timesteps 2000000
+
+import os
+import copy
+import time
+import argparse
+from typing import Callable, List, Optional
+from stable_baselines3 import PPO, A2C
+from stable_baselines3.common.callbacks import BaseCallback, CheckpointCallback
+from stable_baselines3.common.monitor import Monitor
+from stable_baselines3.common.vec_env import DummyVecEnv, SubprocVecEnv, VecEnv, VecMonitor
+from app.src.spark.agent.environment import RecommendationEnv, OBSERVATION_MODES
+from app.src.spark.agent.vec_environment import RecommendationVecEnv
+from app.src.spark.agent.features import CompactFeaturesExtractor
+from app.src.spark.agent.shared_state import SharedEnvState
+from app.src.spark.data.catalog import CatalogStore
+from app.src.spark.data.models import Customer, Product, Category
+
+DATA_DIR = "app/src/spark/data/preprocessed_data/"
+MODEL_DIR = "app/src/spark/agent/models/"
+CHECKPOINT_DIR = "app/src/spark/agent/checkpoints/"
+
+ALGORITHMS = {"ppo": PPO, "a2c": A2C}
+
+
+class RolloutTimer(BaseCallback):
+    """Logs collected steps, wall time and steps/sec for every rollout, and the time spent updating in between."""
+
+    def __init__(self, log_interval: int = 1, verbose: int = 1):
+        super().__init__(verbose)
+        self.log_interval = log_interval
+        self.rollouts = 0
+        self.rollout_started = 0.0
+        self.rollout_ended = None
+        self.rollout_start_steps = 0
+
+    def _on_rollout_start(self):
+        self.rollout_started = time.perf_counter()
+        self.rollout_start_steps = self.num_timesteps
+
+    def _on_rollout_end(self):
+        now = time.perf_counter()
+        wall = now - self.rollout_started
+        steps = self.num_timesteps - self.rollout_start_steps
+        update = self.rollout_started - self.rollout_ended if self.rollout_ended is not None else 0.0
+        self.rollout_ended = now
+        self.rollouts += 1
+
+        self.logger.record("time/rollout_wall_s", wall)
+        self.logger.record("time/rollout_steps_per_s", steps / wall if wall > 0 else 0.0)
+        self.logger.record("time/update_wall_s", update)
+        if self.verbose > 0 and self.rollouts % self.log_interval == 0:
+            print(f"rollout {self.rollouts}: {steps} steps in {wall:.2f}s ({steps / wall if wall > 0 else 0.0:,.0f} steps/s), previous update {update:.2f}s, total {self.num_timesteps} steps")
+
+    def _on_step(self) -> bool:
+        return True
+
+
+def load_data(data_dir: str):
+    """Load the catalog once; workers get their own copies of the customers."""
+    catalog = CatalogStore(data_dir)
+    return catalog.customers(), catalog.products(), catalog.categories()
+
+
+def make_env(customers: List[Customer], products: List[Product], categories: List[Category], args, rank: int, shared: Optional[SharedEnvState] = None) -> Callable[[], Monitor]:
+    def _init():
+        # each env assigns its own counter rows to the customers, so they must not be shared between envs
+        users = [copy.copy(customer) for customer in customers]
+        env_kwargs = {"top_k": args.top_k, "observation_mode": args.observation_mode, "top_n": args.top_n}
+        if shared is not None:
+            env = shared.make_env(users, products, categories, **env_kwargs)
+        else:
+            env = RecommendationEnv(users, products, categories, **env_kwargs)
+        env.seed(args.seed + rank)
+        return Monitor(env)
+
+    return _init
+
+
+def make_vec_env(customers: List[Customer], products: List[Product], categories: List[Category], args, shared: Optional[SharedEnvState] = None) -> VecEnv:
+    if args.vec_env == "batched":
+        env = RecommendationEnv(customers, products, categories, top_k=args.top_k, observation_mode=args.observation_mode, top_n=args.top_n)
+        return VecMonitor(RecommendationVecEnv(env, args.num_envs, seed=args.seed))
+
+    env_fns = [make_env(customers, products, categories, args, rank, shared) for rank in range(args.num_envs)]
+    if args.vec_env == "dummy":
+        return DummyVecEnv(env_fns)
+    return SubprocVecEnv(env_fns, start_method=args.start_method)
+
+
+def build_model(vec_env: VecEnv, args):
+    policy_kwargs = {}
+    if args.observation_mode == "compact":
+        policy_kwargs = {"features_extractor_class": CompactFeaturesExtractor, "features_extractor_kwargs": {"embed_dim": args.embed_dim}}
+
+    kwargs = {
+        "learning_rate": args.learning_rate,
+        "n_steps": args.n_steps,
+        "gamma": args.gamma,
+        "gae_lambda": args.gae_lambda,
+        "ent_coef": args.ent_coef,
+        "policy_kwargs": policy_kwargs,
+        "tensorboard_log": args.tensorboard_log,
+        "seed": args.seed,
+        "device": args.device,
+        "verbose": args.verbose,
+    }
+    if args.algo == "ppo":
+        kwargs.update({"batch_size": args.batch_size, "n_epochs": args.n_epochs, "clip_range": args.clip_range})
+
+    return ALGORITHMS[args.algo]("MultiInputPolicy", vec_env, **kwargs)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Train the Spark recommender with parallel simulated environments.")
+    parser.add_argument("--algo", choices=sorted(ALGORITHMS), default="ppo")
+    parser.add_argument("--num-envs", type=int, default=os.cpu_count() or 1, help="number of environment workers")
+    parser.add_argument("--vec-env", choices=["subproc", "dummy", "batched"], default="subproc",
+                        help="subproc: one process per env, dummy: all envs in this process, batched: RecommendationVecEnv")
+    parser.add_argument("--start-method", choices=["fork", "forkserver", "spawn"], default=None, help="multiprocessing start method for subproc workers")
+    parser.add_argument("--total-timesteps", type=int, default=2000000)
+    parser.add_argument("--learning-rate", type=float, default=0.0007)
+    parser.add_argument("--n-steps", type=int, default=100, help="steps per env per rollout")
+    parser.add_argument("--batch-size", type=int, default=64, help="PPO only")
+    parser.add_argument("--n-epochs", type=int, default=15, help="PPO only")
+    parser.add_argument("--clip-range", type=float, default=0.2, help="PPO only")
+    parser.add_argument("--gamma", type=float, default=0.95)
+    parser.add_argument("--gae-lambda", type=float, default=None, help="defaults to 0.95 for PPO and 0.99 for A2C")
+    parser.add_argument("--ent-coef", type=float, default=0.01)
+    parser.add_argument("--top-k", type=int, default=10, help="number of recommendations per step")
+    parser.add_argument("--observation-mode", choices=OBSERVATION_MODES, default="dense")
+    parser.add_argument("--top-n", type=int, default=32, help="interacted products per compact observation")
+    parser.add_argument("--embed-dim", type=int, default=32, help="product embedding size for compact observations")
+    parser.add_argument("--no-shared-state", action="store_true", help="give every subproc/dummy env its own copy of the customer state")
+    parser.add_argument("--seed", type=int, default=100)
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="where the finished model is saved, the directory the app serves from")
+    parser.add_argument("--checkpoint-dir", default=CHECKPOINT_DIR, help="where checkpoints and the model of an interrupted or failed run are saved")
+    parser.add_argument("--name", default=None, help="model file name, defaults to <algo>_recommender")
+    parser.add_argument("--save-interval", type=int, default=200000, help="checkpoint every this many total steps, 0 to disable")
+    parser.add_argument("--log-interval", type=int, default=1, help="print timings every this many rollouts")
+    parser.add_argument("--tensorboard-log", default=None)
+    parser.add_argument("--verbose", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    if args.gae_lambda is None:
+        args.gae_lambda = 0.95 if args.algo == "ppo" else 0.99
+    if args.name is None:
+        args.name = f"{args.algo}_recommender"
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    os.makedirs(args.model_dir, exist_ok=True)
+    os.makedirs(args.checkpoint_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    customers, products, categories = load_data(args.data_dir)
+
+    # workers map one copy of the counters instead of each rebuilding them from the customers' interactions
+    shared = None
+    if args.vec_env != "batched" and not args.no_shared_state:
+        shared = SharedEnvState.create(RecommendationEnv(customers, products, categories, top_k=args.top_k))
+        customers = SharedEnvState.customer_stubs(customers)
+
+    try:
+        vec_env = make_vec_env(customers, products, categories, args, shared)
+        print(f"{args.num_envs} {args.vec_env} envs over {len(customers)} customers and {len(products)} products ready in {time.perf_counter() - started:.2f}s")
+
+        model = build_model(vec_env, args)
+        callbacks = [RolloutTimer(log_interval=args.log_interval)]
+        if args.save_interval > 0:
+            # CheckpointCallback counts calls, each call is one step of every env
+            callbacks.append(CheckpointCallback(save_freq=max(args.save_interval // args.num_envs, 1), save_path=args.checkpoint_dir, name_prefix=args.name, verbose=1))
+
+        started = time.perf_counter()
+        try:
+            model.learn(total_timesteps=args.total_timesteps, callback=callbacks)
+        except BaseException:
+            # keep the served model in model_dir intact, the partly trained one goes with the checkpoints
+            interrupted_path = os.path.join(args.checkpoint_dir, f"{args.name}_interrupted_{model.num_timesteps}_steps")
+            model.save(interrupted_path)
+            print(f"training stopped after {model.num_timesteps} steps, saved {interrupted_path}.zip")
+            raise
+        finally:
+            vec_env.close()
+        model_path = os.path.join(args.model_dir, args.name)
+        model.save(model_path)
+    finally:
+        if shared is not None:
+            shared.close()
+
+    wall = time.perf_counter() - started
+    print(f"trained {model.num_timesteps} steps in {wall:.1f}s ({model.num_timesteps / wall:,.0f} steps/s), saved {model_path}.zip")
+
+
+if __name__ == "__main__":
+    main()
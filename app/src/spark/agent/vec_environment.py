@@ -0,0 +1,182 @@
+# vec_environment.py
+
+import numpy as np
+from typing import Any, List, Optional, Sequence, Type
+from stable_baselines3.common.vec_env.base_vec_env import VecEnv, VecEnvIndices, VecEnvObs, VecEnvStepReturn
+from app.src.spark.agent.environment import RecommendationEnv
+from app.src.spark.data.models import InteractionType, INTERACTION_TYPES, TYPE_CODES
+
+NONE, VIEW, LIKE, BUY, RATE, SESSION_START, SESSION_CLOSE = (TYPE_CODES[t] for t in (
+    InteractionType.NONE, InteractionType.VIEW, InteractionType.LIKE, InteractionType.BUY,
+    InteractionType.RATE, InteractionType.SESSION_START, InteractionType.SESSION_CLOSE))
+
+# fixed reward per simulated interaction type, ratings are rewarded separately
+TYPE_REWARDS = np.zeros(len(INTERACTION_TYPES), dtype=np.float32)
+TYPE_REWARDS[NONE] = -1 # no interaction, customers not interested in recommendations
+TYPE_REWARDS[VIEW] = 3
+TYPE_REWARDS[LIKE] = 10
+TYPE_REWARDS[BUY] = 30
+
+# default interaction probabilities, lower prob for SESSION_CLOSE ending episode to encourage longer training
+TYPE_PROBS = np.full(len(INTERACTION_TYPES), 1.0 / len(INTERACTION_TYPES))
+TYPE_PROBS[SESSION_CLOSE] = 0.1
+
+
+class RecommendationVecEnv(VecEnv):
+    """
+    Batched version of RecommendationEnv implementing the stable-baselines3 VecEnv interface.
+
+    Every env slot simulates one user. Product choice, interaction type and rating follow the same
+    preference-weighted rules as RecommendationEnv._simulate_interaction, but are sampled for all
+    slots at once with one uniform draw per slot against the cumulative weights. User counters are
+    the wrapped env's (num_users, num_products) matrices, so users keep their history across
+    episodes and share it with the single env.
+    """
+
+    def __init__(self, env:RecommendationEnv, num_envs:int, seed:Optional[int]=None):
+        super().__init__(num_envs, env.observation_space, env.action_space)
+
+        self.env = env
+        self.num_users = len(env.users)
+        self.num_products = len(env.products)
+        self.num_categories = len(env.categories)
+        self.product_categories = env.product_categories
+
+        # the env's counter matrices, shared rather than copied
+        self.views = env.views
+        self.likes = env.likes
+        self.buys = env.buys
+        self.ratings = env.ratings
+
+        self.np_random = np.random.default_rng(seed)
+        self.user_idxs = np.zeros(num_envs, dtype=np.int64)   # index of users list per env slot, not user_id
+        self.actions = np.zeros((num_envs, env.top_k), dtype=np.int64)
+
+    def _sample(self, weights):
+        """ one categorical draw per row of non-negative weights """
+        cumulative = np.cumsum(weights, axis=1)
+        draws = self.np_random.random(len(weights)) * cumulative[:, -1]
+        return np.minimum((cumulative <= draws[:, None]).sum(axis=1), weights.shape[1] - 1)
+
+    def _preferences(self, rows):
+        views, likes, buys, ratings = self.views[rows], self.likes[rows], self.buys[rows], self.ratings[rows]
+        return views, likes, buys, ratings, self.env.product_prefs[rows], self.env.category_prefs[rows]
+
+    def _observations(self, rows, types=None, products=None, ratings=None):
+        if self.env.observation_mode == 'compact':
+            return self.env._compact_observations(rows, products, types, ratings)
+        
+        views, likes, buys, user_ratings, product_prefs, cat_prefs = self._preferences(rows)
+
+        product_obs = np.zeros((len(rows), self.num_products), dtype=np.uint8)
+        interaction_obs = np.zeros((len(rows), len(INTERACTION_TYPES)), dtype=np.uint8)
+        rating_obs = np.zeros(len(rows), dtype=np.int64)
+        if types is not None:
+            slots = np.arange(len(rows))
+            touched = np.isin(types, (VIEW, LIKE, BUY, RATE))
+            product_obs[slots[touched], products[touched]] = 1
+            interaction_obs[slots, types] = 1
+            rating_obs = np.where(types == RATE, ratings, 0)
+
+        return {
+                'pref_prod': product_prefs,
+                'pref_cat': cat_prefs,
+                'buys': buys,
+                'views': views,
+                'likes': likes,
+                'ratings': user_ratings,
+                'product': product_obs,
+                'interaction': interaction_obs,
+                'rating': rating_obs
+            }
+
+    def reset(self) -> VecEnvObs:
+        if self._seeds[0] is not None:
+            self.np_random = np.random.default_rng(self._seeds[0])
+        self._reset_seeds()
+        self._reset_options()
+
+        self.user_idxs = self.np_random.integers(self.num_users, size=self.num_envs)
+        return self._observations(self.user_idxs)
+
+    def step_async(self, actions:np.ndarray) -> None:
+        self.actions = np.asarray(actions, dtype=np.int64).reshape(self.num_envs, -1)
+
+    def step_wait(self) -> VecEnvStepReturn:
+        rows = self.user_idxs
+        slots = np.arange(self.num_envs)
+        actions = self.actions
+        _, _, _, _, product_prefs, cat_prefs = self._preferences(rows)
+
+        # simulate selection, scores higher for preferred products and favourite categories
+        prod_scores = np.clip(np.take_along_axis(product_prefs, actions, axis=1), 0, 255).astype(np.uint8)
+        prod_scores = np.clip(prod_scores + cat_prefs[slots[:, None], self.product_categories[actions]], 0, 255).astype(np.uint8)
+        prod_weights = np.where(prod_scores.max(axis=1, keepdims=True) > 0, prod_scores, 1).astype(np.float64) # equal probs by default
+        selected = actions[slots, self._sample(prod_weights)]
+
+        # simulate interaction for the selected product, scaled by the user's history with it
+        inter_scores = np.zeros((self.num_envs, len(INTERACTION_TYPES)), dtype=np.float64)
+        inter_scores[:, VIEW] = np.clip(self.views[rows, selected], 0, 255)
+        inter_scores[:, LIKE] = np.clip(self.likes[rows, selected], 0, 255)
+        inter_scores[:, BUY] = np.clip(self.buys[rows, selected], 0, 255)
+        inter_scores[:, RATE] = np.clip(self.ratings[rows, selected], 0, 255)
+        inter_weights = np.where(inter_scores.max(axis=1, keepdims=True) > 0, (inter_scores + 1) * TYPE_PROBS, TYPE_PROBS)
+        types = self._sample(inter_weights)
+
+        # likely rating of 2-5 if a favourite product is rated, up chance of that rating
+        likely_ratings = self.np_random.integers(0, 6, size=self.num_envs)
+        selected_prefs = product_prefs[slots, selected]
+        max_prefs = product_prefs.max(axis=1)
+        favourite = (types == RATE) & (selected_prefs > 0)
+        likely_ratings[favourite] = (selected_prefs[favourite] / max_prefs[favourite] * 3).astype(np.int64) + 2
+        rating_weights = np.full((self.num_envs, 6), 1 / 6)
+        rating_weights[slots, likely_ratings] = 0.7
+        ratings = self._sample(rating_weights)
+
+        rewards = TYPE_REWARDS[types].copy()
+        rewards[types == RATE] = (ratings[types == RATE] - 2) * 3 # rating of 1 is negative
+        dones = types == SESSION_CLOSE
+
+        # apply the interactions to the users' counters, np.add.at handles two slots sharing a user
+        for counters, inter_type in ((self.views, VIEW), (self.likes, LIKE), (self.buys, BUY)):
+            mask = types == inter_type
+            np.add.at(counters, (rows[mask], selected[mask]), 1)
+        rated = types == RATE
+        self.ratings[rows[rated], selected[rated]] = ratings[rated]
+        touched = np.isin(types, (VIEW, LIKE, BUY, RATE))
+        self.env._refresh_preferences(rows[touched], selected[touched])
+
+        obs = self._observations(rows, types, selected, ratings)
+        infos = [{} for _ in range(self.num_envs)]
+
+        # save final observation where the caller can get it, then reset finished slots to new random users
+        done_slots = np.flatnonzero(dones)
+        if len(done_slots):
+            for slot in done_slots:
+                infos[slot]['terminal_observation'] = {key: value[slot] for key, value in obs.items()}
+                infos[slot]['TimeLimit.truncated'] = False
+            self.user_idxs[done_slots] = self.np_random.integers(self.num_users, size=len(done_slots))
+            reset_obs = self._observations(self.user_idxs[done_slots])
+            for key, value in reset_obs.items():
+                obs[key][done_slots] = value
+
+        return obs, rewards, dones, infos
+
+    def close(self) -> None:
+        pass
+
+    def get_attr(self, attr_name:str, indices:VecEnvIndices=None) -> List[Any]:
+        return [getattr(self.env, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(self, attr_name:str, value:Any, indices:VecEnvIndices=None) -> None:
+        setattr(self.env, attr_name, value)
+
+    def env_method(self, method_name:str, *method_args, indices:VecEnvIndices=None, **method_kwargs) -> List[Any]:
+        method = getattr(self.env, method_name)
+        return [method(*method_args, **method_kwargs) for _ in self._get_indices(indices)]
+
+    def env_is_wrapped(self, wrapper_class:Type, indices:VecEnvIndices=None) -> List[bool]:
+        return [False for _ in self._get_indices(indices)]
+
+    def get_images(self) -> Sequence[Optional[np.ndarray]]:
+        return [None for _ in range(self.num_envs)]
@@ -0,0 +1,196 @@
+# catalog.py
+
+import os
+import threading
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional, Tuple
+from app.src.spark.data.models import Customer, Category, Product, Interaction, InteractionBatch
+from app.src.spark.data.interaction_log import InteractionLog
+from app.src.spark.data.columnar import COLUMNS, read_table, table_path
+
+
+def hydrate_interactions(interaction_df: pd.DataFrame) -> List[Interaction]:
+    """Build Interaction objects from an interaction frame in one pass over its columns."""
+    return list(InteractionBatch.from_frame(interaction_df))
+
+
+def group_by_customer(batch: InteractionBatch) -> Dict[int, np.ndarray]:
+    """Positions in the batch of each customer's interactions, in batch order."""
+    customer_idxs = batch.records["customer_idx"]
+    order = np.argsort(customer_idxs, kind="stable")
+    customers, starts = np.unique(customer_idxs[order], return_index=True)
+    return dict(zip(customers.tolist(), np.split(order, starts[1:])))
+
+
+class CatalogStore:
+    """Process-wide cache of the preprocessed data files, indexed by idx.
+
+    Files are parsed once and only re-parsed when their mtime or size changes,
+    so lookups by idx are dictionary reads instead of a full CSV parse. Records
+    appended to the interaction log are read incrementally from the last position seen.
+    """
+
+    def __init__(self, data_dir: str, interaction_log: Optional[InteractionLog] = None):
+        self.data_dir = data_dir
+        self.interaction_log = interaction_log
+        self._log_position = 0
+        self._lock = threading.RLock()
+        self._signatures: Dict[str, Tuple[int, int]] = {}
+
+        self._categories: List[Category] = []
+        self._category_map: Dict[int, Category] = {}
+        self._products: List[Product] = []
+        self._product_map: Dict[int, Product] = {}
+        self._category_products: Dict[int, List[Product]] = {}
+        self._customers: List[Customer] = []
+        self._customer_map: Dict[int, Customer] = {}
+        self._interactions = InteractionBatch()
+
+    def _path(self, filename: str) -> str:
+        return os.path.join(self.data_dir, filename)
+
+    def _signature(self, filename: str) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self._path(filename))
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def _stale(self, *tables: str) -> Optional[Dict[str, Tuple[int, int]]]:
+        """Return the current signatures of the tables' files if any differ from the version last loaded, otherwise None."""
+        # keyed by the file actually read, so switching between a table's CSV and Parquet file also reloads it
+        filenames = [os.path.basename(table_path(self.data_dir, table)) for table in tables]
+        signatures = {filename: self._signature(filename) for filename in filenames}
+        if all(filename in self._signatures and self._signatures[filename] == signature for filename, signature in signatures.items()):
+            return None
+        return signatures
+
+    def _read_table(self, table: str) -> pd.DataFrame:
+        return read_table(self.data_dir, table, COLUMNS[table])
+
+    def _refresh_products(self):
+        signatures = self._stale("Category", "Product")
+        if signatures is None:
+            return
+
+        category_df = self._read_table("Category")
+        product_df = self._read_table("Product")
+
+        categories = [Category(idx=row["idx"], name=row["name"], desc=row["desc"]) for _, row in category_df.iterrows()]
+        category_map = {category.idx: category for category in categories}
+        products = [
+            Product(
+                idx=row["idx"],
+                name=row["name"],
+                desc=row["desc"],
+                long_desc=row["long_desc"],
+                category=category_map.get(row["category_num_id"]),
+                price=row["price"],
+            )
+            for _, row in product_df.iterrows()
+        ]
+
+        category_products = {}
+        for product in products:
+            if product.category:
+                category_products.setdefault(product.category.idx, []).append(product)
+
+        self._categories = categories
+        self._category_map = category_map
+        self._products = products
+        self._product_map = {product.idx: product for product in products}
+        self._category_products = category_products
+        self._signatures.update(signatures)
+
+    def _refresh_customers(self):
+        signatures = self._stale("Customer", "Interaction")
+        if signatures is None:
+            self._tail_log()
+            return
+
+        customer_df = self._read_table("Customer")
+        interaction_df = self._read_table("Interaction")
+
+        # one structured array for every interaction, each customer holds the batch of its own rows in file order
+        interactions = InteractionBatch.from_frame(interaction_df)
+        customer_positions = group_by_customer(interactions)
+        no_positions = np.empty(0, dtype=np.int64)
+
+        customers = []
+        customer_map = {}
+        for idx, zip_code, city, state in zip(
+            customer_df["idx"].tolist(), customer_df["zip_code"].tolist(), customer_df["city"].tolist(), customer_df["state"].tolist()
+        ):
+            # views, likes, buys and ratings are allocated by RecommendationEnv as rows of its counter matrices
+            customer = Customer(idx=idx, zip_code=zip_code, city=city, state=state,
+                                interactions=interactions[customer_positions.get(idx, no_positions)])
+            customers.append(customer)
+            customer_map[customer.idx] = customer
+
+        self._customers = customers
+        self._customer_map = customer_map
+        self._interactions = interactions
+        self._signatures.update(signatures)
+        self._log_position = 0
+        self._tail_log()
+
+    def _tail_log(self):
+        """Attach interactions appended to the log since the last refresh."""
+        if self.interaction_log is None:
+            return
+
+        position = len(self.interaction_log)
+        if position <= self._log_position:
+            return
+
+        # appended in place with capacity doubling, copying everything on every refresh would be quadratic in the log
+        interactions = InteractionBatch.from_frame(self.interaction_log.read_frame(self._log_position))
+        for customer_idx, positions in group_by_customer(interactions).items():
+            customer = self._customer_map.get(customer_idx)
+            if customer:
+                customer.interactions.extend(interactions[positions])
+
+        self._interactions.extend(interactions)
+        self._log_position += len(interactions)
+
+    def categories(self) -> List[Category]:
+        with self._lock:
+            self._refresh_products()
+            return self._categories
+
+    def category(self, idx: int) -> Optional[Category]:
+        with self._lock:
+            self._refresh_products()
+            return self._category_map.get(idx)
+
+    def products(self) -> List[Product]:
+        with self._lock:
+            self._refresh_products()
+            return self._products
+
+    def product(self, idx: int) -> Optional[Product]:
+        with self._lock:
+            self._refresh_products()
+            return self._product_map.get(idx)
+
+    def category_products(self, category_idx: int) -> List[Product]:
+        with self._lock:
+            self._refresh_products()
+            return self._category_products.get(category_idx, [])
+
+    def customers(self) -> List[Customer]:
+        with self._lock:
+            self._refresh_customers()
+            return self._customers
+
+    def customer(self, idx: int) -> Optional[Customer]:
+        with self._lock:
+            self._refresh_customers()
+            return self._customer_map.get(idx)
+
+    def interactions(self) -> InteractionBatch:
+        with self._lock:
+            self._refresh_customers()
+            # a batch over the rows so far, later appends do not change it
+            return InteractionBatch(self._interactions.records)
@@ -0,0 +1,110 @@
+# columnar.py
+#
+# Typed Parquet copies of the preprocessed tables, read with column projection and memory-mapping.
+# Convert the CSVs of a data directory with:
+#
+#   python -m app.src.spark.data.columnar app/src/spark/data/preprocessed_data/
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from typing import Dict, List, Optional
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet is optional, every table also has its CSV
+    pa = None
+    pq = None
+
+TABLES = ("Category", "Customer", "Interaction", "Product")
+
+# repeated strings are stored once per file as dictionaries
+DICTIONARY_COLUMNS = ("type", "city", "state")
+
+# columns the app reads from each table
+COLUMNS: Dict[str, List[str]] = {
+    "Category": ["idx", "name", "desc"],
+    "Customer": ["idx", "zip_code", "city", "state"],
+    "Interaction": ["timestamp", "idx", "product_idx", "customer_idx", "review_score", "type", "value"],
+    "Product": ["idx", "name", "desc", "long_desc", "category_num_id", "price"],
+}
+
+
+def parquet_available() -> bool:
+    return pq is not None
+
+
+def table_path(data_dir: str, name: str) -> str:
+    """The file a table is read from: its Parquet file if pyarrow is installed and the CSV is not newer, else its CSV."""
+    parquet_path = os.path.join(data_dir, f"{name}.parquet")
+    csv_path = os.path.join(data_dir, f"{name}.csv")
+    if pq is None or not os.path.isfile(parquet_path):
+        return csv_path
+    # a CSV edited after the Parquet file was written wins
+    if os.path.isfile(csv_path) and os.path.getmtime(csv_path) > os.path.getmtime(parquet_path):
+        return csv_path
+    return parquet_path
+
+
+def read_table(data_dir: str, name: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Read a table from its Parquet file, memory-mapped, or from its CSV; only the given columns if any."""
+    path = table_path(data_dir, name)
+    if path.endswith(".parquet"):
+        return pq.read_table(path, columns=columns, memory_map=True).to_pandas()
+    return pd.read_csv(path, usecols=columns)
+
+
+def to_arrow(df: pd.DataFrame, timestamp_columns=("timestamp",), vector_types: Optional[Dict[str, "pa.DataType"]] = None) -> "pa.Table":
+    """
+    Arrow table of a frame without its index, with dictionary-encoded string columns and parsed timestamps.
+
+    Columns in vector_types hold equal-length arrays and are stored as fixed-size lists of the given type.
+    """
+    vector_types = vector_types or {}
+    arrays = {}
+    for column in df.columns:
+        if str(column).startswith("Unnamed:"):
+            continue  # the index written by DataFrame.to_csv
+        values = df[column]
+        if column in vector_types:
+            vectors = np.stack(values.to_numpy())
+            arrays[column] = pa.FixedSizeListArray.from_arrays(pa.array(vectors.ravel(), type=vector_types[column]), vectors.shape[1])
+            continue
+        if column in timestamp_columns and not pd.api.types.is_datetime64_any_dtype(values):
+            values = pd.to_datetime(values)
+        array = pa.Array.from_pandas(values)
+        # pandas' str dtype converts to large_string
+        if column in DICTIONARY_COLUMNS and (pa.types.is_string(array.type) or pa.types.is_large_string(array.type)):
+            array = array.dictionary_encode()
+        arrays[column] = array
+    return pa.table(arrays)
+
+
+def convert_csv(data_dir: str, name: str, compression: str = "zstd") -> str:
+    """Write the Parquet copy of a table's CSV and return its path."""
+    if pq is None:
+        raise ImportError("pyarrow is required to write Parquet files")
+    parquet_path = os.path.join(data_dir, f"{name}.parquet")
+    pq.write_table(to_arrow(pd.read_csv(os.path.join(data_dir, f"{name}.csv"))), parquet_path, compression=compression)
+    return parquet_path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write Parquet copies of the preprocessed CSV tables.")
+    parser.add_argument("data_dir")
+    parser.add_argument("--tables", nargs="+", default=list(TABLES))
+    args = parser.parse_args(argv)
+
+    for name in args.tables:
+        csv_path = os.path.join(args.data_dir, f"{name}.csv")
+        if not os.path.isfile(csv_path):
+            print(f"skipping {name}, no {csv_path}")
+            continue
+        parquet_path = convert_csv(args.data_dir, name)
+        print(f"{csv_path} ({os.path.getsize(csv_path):,} B) -> {parquet_path} ({os.path.getsize(parquet_path):,} B)")
+
+
+if __name__ == "__main__":
+    main()
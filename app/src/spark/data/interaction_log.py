@@ -0,0 +1,185 @@
+# interaction_log.py
+
+import os
+import csv
+import threading
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from app.src.spark.data.models import InteractionType, INTERACTION_TYPES, TYPE_CODES
+
+# fixed-width little-endian record, 67 bytes, so the n-th record always starts at n * itemsize
+RECORD_DTYPE = np.dtype(
+    [
+        ("id", "<i8"),
+        ("timestamp", "<i8"),  # microseconds since 1970-01-01, naive like the CSV timestamps
+        ("idx", "S32"),
+        ("product_idx", "<i4"),
+        ("customer_idx", "<i4"),
+        ("review_score", "<i2"),
+        ("type", "u1"),  # position in InteractionType
+        ("value", "<f8"),
+    ]
+)
+
+CSV_HEADER = ["id", "timestamp", "idx", "product_idx", "customer_idx", "review_score", "type", "value"]
+
+_EPOCH = datetime(1970, 1, 1)
+_TYPE_VALUES = np.array([interaction_type.value for interaction_type in INTERACTION_TYPES], dtype=object)
+
+
+def _last_csv_id(csv_path: str) -> Optional[int]:
+    """Read the id of the last row of a CSV by seeking backwards from the end of the file."""
+    if not os.path.isfile(csv_path):
+        return None
+
+    with open(csv_path, mode="rb") as file:
+        position = file.seek(0, os.SEEK_END)
+        block = b""
+        # read 4 KiB blocks backwards until the block holds a complete last line
+        while position > 0:
+            step = min(4096, position)
+            position -= step
+            file.seek(position)
+            block = file.read(step) + block
+            if b"\n" in block.rstrip(b"\r\n"):
+                break
+
+    lines = block.rstrip(b"\r\n").splitlines()
+    # only a header (or nothing) means there are no interactions yet
+    if len(lines) < 2 and position == 0:
+        return None
+    return int(lines[-1].split(b",")[0])
+
+
+class InteractionLog:
+    """Append-only binary log of interactions saved through the API.
+
+    Interaction.csv stays the read-only seed produced by the ETL; new interactions are
+    appended here as fixed-width records. The next interaction id is kept in memory and
+    recovered from the last record (or the last CSV row) at startup, so neither
+    allocating an id nor appending depends on the size of the history.
+    """
+
+    def __init__(self, path: str, seed_csv_path: Optional[str] = None):
+        self.path = path
+        self.seed_csv_path = seed_csv_path
+        self._lock = threading.Lock()
+        self._next_id = self._recover_next_id()
+        self._file = open(self.path, mode="ab")
+
+    def _recover_next_id(self) -> int:
+        last_ids = []
+        if os.path.isfile(self.path):
+            size = os.path.getsize(self.path)
+            torn = size % RECORD_DTYPE.itemsize
+            if torn:
+                # drop a partially written record left behind by a crash
+                with open(self.path, mode="r+b") as file:
+                    file.truncate(size - torn)
+                size -= torn
+            if size:
+                last = np.fromfile(self.path, dtype=RECORD_DTYPE, count=1, offset=size - RECORD_DTYPE.itemsize)
+                last_ids.append(int(last["id"][0]))
+
+        last_csv_id = _last_csv_id(self.seed_csv_path) if self.seed_csv_path else None
+        if last_csv_id is not None:
+            last_ids.append(last_csv_id)
+
+        return max(last_ids) + 1 if last_ids else 0
+
+    def next_id(self) -> int:
+        """Atomically allocate the next interaction id."""
+        with self._lock:
+            interaction_id = self._next_id
+            self._next_id += 1
+            return interaction_id
+
+    def append(self, interaction_data: Dict, fsync: bool = False):
+        """Append one interaction record to the end of the log."""
+        self.append_many([interaction_data], fsync=fsync)
+
+    def append_many(self, interactions: List[Dict], fsync: bool = False):
+        """Append interaction records to the end of the log in a single write, optionally fsyncing it to disk."""
+        if not interactions:
+            return
+
+        records = np.empty(len(interactions), dtype=RECORD_DTYPE)
+        for i, interaction_data in enumerate(interactions):
+            records[i] = (
+                interaction_data["id"],
+                (interaction_data["timestamp"] - _EPOCH) // timedelta(microseconds=1),
+                str(interaction_data["idx"]).encode(),
+                interaction_data["product_idx"],
+                interaction_data["customer_idx"],
+                interaction_data["review_score"] or 0,
+                TYPE_CODES[InteractionType(interaction_data["type"])],
+                interaction_data["value"],
+            )
+
+        with self._lock:
+            self._file.write(records.tobytes())
+            self._file.flush()
+            if fsync:
+                os.fsync(self._file.fileno())
+
+    def __len__(self) -> int:
+        try:
+            return os.path.getsize(self.path) // RECORD_DTYPE.itemsize
+        except FileNotFoundError:
+            return 0
+
+    def read(self, start: int = 0) -> np.ndarray:
+        """Read every complete record from position start onwards."""
+        count = len(self) - start
+        if count <= 0:
+            return np.empty(0, dtype=RECORD_DTYPE)
+        return np.fromfile(self.path, dtype=RECORD_DTYPE, count=count, offset=start * RECORD_DTYPE.itemsize)
+
+    def read_latest(self) -> pd.DataFrame:
+        """Read the last record of every customer as a frame shaped like Interaction.csv."""
+        records = self.read()
+        # first occurrence in the reversed log is the latest record of each customer
+        _, reversed_positions = np.unique(records["customer_idx"][::-1], return_index=True)
+        positions = np.sort(len(records) - 1 - reversed_positions)
+        return records_to_frame(records[positions])
+
+    def read_frame(self, start: int = 0) -> pd.DataFrame:
+        """Read records from position start onwards as a frame shaped like Interaction.csv."""
+        return records_to_frame(self.read(start))
+
+    def export_csv(self, csv_path: str):
+        """Write the seed CSV followed by every logged interaction as a single Interaction.csv-compatible file."""
+        with open(csv_path, mode="w", newline="") as out:
+            if self.seed_csv_path and os.path.isfile(self.seed_csv_path):
+                with open(self.seed_csv_path, mode="r", newline="") as seed:
+                    for line in seed:
+                        out.write(line if line.endswith("\n") else line + "\n")
+            else:
+                csv.writer(out).writerow(CSV_HEADER)
+
+            writer = csv.writer(out)
+            frame = self.read_frame()
+            frame["timestamp"] = frame["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")
+            writer.writerows(frame[CSV_HEADER].itertuples(index=False, name=None))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def records_to_frame(records: np.ndarray) -> pd.DataFrame:
+    """Convert log records to a frame with the Interaction.csv columns."""
+    return pd.DataFrame(
+        {
+            "id": records["id"],
+            "timestamp": pd.to_datetime(records["timestamp"], unit="us"),
+            "idx": np.char.decode(records["idx"]) if len(records) else np.empty(0, dtype=str),
+            "product_idx": records["product_idx"].astype(np.int64),
+            "customer_idx": records["customer_idx"].astype(np.int64),
+            "review_score": records["review_score"].astype(np.int64),
+            "type": _TYPE_VALUES[records["type"]],
+            "value": records["value"],
+        }
+    )
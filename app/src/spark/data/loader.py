@@ -1,22 +1,69 @@
 # loader.py
 
-import os
+import atexit
+import threading
 import pandas as pd
 from datetime import datetime
-from typing import List, Tuple, Dict, Optional
-from app.src.spark.data.models import Customer, Category, Product, Interaction, InteractionType
-import csv
+from typing import TYPE_CHECKING, FrozenSet, List, Tuple, Dict, Optional
+from app.src.spark.data.models import Customer, Category, Product, Interaction, InteractionBatch, InteractionType
+from app.src.spark.data.catalog import CatalogStore, hydrate_interactions
+from app.src.spark.data.columnar import COLUMNS, read_table
+from app.src.spark.data.interaction_log import InteractionLog
+from app.src.spark.data.write_queue import WriteBehindQueue
+from app.src.spark.data.cache import VersionedLRUCache
 import numpy as np
-from app.src.spark import utils
-from stable_baselines3 import PPO, A2C
 from app.src.spark.agent.environment import RecommendationEnv
+from app.src.spark.agent.batcher import MicroBatcher
+from app.src.spark.agent.registry import ModelRegistry, ServingModels
 import traceback
 
+if TYPE_CHECKING:
+    # stable_baselines3 pulls in torch, so it is only imported once a model is actually loaded
+    from stable_baselines3.common.base_class import BaseAlgorithm
+
 data_dir = "app/src/spark/data/preprocessed_data/"
 model_dir = "app/src/spark/agent/models/"
 
 current_user_id = 0
 
+# the interaction log, its write queue and the catalog are opened on first use rather than at import, so importing
+# the loader creates no files and starts no threads
+_interaction_log: Optional[InteractionLog] = None
+_interaction_queue: Optional[WriteBehindQueue] = None
+_catalog: Optional[CatalogStore] = None
+_store_lock = threading.RLock()
+
+
+def get_interaction_log() -> InteractionLog:
+    """Append-only log of new interactions, seeded with the ids already in Interaction.csv."""
+    global _interaction_log
+    if _interaction_log is None:
+        with _store_lock:
+            if _interaction_log is None:
+                _interaction_log = InteractionLog(f"{data_dir}Interaction.log", seed_csv_path=f"{data_dir}Interaction.csv")
+    return _interaction_log
+
+
+def get_interaction_queue() -> WriteBehindQueue:
+    """Queue that acknowledges interactions once queued and writes them to the log in batches."""
+    global _interaction_queue
+    if _interaction_queue is None:
+        with _store_lock:
+            if _interaction_queue is None:
+                _interaction_queue = WriteBehindQueue(get_interaction_log(), max_batch=512, flush_interval=0.05, fsync=False)
+                atexit.register(_interaction_queue.close)  # scripts and notebooks that never run the FastAPI shutdown hook
+    return _interaction_queue
+
+
+def get_catalog() -> CatalogStore:
+    """Process-wide cache of the data files, shared by every request."""
+    global _catalog
+    if _catalog is None:
+        with _store_lock:
+            if _catalog is None:
+                _catalog = CatalogStore(data_dir, get_interaction_log())
+    return _catalog
+
 
 def set_current_user(user_id: int):
     """Set the current user ID for server use."""
@@ -36,246 +83,460 @@ def load_csv(filename: str) -> pd.DataFrame:
     return pd.read_csv(f"{data_dir}{filename}")
 
 
+def load_table(name: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """Load a table from its Parquet file in the data directory, or from its CSV when there is none."""
+    return read_table(data_dir, name, columns)
+
+
 # Load customers with interactions if required
 def load_customers(idxs: List[int] = [], include_interactions: bool = True) -> List[Customer]:
-    customer_df = load_csv("Customer.csv")
-    interaction_df = load_csv("Interaction.csv") if include_interactions else None
+    customers = get_catalog().customers()
 
     if idxs:
-        customer_df = customer_df[customer_df["idx"].isin(idxs)]
-
-    customers = []
-    num_products = 100  # Adjust as needed to match your dataset
-    for _, row in customer_df.iterrows():
-        interactions = []
-        if include_interactions and interaction_df is not None:
-            customer_interactions = interaction_df[interaction_df["customer_idx"] == row["idx"]]
-            for _, int_row in customer_interactions.iterrows():
-                interactions.append(
-                    Interaction(
-                        idx=str(int_row["idx"]),
-                        timestamp=datetime.strptime(int_row["timestamp"], "%Y-%m-%d %H:%M:%S"),
-                        customer_idx=int_row["customer_idx"],
-                        product_idx=int_row["product_idx"],
-                        type=InteractionType(int_row["type"]),
-                        value=int_row["value"],
-                        review_score=int_row["review_score"],
-                    )
-                )
-
-        customer = Customer(idx=row["idx"], zip_code=row["zip_code"], city=row["city"], state=row["state"], interactions=interactions)
-        # Initialize views, likes, buys, and ratings as numeric arrays
-        customer.views = np.zeros(num_products, dtype=float)
-        customer.likes = np.zeros(num_products, dtype=float)
-        customer.buys = np.zeros(num_products, dtype=float)
-        customer.ratings = np.zeros(num_products, dtype=float)
-
-        customers.append(customer)
+        customers = [customer for customer in customers if customer.idx in idxs]
+
+    if not include_interactions:
+        customers = [Customer(idx=c.idx, zip_code=c.zip_code, city=c.city, state=c.state) for c in customers]
 
     return customers
 
 
 def load_customer(idx: int) -> Optional[Customer]:
-    customers = load_customers()
-    for customer in customers:
-        if customer.idx == idx:
-            return customer
-    return None
+    return get_catalog().customer(idx)
 
 
 # Load products
 def load_products() -> List[Product]:
-    product_df = load_csv("Product.csv")
-    category_df = load_csv("Category.csv")
-    category_map = {row["idx"]: Category(idx=row["idx"], name=row["name"], desc=row["desc"]) for _, row in category_df.iterrows()}
-
-    return [
-        Product(
-            idx=row["idx"],
-            name=row["name"],
-            desc=row["desc"],
-            long_desc=row["long_desc"],
-            category=category_map.get(row["category_num_id"]),
-            price=row["price"],
-        )
-        for _, row in product_df.iterrows()
-    ]
+    return get_catalog().products()
 
 
 def load_product(idx: int) -> Optional[Product]:
-    products = load_products()
-    for product in products:
-        if product.idx == idx:
-            return product
-    return None
+    return get_catalog().product(idx)
+
+
+def load_category_products(category_idx: int) -> List[Product]:
+    """Fetch the products belonging to a single category."""
+    return get_catalog().category_products(category_idx)
 
 
 # Load categories
 def load_categories(idxs: List[int] = []) -> List[Category]:
-    category_df = load_csv("Category.csv")
+    categories = get_catalog().categories()
     if idxs:
-        category_df = category_df[category_df["idx"].isin(idxs)]
+        categories = [category for category in categories if category.idx in idxs]
 
-    return [Category(idx=row["idx"], name=row["name"], desc=row["desc"]) for _, row in category_df.iterrows()]
+    return categories
 
 
 # Load interactions
-def load_interactions() -> List[Interaction]:
-    interaction_df = load_csv("Interaction.csv")
-    return [
-        Interaction(
-            idx=row["idx"],
-            timestamp=datetime.strptime(row["timestamp"], "%Y-%m-%d %H:%M:%S"),
-            customer_idx=row["customer_idx"],
-            product_idx=row["product_idx"],
-            type=InteractionType(row["type"]),
-            value=row["value"],
-            review_score=row["review_score"],
-        )
-        for _, row in interaction_df.iterrows()
-    ]
+def load_interactions() -> InteractionBatch:
+    return get_catalog().interactions()
 
 
 def get_next_interaction_id() -> int:
-    """Retrieve the next interaction ID based on the last entry in the Interaction.csv file."""
-    file_path = f"{data_dir}/Interaction.csv"
-    if not os.path.isfile(file_path):
-        return 0
-
-    with open(file_path, mode="r") as file:
-        lines = file.readlines()
-
-    return int(lines[-1].split(",")[0]) + 1 if len(lines) > 1 else 0
+    """Allocate the next interaction ID from the interaction log's in-memory counter."""
+    return get_interaction_log().next_id()
 
 
 def save_interaction(interaction_data: Dict):
-    """Save interaction data to a separate interaction log file and update the environment observation."""
-    file_path = f"{data_dir}/Interaction.csv"
-    is_empty = not os.path.isfile(file_path) or os.path.getsize(file_path) == 0
-
-    # Save interaction data to CSV
-    with open(file_path, mode="a", newline="") as file:
-        writer = csv.writer(file)
-        if is_empty:
-            writer.writerow(["id", "timestamp", "idx", "product_idx", "customer_idx", "review_score", "type", "value"])
-        writer.writerow(
-            [
-                interaction_data["id"],
-                interaction_data["timestamp"].strftime("%Y-%m-%d %H:%M:%S"),
-                interaction_data["idx"],
-                interaction_data["product_idx"],
-                interaction_data["customer_idx"],
-                interaction_data["review_score"],
-                interaction_data["type"],
-                interaction_data["value"],
-            ]
-        )
+    """Queue interaction data for the interaction log and update the environment observation immediately."""
+    # load the env before queueing, so an env built from the log never already contains this interaction
+    env = get_env()
+    get_interaction_queue().put(interaction_data)
+
+    # Create an Interaction instance from interaction_data for the index and the observation
+    interaction = Interaction(
+        idx=interaction_data["idx"],
+        timestamp=interaction_data["timestamp"],
+        customer_idx=interaction_data["customer_idx"],
+        product_idx=interaction_data["product_idx"],
+        type=InteractionType(interaction_data["type"]),
+        value=interaction_data["value"],
+        review_score=interaction_data["review_score"],
+    )
+    _last_interaction_index()[interaction.customer_idx] = interaction
 
     # Find the corresponding customer in the environment
-    customer_idx = interaction_data["customer_idx"]
-    customer = next((user for user in env.users if user.idx == customer_idx), None)
+    customer = env.get_user(interaction_data["customer_idx"])
 
     # Ensure the customer exists in the environment before updating
     if customer:
-        # Create an Interaction instance from interaction_data for updating the observation
-        interaction = Interaction(
-            idx=interaction_data["idx"],
-            timestamp=interaction_data["timestamp"],
-            customer_idx=interaction_data["customer_idx"],
-            product_idx=interaction_data["product_idx"],
-            type=InteractionType(interaction_data["type"]),
-            value=interaction_data["value"],
-            review_score=interaction_data["review_score"],
-        )
-
         # Update the observation in the environment
         updated_obs = env.update_observation(customer, interaction)
+        # the last interaction is part of the observation, so cached recommendations are stale even if no counter changed
+        env.bump_state_version(customer)
 
 
-def get_last_interaction(customer_idx: int) -> Optional[Interaction]:
-    """Retrieve the last interaction for a specific customer from Interaction.csv."""
-    interaction = load_csv("Interaction.csv")
-    interaction = interaction[interaction["customer_idx"] == customer_idx]
-    if interaction.empty:
-        return None
+def get_interaction_queue_stats() -> Dict:
+    """Fetch the depth and counters of the interaction write queue."""
+    return get_interaction_queue().stats()
+
+
+def flush_interactions():
+    """Write every queued interaction to the log and stop the write queue; called on shutdown."""
+    if _interaction_queue is not None:
+        _interaction_queue.close()
+
+
+def build_last_interaction_index() -> Dict[int, Interaction]:
+    """Index the latest interaction of every customer from the seed CSV and the interaction log."""
+    index = {}
+    # later sources win, so the log overrides the seed CSV
+    for latest_df in (load_table("Interaction", COLUMNS["Interaction"]).drop_duplicates(subset="customer_idx", keep="last"), get_interaction_log().read_latest()):
+        index.update((interaction.customer_idx, interaction) for interaction in hydrate_interactions(latest_df))
+
+    return index
 
-    interaction = interaction.iloc[-1]
-    return Interaction(
-        idx=interaction["idx"],
-        timestamp=datetime.strptime(interaction["timestamp"], "%Y-%m-%d %H:%M:%S"),
-        customer_idx=interaction["customer_idx"],
-        product_idx=interaction["product_idx"],
-        type=InteractionType(interaction["type"]),
-        value=interaction["value"],
-        review_score=interaction["review_score"],
-    )
 
+# latest interaction per customer, built on first use and kept current by save_interaction
+_last_interactions: Optional[Dict[int, Interaction]] = None
+_last_interactions_lock = threading.Lock()
 
-def get_model_and_env() -> Tuple[PPO, RecommendationEnv]:
-    """Load the model and environment for generating recommendations."""
-    model = "ppo_recommender"
-    model_path = f"{model_dir}/{model}"
-    model = PPO.load(model_path)
 
+def _last_interaction_index() -> Dict[int, Interaction]:
+    global _last_interactions
+    if _last_interactions is None:
+        with _last_interactions_lock:
+            if _last_interactions is None:
+                _last_interactions = build_last_interaction_index()
+    return _last_interactions
+
+
+def get_last_interaction(customer_idx: int) -> Optional[Interaction]:
+    """Retrieve the last interaction for a specific customer."""
+    return _last_interaction_index().get(customer_idx)
+
+
+def get_model_and_env() -> Tuple["BaseAlgorithm", RecommendationEnv]:
+    """Load the environment and the serving model for generating recommendations."""
     # Load customers, products, and interactions
     customers = load_customers()
     products = load_products()
     categories = load_categories()
-    product_map = {product.idx: product for product in products}  # Create a map for quick lookup
 
     # Initialize the environment with required arguments
     env = RecommendationEnv(users=customers, products=products, categories=categories, top_k=10)
     env.seed(100)
 
-    return model, env
+    if model_registry.serving() is None:
+        model_registry.activate(serving_model, observation_space=env.observation_space)
+
+    return model_registry.serving().primary.model, env
+
+
+# model served unless another one was activated by name, which pins it in model_dir/serving.json
+default_model = "a2c_recommender"
+
+# versions of the models in model_dir, and the ones serving recommendations
+model_registry = ModelRegistry(model_dir, default_model=default_model)
+serving_model: Optional[str] = None  # model to serve at startup, e.g. "ppo_recommender"; None serves the pinned model
+
+# the environment and first model are loaded once, on first use or by warm_up, rather than at import
+_env: Optional[RecommendationEnv] = None
+_model_lock = threading.Lock()
+_model_error: Optional[str] = None
+
+
+def load_model_and_env() -> Tuple["BaseAlgorithm", RecommendationEnv]:
+    """Return the primary serving model and the shared environment, loading them on first call; safe to call from any thread."""
+    global _env, _model_error
+    if _env is None:
+        with _model_lock:
+            if _env is None:
+                try:
+                    _, env = get_model_and_env()
+                    # built before _env is published, so a request let through by is_ready() never waits on it
+                    _last_interaction_index()
+                except Exception as e:
+                    _model_error = f"{type(e).__name__}: {e}"
+                    raise
+                _model_error = None
+                _env = env
+    return model_registry.serving().primary.model, _env
+
+
+def get_model() -> "BaseAlgorithm":
+    return load_model_and_env()[0]
+
+
+def get_env() -> RecommendationEnv:
+    return load_model_and_env()[1]
+
+
+def _serving() -> ServingModels:
+    """The serving models after making sure they are loaded, take one reference per request."""
+    load_model_and_env()
+    return model_registry.serving()
+
+
+def reload_model(name: Optional[str] = None, candidate: Optional[str] = None, candidate_share: float = 0.0):
+    """Load a model version in the background and swap it in once warmed up, without interrupting requests.
+
+    With a candidate, candidate_share of the users (by a stable hash of their id) are served by the candidate
+    and the rest by name. Returns a future that resolves to the new ServingModels.
+    """
+    return model_registry.reload(name, get_env().observation_space, candidate, candidate_share)
+
+
+def get_model_registry_stats() -> Dict:
+    """Fetch the serving models, the versions in the model directory and the state of the last reload."""
+    return model_registry.stats()
+
+
+def is_ready() -> bool:
+    """Whether the model, environment and interaction index are loaded, without loading them."""
+    return _env is not None
+
 
+def get_readiness() -> Dict:
+    """Readiness of the recommender for health checks: loaded or not, and the error of the last failed load."""
+    return {"ready": is_ready(), "error": _model_error}
 
-# Load the model and environment once for reuse
-model, env = get_model_and_env()
+
+class RecommenderNotReady(RuntimeError):
+    """The model and environment are still loading in the background, or failed to load."""
+
+
+def ensure_ready():
+    """Raise RecommenderNotReady unless loaded; for request paths on the event loop, which must not wait on the load."""
+    if not is_ready():
+        raise RecommenderNotReady(_model_error or "the recommender is still loading")
+
+
+def warm_up() -> bool:
+    """Load the model, environment and interaction index and run one prediction, so the first request pays for none of it."""
+    try:
+        env = get_env()
+        if env.users:
+            _predict([0])
+        return True
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(f"Error warming up the recommender: {e}\n{tb}")
+        return False
+
+
+def __getattr__(name: str):
+    # loader.model, loader.env and loader.last_interactions still work for notebooks and scripts, loading on first access
+    if name == "model":
+        return get_model()
+    if name == "env":
+        return get_env()
+    if name == "last_interactions":
+        return _last_interaction_index()
+    # as do loader.catalog, loader.interaction_log, loader.interaction_queue and loader.recommendation_batcher
+    if name == "catalog":
+        return get_catalog()
+    if name == "interaction_log":
+        return get_interaction_log()
+    if name == "interaction_queue":
+        return get_interaction_queue()
+    if name == "recommendation_batcher":
+        return get_recommendation_batcher()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# recommendations are deterministic for a given user state and model, keyed by user_id with version (state_version, model version)
+recommendation_cache = VersionedLRUCache(max_size=10000, ttl=None)
+
+# "top_k": unique top-k over the policy's per-product scores with masking, "slots": each action slot's argmax as model.predict
+ranking_mode = "top_k"
+exclude_purchased = True  # never recommend products the customer has already bought
+
+# products out of stock or otherwise not to be recommended. Updates replace the whole set under the lock and bump
+# the generation, so requests read one consistent set without locking and cached rankings of an older set miss
+unavailable_products: FrozenSet[int] = frozenset()
+_availability_generation = 0
+_availability_lock = threading.Lock()
+
+
+def set_product_available(product_idx: int, available: bool):
+    """Allow or stop recommending a product, e.g. when it goes out of stock."""
+    global unavailable_products, _availability_generation
+    with _availability_lock:
+        unavailable_products = unavailable_products - {product_idx} if available else unavailable_products | {product_idx}
+        _availability_generation += 1
+    # cached recommendations were ranked with the old availability
+    recommendation_cache.clear()
+
+
+def get_unavailable_products() -> FrozenSet[int]:
+    return unavailable_products
+
+
+def _default_interaction(user_id: int) -> Interaction:
+    """Placeholder interaction for customers without any history."""
+    products = get_env().products
+    return Interaction(
+        idx="0",
+        timestamp=datetime.now(),
+        customer_idx=user_id,
+        product_idx=products[0].idx if products else 0,  # Choose a default product if available
+        type=InteractionType.NONE,
+        value=1.0,
+        review_score=0,
+    )
+
+
+def _recommendation_payload(recommended_product_indices, product_map: Dict[int, Product]) -> List[Dict]:
+    """Map recommended indices to actual products."""
+    return [
+        {
+            "id": product_map[idx].idx,
+            "name": product_map[idx].name,
+            "price": f"{product_map[idx].price:.2f}",
+            "desc": product_map[idx].desc,
+            "image": f"{product_map[idx].category.name}.jpeg" if product_map[idx].category else "default.jpeg",
+        }
+        for idx in recommended_product_indices
+        if idx in product_map
+    ]
+
+
+def _predict(user_ids: List[int], category_ids: Optional[List[int]] = None, serving: Optional[ServingModels] = None) -> np.ndarray:
+    """Run one batched policy forward pass per serving model for the given users; returns (len(user_ids), top_k) product indices.
+
+    In "top_k" mode the indices are unique per user, restricted to category_ids if given, and padded with -1
+    when fewer than top_k products are allowed.
+    """
+    from app.src.spark.agent.ranking import product_scores, recommendation_mask, top_k_batch
+
+    serving = serving or _serving()
+    env = get_env()
+    customers = [env.get_user(user_id) for user_id in user_ids]
+    # Get the last interaction or create a default one if not found
+    interactions = [get_last_interaction(user_id) or _default_interaction(user_id) for user_id in user_ids]
+
+    # Build the observations without replaying the last interaction into the customer's counters
+    obs = env.get_observations(customers, interactions)
+    if ranking_mode != "slots":
+        rows = np.array([env.user_rows[customer.idx] for customer in customers], dtype=np.int64)
+        mask = recommendation_mask(env, rows, exclude_purchased=exclude_purchased, unavailable=unavailable_products, categories=category_ids)
+
+    recommended_product_indices = np.full((len(user_ids), env.top_k), -1, dtype=np.int64)
+    for loaded, positions in serving.assign(user_ids):
+        group_obs = obs if len(positions) == len(user_ids) else {key: value[positions] for key, value in obs.items()}
+        if ranking_mode == "slots":
+            recommended_product_indices[positions], _ = loaded.model.predict(group_obs, deterministic=True)
+        else:
+            recommended_product_indices[positions] = top_k_batch(product_scores(loaded.model, group_obs), env.top_k, mask[positions])
+    return recommended_product_indices
 
 
 def get_recommendations(user_id: int) -> Optional[List[Dict]]:
     try:
-        customer = env.users[user_id]
-        products = env.products
-        product_map = {product.idx: product for product in products}  # Create a map for quick lookup
-
-        # Get the last interaction or create a default one if not found
-        interaction = get_last_interaction(user_id)
-        if not interaction:
-            # Create a default interaction if none exists
-            interaction = Interaction(
-                idx="0",
-                timestamp=datetime.now(),
-                customer_idx=user_id,
-                product_idx=products[0].idx if products else 0,  # Choose a default product if available
-                type=InteractionType.NONE,
-                value=1.0,
-                review_score=0,
-            )
-
-        # Update the observation using the environment and interaction
-        obs = env.update_observation(customer, interaction)
-
-        # Use the model to predict based on the observation
-        recommended_product_indices, _ = model.predict(obs, deterministic=True)
-
-        # Map recommended indices to actual products
-        recommended_products = [
-            {
-                "id": product_map[idx].idx,
-                "name": product_map[idx].name,
-                "price": f"{product_map[idx].price:.2f}",
-                "desc": product_map[idx].desc,
-                "image": f"{product_map[idx].category.name}.jpeg" if product_map[idx].category else "default.jpeg",
-            }
-            for idx in recommended_product_indices
-            if idx in product_map
-        ]
-
-        return recommended_products
+        return get_recommendations_batch([user_id]).get(user_id)
 
     except Exception as e:
         tb = traceback.format_exc()
         print(f"Error generating recommendations: {e}\n{tb}")
         return None
+
+
+def _valid_user_ids(user_ids: Optional[List[int]]) -> List[int]:
+    env = get_env()
+    if user_ids is None:
+        return [user.idx for user in env.users]
+    return [user_id for user_id in user_ids if user_id in env.user_rows]
+
+
+def _cache_version(env: RecommendationEnv, serving: ServingModels, user_id: int) -> Tuple[int, int, str]:
+    """Cached recommendations are valid while neither the user's state, product availability nor the model serving them changes."""
+    return env.get_state_version(env.get_user(user_id)), _availability_generation, serving.model_for(user_id).version.sha256
+
+
+def _cached_recommendations(user_ids: List[int]) -> Dict[int, List[Dict]]:
+    """Recommendations still valid for the users' current state versions and serving models."""
+    serving = _serving()
+    env = get_env()
+    recommendations = {}
+    for user_id in user_ids:
+        cached = recommendation_cache.get(user_id, _cache_version(env, serving, user_id))
+        if cached is not None:
+            recommendations[user_id] = cached
+    return recommendations
+
+
+def _compute_recommendations(user_ids: List[int], chunk_size: int = 256, category_ids: Optional[List[int]] = None) -> Dict[int, List[Dict]]:
+    """Run the policy for the given users, one forward pass per chunk, and cache unfiltered results."""
+    # one reference to the serving models for the whole request, a model swapped in meanwhile serves the next one
+    serving = _serving()
+    env = get_env()
+    user_ids = list(dict.fromkeys(user_ids))
+    versions = {user_id: _cache_version(env, serving, user_id) for user_id in user_ids}
+
+    recommendations = {}
+    product_map = {product.idx: product for product in env.products}  # Create a map for quick lookup
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start : start + chunk_size]
+        for user_id, recommended_product_indices in zip(chunk, _predict(chunk, category_ids, serving)):
+            recommendations[user_id] = _recommendation_payload(recommended_product_indices, product_map)
+            if category_ids is None:
+                recommendation_cache.put(user_id, versions[user_id], recommendations[user_id])
+
+    return recommendations
+
+
+def get_recommendations_batch(user_ids: Optional[List[int]] = None, chunk_size: int = 256, category_ids: Optional[List[int]] = None) -> Dict[int, List[Dict]]:
+    """Generate recommendations for many users with one policy forward pass per chunk of users.
+
+    Defaults to every user in the environment; ids without a matching user are skipped.
+    Users whose state has not changed since their last request are served from the cache,
+    except when the recommendations are restricted to category_ids.
+    """
+    user_ids = _valid_user_ids(user_ids)
+    if category_ids is not None:
+        return _compute_recommendations(user_ids, chunk_size, category_ids)
+
+    recommendations = _cached_recommendations(user_ids)
+    recommendations.update(_compute_recommendations([user_id for user_id in user_ids if user_id not in recommendations], chunk_size))
+
+    return recommendations
+
+
+def get_recommendation_cache_stats() -> Dict:
+    """Fetch hit/miss/eviction counters of the recommendation cache."""
+    return recommendation_cache.stats()
+
+
+def _recommend_users(user_ids: List[int]) -> List[Optional[List[Dict]]]:
+    """Recommendations for a coalesced batch of cache misses, in request order."""
+    recommendations = _compute_recommendations(_valid_user_ids(user_ids), chunk_size=len(user_ids))
+    return [recommendations.get(user_id) for user_id in user_ids]
+
+
+# concurrent recommendation requests arriving within 2 ms share one policy forward pass on a worker thread, started on first use
+_recommendation_batcher: Optional[MicroBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_recommendation_batcher() -> MicroBatcher:
+    global _recommendation_batcher
+    if _recommendation_batcher is None:
+        with _batcher_lock:
+            if _recommendation_batcher is None:
+                _recommendation_batcher = MicroBatcher(_recommend_users, max_batch_size=64, max_wait=0.002, name="recommendation-batcher")
+    return _recommendation_batcher
+
+
+async def get_recommendations_async(user_id: int) -> Optional[List[Dict]]:
+    """Generate recommendations through the micro-batcher without blocking the event loop.
+
+    Raises RecommenderNotReady while the model is loading instead of waiting for it on the event loop.
+    """
+    ensure_ready()
+    try:
+        # cache hits skip the batching window entirely
+        cached = _cached_recommendations(_valid_user_ids([user_id]))
+        if cached:
+            return cached[user_id]
+        return await get_recommendation_batcher().infer(user_id)
+    except Exception as e:
+        tb = traceback.format_exc()
+        print(f"Error generating recommendations: {e}\n{tb}")
+        return None
+
+
+def get_recommendation_batcher_stats() -> Dict:
+    """Fetch queue depth plus batch-size and queue-wait histograms of the recommendation batcher."""
+    return get_recommendation_batcher().stats()
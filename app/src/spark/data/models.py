@@ -1,7 +1,11 @@
-from typing import List, Optional
-from datetime import datetime
+import numpy as np
+from typing import TYPE_CHECKING, Iterator, List, Optional, Sequence, Union
+from datetime import datetime, timedelta
 from enum import Enum
 
+if TYPE_CHECKING:
+    import pandas as pd
+
 
 class InteractionType(Enum):
     NONE = "none"
@@ -13,7 +17,44 @@ class InteractionType(Enum):
     SESSION_CLOSE = "session_close"
 
 
+# code of each interaction type in records and observations: its position in InteractionType
+INTERACTION_TYPES = list(InteractionType)
+TYPE_CODES = {interaction_type: code for code, interaction_type in enumerate(INTERACTION_TYPES)}
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+# one record per interaction in an InteractionBatch, the Interaction.csv columns the app reads
+INTERACTION_DTYPE = np.dtype(
+    [
+        ("timestamp", "<i8"),  # microseconds since 1970-01-01, naive like the CSV timestamps
+        ("idx", "S32"),
+        ("customer_idx", "<i4"),
+        ("product_idx", "<i4"),
+        ("type", "u1"),  # position in InteractionType
+        ("review_score", "<i2"),
+        ("value", "<f8"),  # NaN for no value
+    ]
+)
+
+
 class Interaction:
+    __slots__ = (
+        "idx",
+        "timestamp",
+        "customer_idx",
+        "product_idx",
+        "type",
+        "value",
+        "review_score",
+        "city_embedding",
+        "state_embedding",
+        "zip_code_embedding",
+        "product_purchase_history",
+        "category_purchase_history",
+        "rate_history",
+    )
+
     def __init__(
         self,
         idx: str,
@@ -45,8 +86,106 @@ class Interaction:
         self.rate_history = rate_history
 
 
+class InteractionBatch:
+    """
+    Interactions held as one NumPy structured array of INTERACTION_DTYPE records instead of an object each.
+
+    Indexing with an int builds that row's Interaction on demand, any other index (slice, positions, mask)
+    returns a batch of those rows. The optional embedding and history fields are not stored. extend appends
+    in place into spare capacity, so records is a view of the first len rows of a larger buffer.
+    """
+
+    __slots__ = ("records", "_buffer")
+
+    def __init__(self, records: Optional[np.ndarray] = None) -> None:
+        self.records = records if records is not None else np.empty(0, dtype=INTERACTION_DTYPE)
+        self._buffer = self.records
+
+    @classmethod
+    def from_frame(cls, frame: "pd.DataFrame") -> "InteractionBatch":
+        """Batch of the rows of a frame with the Interaction.csv columns, timestamps parsed or already datetimes."""
+        import pandas as pd
+
+        records = np.empty(len(frame), dtype=INTERACTION_DTYPE)
+        if not len(records):
+            return cls(records)
+        timestamps = pd.to_datetime(frame["timestamp"], format="%Y-%m-%d %H:%M:%S").to_numpy()
+        records["timestamp"] = timestamps.astype("datetime64[us]").astype(np.int64)
+        records["idx"] = np.array([str(idx) for idx in frame["idx"].tolist()], dtype="S32")
+        records["customer_idx"] = frame["customer_idx"].to_numpy()
+        records["product_idx"] = frame["product_idx"].to_numpy()
+        # look up each distinct type name once
+        type_positions, type_names = pd.factorize(frame["type"])
+        records["type"] = np.array([TYPE_CODES[InteractionType(name)] for name in type_names], dtype=np.uint8)[type_positions]
+        records["review_score"] = frame["review_score"].to_numpy()
+        records["value"] = frame["value"].to_numpy(dtype=np.float64, na_value=np.nan)
+        return cls(records)
+
+    @classmethod
+    def from_interactions(cls, interactions: Union[Sequence[Interaction], "InteractionBatch"]) -> "InteractionBatch":
+        """Batch of Interaction objects, or the batch itself if it already is one."""
+        if isinstance(interactions, InteractionBatch):
+            return interactions
+        records = np.empty(len(interactions), dtype=INTERACTION_DTYPE)
+        if not len(records):
+            return cls(records)
+        # a column at a time, NumPy converts each list in one call
+        records["timestamp"] = [(interaction.timestamp - _EPOCH) // _MICROSECOND for interaction in interactions]
+        records["idx"] = [str(interaction.idx) for interaction in interactions]
+        records["customer_idx"] = [interaction.customer_idx for interaction in interactions]
+        records["product_idx"] = [interaction.product_idx for interaction in interactions]
+        records["type"] = [TYPE_CODES[interaction.type] for interaction in interactions]
+        records["review_score"] = [interaction.review_score or 0 for interaction in interactions]
+        records["value"] = [interaction.value if interaction.value is not None else np.nan for interaction in interactions]
+        return cls(records)
+
+    @classmethod
+    def concat(cls, batches: Sequence["InteractionBatch"]) -> "InteractionBatch":
+        if not batches:
+            return cls()
+        return cls(np.concatenate([batch.records for batch in batches]))
+
+    def extend(self, other: "InteractionBatch") -> None:
+        """Append the rows of another batch, doubling the capacity when it runs out so appends are amortized O(rows added)."""
+        length, added = len(self.records), len(other.records)
+        if length + added > len(self._buffer):
+            buffer = np.empty(max(2 * len(self._buffer), length + added), dtype=INTERACTION_DTYPE)
+            buffer[:length] = self.records
+            self._buffer = buffer
+        # rows past the current length are not part of any records view handed out, so writing them changes no earlier view
+        self._buffer[length:length + added] = other.records
+        self.records = self._buffer[:length + added]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, key) -> Union[Interaction, "InteractionBatch"]:
+        if isinstance(key, (int, np.integer)):
+            return _to_interaction(self.records[key].item())
+        return InteractionBatch(self.records[key])
+
+    def __iter__(self) -> Iterator[Interaction]:
+        # tolist converts every field to a Python scalar in a single pass
+        return map(_to_interaction, self.records.tolist())
+
+
+def _to_interaction(record: tuple) -> Interaction:
+    timestamp, idx, customer_idx, product_idx, type_code, review_score, value = record
+    return Interaction(
+        idx=idx.decode(),
+        timestamp=_EPOCH + timedelta(microseconds=timestamp),
+        customer_idx=customer_idx,
+        product_idx=product_idx,
+        type=INTERACTION_TYPES[type_code],
+        value=None if value != value else value,  # NaN is no value
+        review_score=review_score,
+    )
+
+
 class Customer:
-    def __init__(self, idx: int, zip_code: int, city: str, state: str, interactions: Optional[List[Interaction]] = None) -> None:
+    def __init__(
+        self, idx: int, zip_code: int, city: str, state: str, interactions: Optional[Union[Sequence[Interaction], InteractionBatch]] = None
+    ) -> None:
         self.idx = idx
         self.zip_code = zip_code
         self.city = city
@@ -55,7 +194,8 @@ class Customer:
         self.views = []  # number of views for each product. format [0,30,23,3]
         self.likes = []  # like for each product. format [0,1,0,1]
         self.ratings = []  # max rating(0-5)for each product. format [0,1,4,2,0]
-        self.interactions = interactions if interactions is not None else []
+        # always an InteractionBatch, Interaction objects passed in are converted
+        self.interactions = InteractionBatch.from_interactions(interactions) if interactions is not None else InteractionBatch()
 
 
 class Category:
@@ -0,0 +1,147 @@
+# write_queue.py
+
+import time
+import queue
+import threading
+import traceback
+from typing import Dict, List, Optional, Tuple
+from app.src.spark.data.interaction_log import InteractionLog
+
+_FLUSH = object()
+_STOP = object()
+
+
+class WriteBehindQueue:
+    """Group-commit queue in front of the interaction log.
+
+    put() returns as soon as the interaction is queued. A background thread collects
+    queued interactions until max_batch is reached or flush_interval seconds have passed
+    since the first one arrived, then appends the whole batch to the log in one write.
+    """
+
+    def __init__(self, interaction_log: InteractionLog, max_batch: int = 512, flush_interval: float = 0.05, fsync: bool = False):
+        self.interaction_log = interaction_log
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.fsync = fsync
+
+        self._queue: queue.Queue = queue.Queue()
+        self._written = threading.Condition()
+        self._enqueued_count = 0
+        self._written_count = 0
+        self._failed_count = 0
+        self._batch_count = 0
+        self._closed = False
+        self._stopped = False
+
+        self._thread = threading.Thread(target=self._run, name="interaction-writer", daemon=True)
+        self._thread.start()
+
+    def put(self, interaction_data: Dict):
+        """Queue an interaction to be written to the log."""
+        # checked and queued under the lock close() holds, so nothing can land behind the stop marker
+        with self._written:
+            if self._closed:
+                raise RuntimeError("Interaction write queue is closed")
+            self._enqueued_count += 1
+            self._queue.put(interaction_data)
+
+    def depth(self) -> int:
+        """Number of interactions queued but not yet written."""
+        with self._written:
+            return self._enqueued_count - self._written_count - self._failed_count
+
+    def stats(self) -> Dict:
+        with self._written:
+            return {
+                "depth": self._enqueued_count - self._written_count - self._failed_count,
+                "enqueued": self._enqueued_count,
+                "written": self._written_count,
+                "failed": self._failed_count,
+                "batches": self._batch_count,
+            }
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far has been written. Returns False on timeout or if the writer has stopped first."""
+        with self._written:
+            target = self._enqueued_count
+            if not self._closed:
+                self._queue.put(_FLUSH)
+            self._written.wait_for(lambda: self._written_count + self._failed_count >= target or self._stopped, timeout=timeout)
+            return self._written_count + self._failed_count >= target
+
+    def close(self, timeout: Optional[float] = None):
+        """Write everything still queued and stop the background thread."""
+        with self._written:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._thread.join(timeout=timeout)
+
+    def _collect(self, first) -> Tuple[List[Dict], bool]:
+        """Collect a batch starting with first; returns the batch and whether the queue was stopped."""
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            if item is _FLUSH:
+                break
+            batch.append(item)
+        return batch, False
+
+    def _write(self, batch: List[Dict]):
+        try:
+            self.interaction_log.append_many(batch, fsync=self.fsync)
+            written, failed = len(batch), 0
+        except Exception as e:
+            tb = traceback.format_exc()
+            print(f"Error writing {len(batch)} interactions: {e}\n{tb}")
+            written, failed = 0, len(batch)
+
+        with self._written:
+            self._written_count += written
+            self._failed_count += failed
+            self._batch_count += 1
+            self._written.notify_all()
+
+    def _run(self):
+        try:
+            self._write_until_stopped()
+        finally:
+            # wake flush() callers whose interactions will now never be written
+            with self._written:
+                self._stopped = True
+                self._written.notify_all()
+
+    def _write_until_stopped(self):
+        stopped = False
+        while not stopped:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            if item is _FLUSH:
+                continue
+
+            batch, stopped = self._collect(item)
+            self._write(batch)
+
+        # drain anything queued behind the stop marker
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP and item is not _FLUSH:
+                remaining.append(item)
+        if remaining:
+            self._write(remaining)
@@ -0,0 +1,101 @@
+# hydration.py
+#
+# Rows/sec of loading customers with their interactions: the original per-customer filter and iterrows
+# loop against CatalogStore's single pass over the columns, on synthetic Customer.csv/Interaction.csv files.
+#
+#   python -m benchmarks.hydration
+#   python -m benchmarks.hydration --sizes 100000:1000 3000000:30000 --old-max-rows 100000
+
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from typing import List
+from app.src.spark.data.catalog import CatalogStore
+from app.src.spark.data.models import Customer, Interaction, InteractionType
+
+INTERACTION_TYPES = ["view", "like", "buy", "rate"]
+
+
+def write_synthetic(data_dir: str, rows: int, customers: int, seed: int = 0):
+    """Customer.csv and Interaction.csv with the preprocessed columns, interactions one second apart."""
+    rng = np.random.default_rng(seed)
+    pd.DataFrame({"idx": np.arange(customers), "zip_code": 1000, "city": "city", "state": "SP"}).to_csv(f"{data_dir}/Customer.csv")
+    timestamps = pd.Timestamp("2017-01-01") + pd.to_timedelta(np.arange(rows), unit="s")
+    pd.DataFrame(
+        {
+            "timestamp": timestamps.strftime("%Y-%m-%d %H:%M:%S"),
+            "idx": [f"order-{i}" for i in range(rows)],
+            "product_idx": rng.integers(0, 295, rows),
+            "customer_idx": rng.integers(0, customers, rows),
+            "review_score": 0,
+            "type": rng.choice(INTERACTION_TYPES, rows),
+            "value": 1.0,
+        }
+    ).to_csv(f"{data_dir}/Interaction.csv")
+
+
+def load_customers_iterrows(data_dir: str) -> List[Customer]:
+    """The original loader.load_customers: filter the interactions of every customer and build them row by row."""
+    customer_df = pd.read_csv(f"{data_dir}/Customer.csv")
+    interaction_df = pd.read_csv(f"{data_dir}/Interaction.csv")
+
+    customers = []
+    for _, row in customer_df.iterrows():
+        interactions = []
+        customer_interactions = interaction_df[interaction_df["customer_idx"] == row["idx"]]
+        for _, int_row in customer_interactions.iterrows():
+            interactions.append(
+                Interaction(
+                    idx=str(int_row["idx"]),
+                    timestamp=datetime.strptime(int_row["timestamp"], "%Y-%m-%d %H:%M:%S"),
+                    customer_idx=int_row["customer_idx"],
+                    product_idx=int_row["product_idx"],
+                    type=InteractionType(int_row["type"]),
+                    value=int_row["value"],
+                    review_score=int_row["review_score"],
+                )
+            )
+        customers.append(Customer(idx=row["idx"], zip_code=row["zip_code"], city=row["city"], state=row["state"], interactions=interactions))
+    return customers
+
+
+def same_interactions(a: List[Customer], b: List[Customer]) -> bool:
+    def fields(customers):
+        return [[(i.idx, i.timestamp, i.customer_idx, i.product_idx, i.type, i.value) for i in c.interactions] for c in customers]
+
+    return fields(a) == fields(b)
+
+
+def parse_size(text: str):
+    rows, customers = text.split(":")
+    return int(rows), int(customers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark customer and interaction hydration.")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(100_000, 1_000), (1_000_000, 10_000), (3_000_000, 30_000)],
+                        metavar="ROWS:CUSTOMERS", help="synthetic interaction rows and customers per run")
+    parser.add_argument("--old-max-rows", type=int, default=100_000, help="only time the iterrows loader up to this many rows, it is quadratic")
+    args = parser.parse_args(argv)
+
+    for rows, customers in args.sizes:
+        with tempfile.TemporaryDirectory() as data_dir:
+            write_synthetic(data_dir, rows, customers)
+
+            started = time.perf_counter()
+            loaded = CatalogStore(data_dir).customers()
+            wall = time.perf_counter() - started
+            print(f"catalog   {rows:>10,} rows {customers:>7,} customers: {wall:7.2f}s {rows / wall:>12,.0f} rows/s")
+
+            if rows <= args.old_max_rows:
+                started = time.perf_counter()
+                expected = load_customers_iterrows(data_dir)
+                wall = time.perf_counter() - started
+                print(f"iterrows  {rows:>10,} rows {customers:>7,} customers: {wall:7.2f}s {rows / wall:>12,.0f} rows/s, same interactions: {same_interactions(expected, loaded)}")
+
+
+if __name__ == "__main__":
+    main()
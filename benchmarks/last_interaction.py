@@ -0,0 +1,109 @@
+# last_interaction.py
+#
+# Latency of looking up a customer's last interaction, which every recommendation request does: the original
+# read of Interaction.csv filtered by customer against the in-memory index the loader builds from the
+# interaction log, on synthetic logs of up to 10M records.
+#
+#   python -m benchmarks.last_interaction
+#   python -m benchmarks.last_interaction --rows 1000000 10000000 --customers 100000 --old-rows 1000000
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from app.src.spark.data.catalog import hydrate_interactions
+from app.src.spark.data.interaction_log import InteractionLog, RECORD_DTYPE, records_to_frame
+from app.src.spark.data.models import Interaction, InteractionType, TYPE_CODES
+
+CHUNK_RECORDS = 1_000_000
+
+
+def write_synthetic_log(path: str, rows: int, customers: int, seed: int = 0):
+    """Interaction.log of random views, one second apart, written a chunk at a time."""
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as log_file:
+        for start in range(0, rows, CHUNK_RECORDS):
+            count = min(CHUNK_RECORDS, rows - start)
+            records = np.zeros(count, dtype=RECORD_DTYPE)
+            records["id"] = np.arange(start, start + count)
+            records["timestamp"] = 1_500_000_000_000_000 + records["id"] * 1_000_000
+            records["idx"] = b"view-synthetic"
+            records["product_idx"] = rng.integers(0, 295, count)
+            records["customer_idx"] = rng.integers(0, customers, count)
+            records["type"] = TYPE_CODES[InteractionType.VIEW]
+            records["value"] = 1.0
+            log_file.write(records.tobytes())
+
+
+def get_last_interaction_csv(csv_path: str, customer_idx: int):
+    """The original loader.get_last_interaction: parse the whole CSV on every request and keep the customer's last row."""
+    interaction = pd.read_csv(csv_path)
+    interaction = interaction[interaction["customer_idx"] == customer_idx]
+    if interaction.empty:
+        return None
+
+    interaction = interaction.iloc[-1]
+    return Interaction(
+        idx=interaction["idx"],
+        timestamp=datetime.strptime(interaction["timestamp"], "%Y-%m-%d %H:%M:%S"),
+        customer_idx=interaction["customer_idx"],
+        product_idx=interaction["product_idx"],
+        type=InteractionType(interaction["type"]),
+        value=interaction["value"],
+        review_score=interaction["review_score"],
+    )
+
+
+def percentiles(latencies) -> str:
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return f"p50 {p50 * 1e6:,.2f} us, p99 {p99 * 1e6:,.2f} us"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark last-interaction lookups against the size of the interaction log.")
+    parser.add_argument("--rows", nargs="+", type=int, default=[1_000_000, 10_000_000], help="interaction log sizes")
+    parser.add_argument("--customers", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=100_000, help="index lookups timed per log size")
+    parser.add_argument("--old-rows", type=int, default=1_000_000, help="rows of the Interaction.csv the original lookup parses, 0 to skip")
+    parser.add_argument("--old-requests", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as data_dir:
+        log_path = os.path.join(data_dir, "Interaction.log")
+        for rows in args.rows:
+            write_synthetic_log(log_path, rows, args.customers)
+            log = InteractionLog(log_path)
+
+            # as loader.build_last_interaction_index does for the log
+            started = time.perf_counter()
+            index = {interaction.customer_idx: interaction for interaction in hydrate_interactions(log.read_latest())}
+            build = time.perf_counter() - started
+            log.close()
+
+            latencies = []
+            for customer_idx in rng.integers(0, args.customers, args.requests).tolist():
+                started = time.perf_counter()
+                index.get(customer_idx)
+                latencies.append(time.perf_counter() - started)
+            print(f"index    {rows:>11,} records: built in {build:6.2f}s, lookup {percentiles(latencies)}")
+
+        if args.old_rows:
+            csv_path = os.path.join(data_dir, "Interaction.csv")
+            frame = records_to_frame(np.fromfile(log_path, dtype=RECORD_DTYPE, count=args.old_rows))
+            frame["timestamp"] = frame["timestamp"].dt.strftime("%Y-%m-%d %H:%M:%S")
+            frame.to_csv(csv_path, index=False)
+
+            latencies = []
+            for customer_idx in rng.integers(0, args.customers, args.old_requests).tolist():
+                started = time.perf_counter()
+                get_last_interaction_csv(csv_path, customer_idx)
+                latencies.append(time.perf_counter() - started)
+            print(f"csv scan {args.old_rows:>11,} rows:    lookup p50 {np.median(latencies) * 1e3:,.0f} ms, grows with the file")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# policy_inference.py
+#
+# Per-call latency of the serving policy: the stable-baselines3 model (torch) against its NumpyPolicy export,
+# for model.predict and for the per-product scores the ranking uses, on random observations at a few batch sizes.
+#
+#   python -m benchmarks.policy_inference
+#   python -m benchmarks.policy_inference --model app/src/spark/agent/models/a2c_recommender.zip --batch-sizes 1 64 256 --calls 500
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import stable_baselines3
+from app.src.spark.agent.export import export_policy
+from app.src.spark.agent.ranking import product_scores
+from app.src.spark.agent.registry import ALGORITHMS
+
+
+def random_observations(observation_space, count: int, seed: int = 0):
+    """A batch of count observations sampled from the model's observation space."""
+    observation_space.seed(seed)
+    samples = [observation_space.sample() for _ in range(count)]
+    return {key: np.stack([sample[key] for sample in samples]) for key in samples[0]}
+
+
+def time_calls(call, obs, calls: int):
+    call(obs)  # the first call pays for lazy initialisation
+    latencies = []
+    for _ in range(calls):
+        started = time.perf_counter()
+        call(obs)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def percentiles(latencies) -> str:
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return f"p50 {p50 * 1e3:7.3f} ms, p99 {p99 * 1e3:7.3f} ms"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark policy inference with torch against the NumPy export.")
+    parser.add_argument("--model", default="app/src/spark/agent/models/a2c_recommender.zip", help="stable-baselines3 .zip to export and time")
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 64])
+    parser.add_argument("--calls", type=int, default=200, help="timed calls per path and batch size")
+    args = parser.parse_args(argv)
+
+    algorithm = os.path.basename(args.model).split("_", 1)[0].lower()
+    if algorithm not in ALGORITHMS:
+        raise SystemExit(f"Cannot tell the algorithm of {args.model}")
+    model = getattr(stable_baselines3, algorithm.upper()).load(args.model, device="cpu")
+
+    with tempfile.TemporaryDirectory() as export_dir:
+        policy = export_policy(model, os.path.join(export_dir, "policy.npz"))
+
+    paths = [
+        ("torch predict", lambda obs: model.predict(obs, deterministic=True)),
+        ("numpy predict", lambda obs: policy.predict(obs, deterministic=True)),
+        ("torch scores", lambda obs: product_scores(model, obs)),
+        ("numpy scores", lambda obs: product_scores(policy, obs)),
+    ]
+    for batch_size in args.batch_sizes:
+        obs = random_observations(model.observation_space, batch_size)
+        for name, call in paths:
+            print(f"{name:<14} batch {batch_size:>4}: {percentiles(time_calls(call, obs, args.calls))}")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,34 @@ Created on Sun Nov  3 15:42:45 2024
 @author: crowl
 
 title: 
+
+Run from the repository root, as a module so the app's columnar helpers import as a package: the raw Olist CSVs
+are read from data/source and the outputs written to data/cleaned.
+
+    python -m data.vector_db_etl                   # rebuild everything from the source data
+    python -m data.vector_db_etl --incremental     # only process orders and reviews added since the last run
+    python -m data.vector_db_etl --memory-budget 512   # stream the run and keep its peak memory within 512 MiB
+
+Every run saves its id mappings, processed orders and reviews, the per-customer history state and a watermark
+(latest processed order_purchase_timestamp) in data/cleaned/etl_state. An incremental run keeps the customers,
+products and categories of the previous run, takes only orders purchased at or after the watermark that were
+not processed yet and reviews not processed yet, continues the history vectors from the saved state and
+appends to the outputs. Its cost is proportional to the new data. Run a full rebuild to reselect the top
+customers, when new orders need a product slot the previous run did not have, or when new interactions
+predate a customer's latest processed one.
+
+Outputs and state are written to .tmp files and moved into place together once all are complete. The moves
+are listed in etl_state/pending.json first, so a run interrupted while making them is finished by the next run.
+
+With --memory-budget the run streams: every source but the small product tables is read in chunks, the customers
+are ranked from per-customer totals kept in numpy arrays, with the order and customer ids held as 64-bit hashes
+and the customer_unique_ids as bytes, orders and reviews are reduced to the top customers' as they are read, and
+the history vectors of Customer_Interactions are computed and written in chunks of rows. The chunks are sized to
+the part of the budget the interpreter and libraries leave. What is still held grows with the number of
+customers and orders, by about 100 bytes each, and with the selected customers' interactions, so the peak
+resident memory of the process is checked after every stage and chunk: a run that went over the budget stops
+with an error before any output is moved into place. Customer_Interactions keeps the city, state and zip code
+ids instead of their dense one-hot embeddings.
 """
 #%% ===========================================================================
 # 1) Set-up
@@ -12,28 +40,149 @@ title:
 import pandas as pd
 from pathlib import Path
 import os
+import sys
+import json
+import shutil
+import argparse
 import numpy as np
+from app.src.spark.data.columnar import to_arrow
+
+try:
+    import resource  # measures the peak memory of a --memory-budget run, not available on Windows
+except ImportError:
+    resource = None
 
-root_path=Path(os.getcwd())
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    sys.exit('pyarrow is required to write the Parquet outputs, install it with pip install pyarrow')
+
+root_path=Path(__file__).resolve().parent  # the data directory
 source_path=root_path.joinpath('source')
 target_path=root_path.joinpath('cleaned')
+state_path=target_path.joinpath('etl_state')
 
 os.makedirs(source_path, exist_ok=True)
 os.makedirs(target_path, exist_ok=True)
 
+parser = argparse.ArgumentParser(description='Build the cleaned tables from the Olist source data.')
+parser.add_argument('--incremental', action='store_true', help='only process orders and reviews added since the last run')
+parser.add_argument('--memory-budget', type=int, default=None, metavar='MB', help='stream the run in chunks and stop it if its peak memory goes over this many MiB')
+args, _ = parser.parse_known_args()  # tolerates the arguments of an IDE console running the cells
+
+incremental = args.incremental
+streaming = args.memory_budget is not None
+
+def peak_memory_mb():
+    # peak resident memory of the process so far, ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2**20 if sys.platform == 'darwin' else peak / 2**10
+
+def check_memory(stage):
+    # outputs are only moved into place at the very end, so a run stopped here leaves the previous ones as they were
+    if streaming and peak_memory_mb() > args.memory_budget:
+        sys.exit(f'Peak memory of {peak_memory_mb():.0f} MiB went over the {args.memory_budget} MiB budget while {stage}, raise --memory-budget')
+
+if streaming:
+    if resource is None:
+        sys.exit('--memory-budget needs the resource module to measure memory, which this platform does not have')
+    # the interpreter and libraries loaded so far count against the budget, the run works in what is left
+    working_bytes = int((args.memory_budget - peak_memory_mb()) * 2**20)
+    if working_bytes < 16 * 2**20:
+        sys.exit(f'A --memory-budget of {args.memory_budget} MiB is too small, the interpreter and libraries alone use {peak_memory_mb():.0f} MiB')
+    # a chunk gets an eighth of it, the rest is left for the per-customer totals and the top customers' rows
+    chunk_bytes = working_bytes // 8
+else:
+    chunk_bytes = None
+
+# Estimated working memory per source row while parsing a chunk, and the rows per chunk it allows
+source_row_bytes = 2048
+source_chunk_rows = max(1000, chunk_bytes // source_row_bytes) if streaming else None
+
+# Outputs staged by this run, as paths relative to target_path, moved into place by commit_staged()
+pending_path = state_path.joinpath('pending.json')
+staged = []
+
+def staged_path(name):
+    # the temporary file to write the output name to
+    staged.append(name)
+    return target_path.joinpath(f'{name}.tmp')
+
+def move_staged(names):
+    # moves whose .tmp is gone were already made
+    for name in names:
+        if target_path.joinpath(f'{name}.tmp').exists():
+            os.replace(target_path.joinpath(f'{name}.tmp'), target_path.joinpath(name))
+    os.remove(pending_path)
+
+def commit_staged():
+    with open(f'{pending_path}.tmp', 'w') as f:
+        json.dump(staged, f, indent=2)
+    os.replace(f'{pending_path}.tmp', pending_path)
+    move_staged(staged)
+
+# A previous run stopped after staging all of its outputs but before moving all of them
+if pending_path.exists():
+    with open(pending_path) as f:
+        move_staged(json.load(f))
+
+if incremental:
+    if not state_path.joinpath('state.json').exists():
+        sys.exit(f'No previous run in {state_path}, run a full rebuild first')
+    with open(state_path.joinpath('state.json')) as f:
+        state = json.load(f)
+    watermark = pd.Timestamp(state['watermark'])
+    # appended rows must have the same Customer_Interactions columns as the previous run's
+    if state.get('location_embeddings', True) == streaming:
+        sys.exit(f"The last run {'did not stream' if streaming else 'streamed'}, run a full rebuild {'with' if streaming else 'without'} --memory-budget")
+
+def read_state(name):
+    return pd.read_parquet(state_path.joinpath(f'{name}.parquet'))
+
 #%% ===========================================================================
 # 2) Import datasets from source
 # =============================================================================
 
-customers      = pd.read_csv(source_path.joinpath('olist_customers_dataset.csv'))
+# Only the columns used, with explicit dtypes rather than inferred ones
+source_dtypes = {'customer_id'                  : str,
+                 'customer_unique_id'           : str,
+                 'customer_zip_code_prefix'     : 'int64',
+                 'customer_city'                : str,
+                 'customer_state'               : str,
+                 'order_id'                     : str,
+                 'order_purchase_timestamp'     : str,
+                 'order_item_id'                : 'int16',
+                 'product_id'                   : str,
+                 'price'                        : 'float64',
+                 'review_id'                    : str,
+                 'review_score'                 : 'int8',
+                 'review_answer_timestamp'      : str,
+                 'product_category_name'        : str,
+                 'product_category_name_english': str,
+                 }
+customer_columns     = ['customer_id', 'customer_unique_id', 'customer_zip_code_prefix', 'customer_city', 'customer_state']
+order_columns        = ['order_id', 'customer_id', 'order_purchase_timestamp']
+order_item_columns   = ['order_id', 'order_item_id', 'product_id', 'price']
+order_review_columns = ['review_id', 'order_id', 'review_score', 'review_answer_timestamp']
+
+def read_source_chunks(file_name, columns):
+    # the whole file as one chunk unless streaming
+    chunks = pd.read_csv(source_path.joinpath(file_name), usecols=columns, dtype={column: source_dtypes[column] for column in columns},
+                         chunksize=source_chunk_rows)
+    return [chunks] if source_chunk_rows is None else chunks
+
+def read_source(file_name, columns, keep=None):
+    # keep selects the rows to retain from each chunk, so only those are ever held together
+    return pd.concat([chunk if keep is None else chunk[keep(chunk)] for chunk in read_source_chunks(file_name, columns)], ignore_index=True)
+
+# customers and orders are read in chunks below, reduced to per-customer totals and to the top customers' orders
 # geolocation    = pd.read_csv(source_path.joinpath('olist_geolocation_dataset.csv'))
-orders         = pd.read_csv(source_path.joinpath('olist_orders_dataset.csv'))
-order_items    = pd.read_csv(source_path.joinpath('olist_order_items_dataset.csv'))
+# order_items and order_reviews, the largest tables, are read once it is known which of their rows are needed
 # order_payments = pd.read_csv(source_path.joinpath('olist_order_payments_dataset.csv'))
-order_reviews  = pd.read_csv(source_path.joinpath('olist_order_reviews_dataset.csv'))
-products       = pd.read_csv(source_path.joinpath('olist_products_dataset.csv'))
+products       = read_source('olist_products_dataset.csv', ['product_id', 'product_category_name'])
 # sellers        = pd.read_csv(source_path.joinpath('olist_sellers_dataset.csv'))
-product_category_name_translation = pd.read_csv(source_path.joinpath('product_category_name_translation.csv'))
+product_category_name_translation = read_source('product_category_name_translation.csv', ['product_category_name', 'product_category_name_english'])
 
 
 #%% ===========================================================================
@@ -48,70 +197,139 @@ products=(products
 
 
 #%% ===========================================================================
-# 4) Combine orders and customers tables
+# 4) Read orders and customers in chunks
 # =============================================================================
-orders = (orders[['order_id', 'customer_id', 'order_purchase_timestamp']]
-          .rename(columns={'order_purchase_timestamp':'timestamp'})
-          )
-
-# Merge customers and orders tables together as customer_id and order_id is 1:1
-customers_orders=(customers
-                  .rename(columns={'customer_zip_code_prefix':'zip_code',
-                                   'customer_city':'city',
-                                   'customer_state':'state'})
-                  .merge(orders, how='inner', on='customer_id')
-            )
+if incremental:
+    # orders at the watermark may have arrived after the last run, so it is inclusive and processed orders are skipped
+    processed_orders = read_state('order_products')['order_id']
+
+def read_orders():
+    # the orders chunk by chunk, only the unprocessed ones since the watermark when incremental
+    for chunk in read_source_chunks('olist_orders_dataset.csv', order_columns):
+        chunk = chunk.rename(columns={'order_purchase_timestamp':'timestamp'})
+        if incremental:
+            chunk = chunk[(pd.to_datetime(chunk['timestamp']) >= watermark) & ~chunk['order_id'].isin(processed_orders)]
+        yield chunk
+
+def key_hashes(keys):
+    # 64-bit hashes of string keys, 8 bytes a key instead of a Python string
+    return pd.util.hash_array(keys.to_numpy(dtype=object))
+
+def key_rows(sorted_keys, keys):
+    # row of each key in the sorted array of keys, -1 where it is not there
+    if len(sorted_keys) == 0:
+        return np.full(len(keys), -1)
+    rows = np.minimum(np.searchsorted(sorted_keys, keys), len(sorted_keys) - 1)
+    return np.where(sorted_keys[rows] == keys, rows, -1)
 
 
 #%% ===========================================================================
 # 5) Identify top X customers
 # =============================================================================
-# De-duplicate customer attributes, will be used later
-customers_unique = (customers_orders[['customer_unique_id','customer_id','zip_code','city','state']]
-                    .drop_duplicates(subset='customer_unique_id', keep='first')
-                    .drop(columns=['customer_id'])
-                    .sort_values(by=['customer_unique_id'])
-                    .reset_index(drop=True)
-                    # .reset_index()
-                    )
+# Identify the top X customers to reduce the dataset to. An incremental run keeps the previous selection, so it
+# skips the ranking, which is a full pass over order_items, and reads only the new orders' items below
+if incremental:
+    top_customers = read_state('customers')
+else:
+    # Every customer_unique_id once, sorted, as UTF-8 bytes rather than Python strings: its row is the customer's
+    # key and sorts the same as the id. customer_id -> that key, by customer_id hash and in hash order.
+    customer_hashes, row_unique_ids = [], []
+    for chunk in read_source_chunks('olist_customers_dataset.csv', ['customer_id','customer_unique_id']):
+        customer_hashes.append(key_hashes(chunk['customer_id']))
+        row_unique_ids.append(np.char.encode(chunk['customer_unique_id'].to_numpy(dtype=str), 'utf-8'))
+    customer_hashes, first_rows = np.unique(np.concatenate(customer_hashes), return_index=True)
+    row_unique_ids = np.concatenate(row_unique_ids)
+    # sorted once in place of np.unique, which would also keep a copy of the unsorted ids
+    id_order = np.argsort(row_unique_ids, kind='stable')
+    row_unique_ids = row_unique_ids[id_order]
+    first_of_id = np.r_[True, row_unique_ids[1:] != row_unique_ids[:-1]]
+    unique_ids = row_unique_ids[first_of_id]
+    del row_unique_ids
+    row_keys = np.empty(len(id_order), dtype='int64')
+    row_keys[id_order] = np.cumsum(first_of_id) - 1
+    customer_keys = row_keys[first_rows]
+    del id_order, first_of_id, row_keys, first_rows
+    check_memory('reading the customer keys')
+
+    # Aggregate order_items to find the value for each order, per chunk then across chunks by order_id hash
+    order_hashes, order_product_counts, order_values = [], [], []
+    for chunk in read_source_chunks('olist_order_items_dataset.csv', order_item_columns):
+        chunk_value = chunk.groupby(key_hashes(chunk['order_id'])).agg({'product_id':'count', 'price':'sum'})
+        order_hashes.append(chunk_value.index.to_numpy())
+        order_product_counts.append(chunk_value['product_id'].to_numpy())
+        order_values.append(chunk_value['price'].to_numpy())
+    order_hashes = np.concatenate(order_hashes)
+    hash_order = np.argsort(order_hashes, kind='stable')
+    order_hashes = order_hashes[hash_order]
+    order_starts = np.flatnonzero(np.r_[True, order_hashes[1:] != order_hashes[:-1]])
+    order_hashes = order_hashes[order_starts]
+    order_product_counts = np.add.reduceat(np.concatenate(order_product_counts)[hash_order], order_starts)
+    order_values = np.add.reduceat(np.concatenate(order_values)[hash_order], order_starts)
+    del hash_order, order_starts
+    check_memory('totalling the order items')
+
+    # Further aggregate order_value to customer level, adding each chunk of orders to its customers' totals
+    order_count   = np.zeros(len(unique_ids), dtype='int64')
+    product_count = np.zeros(len(unique_ids), dtype='int64')
+    value         = np.zeros(len(unique_ids))
+    for chunk in read_orders():
+        order_rows = key_rows(order_hashes, key_hashes(chunk['order_id']))
+        customer_rows = key_rows(customer_hashes, key_hashes(chunk['customer_id']))
+        found = (order_rows >= 0) & (customer_rows >= 0)
+        keys = customer_keys[customer_rows[found]]
+        np.add.at(order_count, keys, 1)
+        np.add.at(product_count, keys, order_product_counts[order_rows[found]])
+        np.add.at(value, keys, order_values[order_rows[found]])
+        check_memory('totalling the orders per customer')
+    del customer_hashes, customer_keys, order_hashes, order_product_counts, order_values
+
+    # Ranked in customer_unique_id order, the order of the keys, which decides the order of ties. Only the
+    # product counts are sorted, the top customers' rows are built from the ranking.
+    with_orders = np.flatnonzero(order_count)
+    ranked = with_orders[pd.Series(product_count[with_orders]).sort_values(ascending=False).index[:100]]
+    top_customers = pd.DataFrame({'customer_num_id'   : np.arange(len(ranked)),
+                                  'customer_unique_id': np.char.decode(unique_ids[ranked], 'utf-8').astype(object),
+                                  'order_count'       : order_count[ranked],
+                                  'product_count'     : product_count[ranked],
+                                  'value'             : value[ranked]})
+    del unique_ids, order_count, product_count, value, with_orders, ranked
 
-# Aggregate order_items to find the value for each customer_id/order_id
-order_value = (order_items
-               .groupby('order_id')
-               .agg({'product_id':'count', 'price':'sum'})
-               .rename(columns={'product_id':'product_count', 'price':'value'})
-               .merge(customers_orders[['order_id','customer_unique_id']], how='inner', on='order_id')
-               .sort_values(by='product_count',ascending=False)
-               .reset_index()
-               )
-
-# Further aggregate order_value to customer_unique_id level
-customer_value = (order_value
-                  .groupby('customer_unique_id')
-                  .agg({'order_id':'count', 'product_count':'sum', 'value':'sum'})
-                  .rename(columns={'order_id':'order_count'})
-                  .merge(customers_unique, how='inner', on='customer_unique_id')
-                  .sort_values(by=['product_count'],ascending=False)
-                  .reset_index(drop=True)
-                  .reset_index()
-                  .rename(columns={'index':'customer_num_id'})
-                  )
 
-# Identify the top X customers to reduce the dataset to
-top_customers = (customer_value
-                 .head(100)
-                 )
+#%% ===========================================================================
+# 6) Curate top_order_items to cascade down to other datasets
+# =============================================================================
+# The top customers' rows by customer_id, a small table each chunk of orders is joined to
+top_customer_ids = (read_source('olist_customers_dataset.csv', customer_columns,
+                                keep=lambda chunk: chunk['customer_unique_id'].isin(top_customers['customer_unique_id']))
+                    .rename(columns={'customer_zip_code_prefix':'zip_code',
+                                     'customer_city':'city',
+                                     'customer_state':'state'})
+                    )
+
+top_customer_orders, latest_purchases = [], []
+for chunk in read_orders():
+    latest_purchases.append(pd.to_datetime(chunk['timestamp']).max())
+    top_customer_orders.append(chunk.merge(top_customer_ids[['customer_id','customer_unique_id']], how='inner', on='customer_id'))
+    check_memory("reading the top customers' orders")
+top_customer_orders = pd.concat(top_customer_orders, ignore_index=True)
+
+if not incremental:
+    # De-duplicate customer attributes: each customer's first row with an order
+    customers_unique = (top_customer_ids[top_customer_ids['customer_id'].isin(top_customer_orders['customer_id'])]
+                        .drop_duplicates(subset='customer_unique_id', keep='first')
+                        [['customer_unique_id','zip_code','city','state']]
+                        )
+    top_customers = top_customers.merge(customers_unique, how='left', on='customer_unique_id')
 
 out_customers =(top_customers
-                .drop(columns=['customer_unique_id', 'order_count', 'product_count','value'])
+                .drop(columns=['customer_unique_id', 'order_count', 'product_count','value'], errors='ignore')
     )
 
+top_orders = top_customer_orders['order_id']
+order_items = read_source('olist_order_items_dataset.csv', order_item_columns, keep=lambda chunk: chunk['order_id'].isin(top_orders))
 
-#%% ===========================================================================
-# 6) Curate top_order_items to cascade down to other datasets
-# =============================================================================
 top_order_items = (order_items[['order_id', 'order_item_id', 'product_id', 'price']]
-                   .merge(customers_orders[['timestamp','order_id','customer_unique_id']], how='inner', on='order_id')
+                   .merge(top_customer_orders[['timestamp','order_id','customer_unique_id']], how='inner', on='order_id')
                    .merge(top_customers[['customer_unique_id','customer_num_id']], how='inner', on='customer_unique_id')
                    .merge(products, how='left', on='product_id')
                    .drop(columns='customer_unique_id')
@@ -122,6 +340,9 @@ top_order_items = (order_items[['order_id', 'order_item_id', 'product_id', 'pric
                    )
 
 
+if incremental:
+    top_order_items['order_num_id'] += state['next_order_num']
+
 top_order_items['timestamp'] = pd.to_datetime(top_order_items['timestamp']) + pd.to_timedelta(top_order_items['order_item_id'], unit='s')
 top_order_items['interaction_id'] = 'order-'+ top_order_items['order_num_id'].astype(str)
 top_order_items['review_score'] = 0
@@ -131,65 +352,102 @@ top_order_items['type'] = 'buy'
 #%% ===========================================================================
 # 6) Derive category and product tables to be used in env())
 # =============================================================================
-products_unique = (top_order_items[['product_id','product_category','price']]
-                   .drop_duplicates(subset='product_id', keep='first')
-                   .fillna(value={'product_category':'shrubbery'})
-                   .sort_values(by=['product_category'])
-                   .reset_index(drop=True)
-                   # .reset_index()
-                   # .rename(columns={'index':'product_num_id'})
-                   )
-
-# =============================================================================
-# A hack to reduce the total count of categories to 14
-# =============================================================================
-category_unique=(products_unique[['product_category']]
-                .drop_duplicates(subset='product_category', keep='first')
-                .reset_index(drop=True)
-                .reset_index()
-                .rename(columns={'index':'category_num_id_raw'})
-    )
-category_unique['category_num_id']=category_unique['category_num_id_raw'].apply(lambda x: (x ) % 14)
-category_unique['product_category_raw']=category_unique['product_category']
-
-out_category=(category_unique[['product_category','category_num_id']]
-                .drop_duplicates(subset='category_num_id', keep='first')
-                )
-
-category_unique=(category_unique
-                 .drop(columns=['product_category'])
-                 .merge(out_category, how='left', on='category_num_id')
-                 )
+if incremental:
+    # keep the previous run's mappings, new products continue the sequence of their category
+    products_unique = read_state('products')
+    category_unique = read_state('categories')
+
+    new_products = (top_order_items[['product_id','product_category']]
+                    .drop_duplicates(subset='product_id', keep='first')
+                    .fillna(value={'product_category':'shrubbery'})
+                    .rename(columns={'product_category':'product_category_raw'})
+                    )
+    new_products = new_products[~new_products['product_id'].isin(products_unique['product_id'])]
+
+    # unseen raw categories continue the raw numbering of the category hack
+    new_raw = new_products.loc[~new_products['product_category_raw'].isin(category_unique['product_category_raw']), ['product_category_raw']].drop_duplicates()
+    new_raw['category_num_id_raw'] = np.arange(len(new_raw)) + len(category_unique)
+    new_raw['category_num_id'] = new_raw['category_num_id_raw'] % 14
+    new_raw = new_raw.merge(category_unique[['category_num_id','product_category']].drop_duplicates(subset='category_num_id'), how='left', on='category_num_id')
+    category_unique = pd.concat([category_unique, new_raw], ignore_index=True)
+
+    new_products = (new_products
+                    .merge(category_unique[['product_category_raw','product_category','category_num_id']], how='left', on='product_category_raw')
+                    .drop(columns=['product_category_raw'])
+                    )
+    category_sizes = new_products['product_category'].map(products_unique['product_category'].value_counts()).fillna(0).astype(int)
+    new_products['category_seq_id'] = (category_sizes + new_products.groupby(['product_category']).cumcount()).apply(lambda x: x % 5 + 1)
+    new_products['product_name_id'] = new_products['product_category'] + '-' + new_products['category_seq_id'].astype(str)
+    new_products = new_products.merge(products_unique[['product_name_id','product_num_id','price']].drop_duplicates(subset='product_name_id'), how='left', on='product_name_id')
+
+    missing_slots = new_products['product_num_id'].isna()
+    if missing_slots.any():
+        sys.exit(f"New products need product slots the last run did not have ({', '.join(sorted(new_products.loc[missing_slots, 'product_name_id'].astype(str).unique()))}), run a full rebuild")
+    new_products['product_num_id'] = new_products['product_num_id'].astype(int)
+    products_unique = pd.concat([products_unique, new_products[products_unique.columns]], ignore_index=True)
+
+    out_category = (category_unique[['product_category','category_num_id']]
+                    .drop_duplicates(subset='category_num_id', keep='first')
+                    )
+else:
+    products_unique = (top_order_items[['product_id','product_category','price']]
+                       .drop_duplicates(subset='product_id', keep='first')
+                       .fillna(value={'product_category':'shrubbery'})
+                       .sort_values(by=['product_category'])
+                       .reset_index(drop=True)
+                       # .reset_index()
+                       # .rename(columns={'index':'product_num_id'})
+                       )
+
+    # =============================================================================
+    # A hack to reduce the total count of categories to 14
+    # =============================================================================
+    category_unique=(products_unique[['product_category']]
+                    .drop_duplicates(subset='product_category', keep='first')
+                    .reset_index(drop=True)
+                    .reset_index()
+                    .rename(columns={'index':'category_num_id_raw'})
+        )
+    category_unique['category_num_id']=category_unique['category_num_id_raw'].apply(lambda x: (x ) % 14)
+    category_unique['product_category_raw']=category_unique['product_category']
+
+    out_category=(category_unique[['product_category','category_num_id']]
+                    .drop_duplicates(subset='category_num_id', keep='first')
+                    )
 
-products_unique = (products_unique
-                   .rename(columns={'product_category':'product_category_raw'})
-                   .merge(category_unique[['product_category_raw','product_category','category_num_id']], how='left', on='product_category_raw')
-                   .drop(columns=['product_category_raw'])
-                )
+    category_unique=(category_unique
+                     .drop(columns=['product_category'])
+                     .merge(out_category, how='left', on='category_num_id')
+                     )
 
-# =============================================================================
-# A second hack to limit the total number of products to 5 per category at most
-# =============================================================================
-products_unique['category_seq_id'] = products_unique.groupby(['product_category']).cumcount()+1
+    products_unique = (products_unique
+                       .rename(columns={'product_category':'product_category_raw'})
+                       .merge(category_unique[['product_category_raw','product_category','category_num_id']], how='left', on='product_category_raw')
+                       .drop(columns=['product_category_raw'])
+                    )
 
+    # =============================================================================
+    # A second hack to limit the total number of products to 5 per category at most
+    # =============================================================================
+    products_unique['category_seq_id'] = products_unique.groupby(['product_category']).cumcount()+1
 
-# Step 1: Map category_seq_id values > 5 to range 1–5
-products_unique['category_seq_id'] = products_unique['category_seq_id'].apply(lambda x: (x - 1) % 5 + 1)
-products_unique['product_name_id'] = products_unique['product_category'] + '-' + products_unique['category_seq_id'].astype(str)
 
-product_first=(products_unique
-                .sort_values(by=['product_name_id'])
-                .drop_duplicates(subset='product_name_id', keep='first')
-                .reset_index(drop=True)
-                .reset_index()
-                .rename(columns={'index':'product_num_id'})
-    )
+    # Step 1: Map category_seq_id values > 5 to range 1–5
+    products_unique['category_seq_id'] = products_unique['category_seq_id'].apply(lambda x: (x - 1) % 5 + 1)
+    products_unique['product_name_id'] = products_unique['product_category'] + '-' + products_unique['category_seq_id'].astype(str)
 
-products_unique = (products_unique
-                   .drop(columns=['price'])
-                   .merge(product_first[['product_num_id','product_name_id','price']], how='left', on='product_name_id')
-                   )
+    product_first=(products_unique
+                    .sort_values(by=['product_name_id'])
+                    .drop_duplicates(subset='product_name_id', keep='first')
+                    .reset_index(drop=True)
+                    .reset_index()
+                    .rename(columns={'index':'product_num_id'})
+        )
 
+    products_unique = (products_unique
+                       .drop(columns=['price'])
+                       .merge(product_first[['product_num_id','product_name_id','price']], how='left', on='product_name_id')
+                       )
 
 out_products = (products_unique
                 .drop_duplicates(subset='product_num_id', keep='first')
@@ -216,8 +474,19 @@ unique_order_products=(top_order_items[['order_id','order_item_id','product_num_
                        .drop_duplicates(subset=['order_id','product_num_id'], keep='first')
     )
 
+# reviews can arrive for orders processed by earlier runs, only the reviews themselves must be new
+processed_reviews = read_state('reviews') if incremental else pd.DataFrame(columns=['review_id','order_id'])
+if incremental:
+    unique_order_products = pd.concat([read_state('order_products'), unique_order_products], ignore_index=True)
+
+order_reviews = read_source('olist_order_reviews_dataset.csv', order_review_columns,
+                            keep=lambda chunk: chunk['order_id'].isin(unique_order_products['order_id']))
+check_memory("reading the top customers' reviews")
 
 top_reviews =(order_reviews[['review_id','order_id','review_score','review_answer_timestamp']]
+              .merge(processed_reviews.assign(processed=True), how='left', on=['review_id','order_id'])
+              .query('processed != True')
+              .drop(columns=['processed'])
               .rename(columns={'review_answer_timestamp':'timestamp'})
               .merge(unique_order_products, how='inner', on='order_id')
               .reset_index(drop=True)
@@ -225,6 +494,9 @@ top_reviews =(order_reviews[['review_id','order_id','review_score','review_answe
               .rename(columns={'index':'review_num_id'})
     )
 
+if incremental:
+    top_reviews['review_num_id'] += state['next_review_num']
+
 top_reviews['timestamp'] = pd.to_datetime(top_reviews['timestamp']) + pd.to_timedelta(top_reviews['order_item_id'], unit='s')
 top_reviews['interaction_id'] = 'review-'+ top_reviews['review_num_id'].astype(str)
 top_reviews['type'] = 'rate'
@@ -240,6 +512,12 @@ out_interactions=(pd.concat([top_order_items[['timestamp','interaction_id','prod
                   .reset_index(drop=True)
                   )
 
+if incremental and out_interactions.empty:
+    print(f"No new orders or reviews since {state['watermark']}")
+    sys.exit(0)
+if out_interactions.empty:
+    sys.exit('No orders or reviews of the top customers in the source data')
+
 
 #%% ===========================================================================
 # 8) Create out_customer_interactions flatfile
@@ -276,112 +554,166 @@ out_customer_interactions=(out_interactions
                            .merge(unique_state,     how='left', on='state')
                            )
 
-city_dummies = pd.get_dummies(out_customer_interactions['city_id']).astype(int)
-state_dummies = pd.get_dummies(out_customer_interactions['state_id']).astype(int)
-zip_code_dummies = pd.get_dummies(out_customer_interactions['zip_code_id']).astype(int)
+# A streaming run keeps only the ids, the dense one-hot rows would grow with both the rows and the customers
+if not streaming:
+    # One column per id of the customer table rather than per id present in these interactions, so the width is the same in every run
+    city_dummies = pd.get_dummies(pd.Categorical(out_customer_interactions['city_id'], categories=unique_city['city_id'])).astype(int)
+    state_dummies = pd.get_dummies(pd.Categorical(out_customer_interactions['state_id'], categories=unique_state['state_id'])).astype(int)
+    zip_code_dummies = pd.get_dummies(pd.Categorical(out_customer_interactions['zip_code_id'], categories=unique_zip_code['zip_code_id'])).astype(int)
 
-# Step 2: Convert each row’s one-hot encoding into a dense numpy array
-out_customer_interactions['city_embedding'] = city_dummies.apply(lambda row: row.values, axis=1)
-out_customer_interactions['state_embedding'] = state_dummies.apply(lambda row: row.values, axis=1)
-out_customer_interactions['zip_code_embedding'] = zip_code_dummies.apply(lambda row: row.values, axis=1)
+    # Step 2: Convert each row’s one-hot encoding into a dense numpy array
+    out_customer_interactions['city_embedding'] = city_dummies.apply(lambda row: row.values, axis=1)
+    out_customer_interactions['state_embedding'] = state_dummies.apply(lambda row: row.values, axis=1)
+    out_customer_interactions['zip_code_embedding'] = zip_code_dummies.apply(lambda row: row.values, axis=1)
 
 
 #%% ===========================================================================
 # 9) Derive purchase_history and rate_history
 # =============================================================================
 # Number of unique products
-product_count  = out_customer_interactions['product_num_id'].nunique()
+product_count  = out_products['product_num_id'].nunique()
 category_count = out_category['category_num_id'].nunique()
+customer_count = len(out_customers)
 
 # Define scaling factor for review scores and EMA for purchase history
 review_score_max = 5  # Known max value for review scores
 alpha = 0.1  # EMA scaling factor for purchase history
 
-# Initialize lists to store the scaled purchase and rate histories
-hist_purchase_list = []
-hist_rate_list     = []
-hist_category_list = []
+# History carried over from the previous run, or chunk, per customer_num_id: counts and latest rates after all
+# of its rows, the same just before its last timestamp, and that timestamp. Rows tied with it start from the
+# state before it.
+if incremental:
+    carried = dict(np.load(state_path.joinpath('history.npz')))
+else:
+    carried = {'purchases'            : np.zeros((customer_count, product_count), dtype=int),
+               'purchases_before_last': np.zeros((customer_count, product_count), dtype=int),
+               'categories'            : np.zeros((customer_count, category_count), dtype=int),
+               'categories_before_last': np.zeros((customer_count, category_count), dtype=int),
+               'rates'                 : np.full((customer_count, product_count), np.nan),
+               'rates_before_last'     : np.full((customer_count, product_count), np.nan),
+               'last_timestamp'        : np.full(customer_count, np.datetime64('NaT'), dtype=out_customer_interactions['timestamp'].to_numpy().dtype),
+               }
 
 # Diagnostic counter for scaled_purchase_vector values exceeding 1
 count_exceeds_one = 0
 
-# Step 1: Iterate over each row in out_interactions
-for idx, row in out_customer_interactions.iterrows():
-    # Step 2: Initialize the purchase and rate history vectors
-    purchase_vector     = np.zeros(product_count,  dtype=int)
-    rate_history_vector = np.zeros(product_count,  dtype=float)
-    category_vector     = np.zeros(category_count, dtype=int)
-    
-    # Step 3: Filter past 'buy' interactions for the purchase vector
-    past_buys = out_customer_interactions[
-        (out_interactions['customer_num_id'] == row['customer_num_id']) &
-        (out_interactions['type'] == 'buy') &
-        (out_interactions['timestamp'] < row['timestamp'])
-    ]
-
-    # Increment the purchase vector based on past buys
-    for _, buy_row in past_buys.iterrows():
-        product_id=buy_row['product_num_id']
-        category_id=buy_row['category_num_id']
-        purchase_vector[product_id] += 1
-        category_vector[category_id] += 1
+def add_histories(interactions):
+    # Every history is point-in-time: it only counts the customer's interactions strictly before the row's timestamp.
+    # Rather than re-filtering all interactions for every row, sort once by customer and timestamp, accumulate
+    # per-customer counters down the sorted rows and read each row's history off the row just before the first
+    # of its (customer, timestamp) group. The sort is stable, so ties keep the order of out_interactions.
+    # Rows must not predate the rows of the same customer already in carried, which is then advanced past them.
+    global count_exceeds_one
+    customer_ids = interactions['customer_num_id'].to_numpy()
+    timestamps   = interactions['timestamp'].to_numpy()
+    order        = np.lexsort((timestamps, customer_ids))
+    row_count    = len(order)
+
+    sorted_customers  = customer_ids[order]
+    sorted_timestamps = timestamps[order]
+
+    predating = sorted_timestamps < carried['last_timestamp'][sorted_customers]
+    if predating.any():
+        sys.exit(f"New interactions predate interactions processed by the last run (customers {', '.join(map(str, np.unique(sorted_customers[predating])))}), run a full rebuild")
+    sorted_types      = interactions['type'].to_numpy()[order]
+    sorted_products   = interactions['product_num_id'].to_numpy()[order].astype(int)
+    sorted_categories = interactions['category_num_id'].to_numpy()[order]
+    sorted_scores     = interactions['review_score'].to_numpy()[order]
+
+    # First sorted row of each customer, and of each (customer, timestamp) group
+    positions      = np.arange(row_count)
+    new_customer   = np.r_[True, sorted_customers[1:] != sorted_customers[:-1]]
+    new_group      = new_customer | np.r_[True, sorted_timestamps[1:] != sorted_timestamps[:-1]]
+    customer_start = np.maximum.accumulate(np.where(new_customer, positions, 0))
+    group_start    = np.maximum.accumulate(np.where(new_group, positions, 0))
+    previous_row   = group_start - 1  # last row strictly before the row's timestamp, if it is the same customer's
+    has_history    = previous_row >= customer_start
+    customer_end   = np.r_[positions[new_customer][1:] - 1, row_count - 1][np.cumsum(new_customer) - 1]
+    tied_with_carried = sorted_timestamps == carried['last_timestamp'][sorted_customers]
+
+    def history_counts(is_event, columns, name):
+        # Running per-customer count of events per column, as it was just before each sorted row's timestamp,
+        # and including the row itself
+        start = np.where(tied_with_carried[:, None], carried[f'{name}_before_last'][sorted_customers], carried[name][sorted_customers])
+        counts = np.zeros((row_count, carried[name].shape[1]), dtype=int)
+        counts[positions[is_event], columns[is_event].astype(int)] = 1
+        counts = np.cumsum(counts, axis=0)
+        # subtract everything counted before the customer's first row
+        before_customer = np.where((customer_start > 0)[:, None], counts[customer_start - 1], 0)
+        history = start + np.where(has_history[:, None], counts[previous_row] - before_customer, 0)
+        return history, carried[name][sorted_customers] + counts - before_customer
+
+    is_buy = sorted_types == 'buy'
+    purchase_counts, purchase_totals = history_counts(is_buy, sorted_products,   'purchases')
+    category_counts, category_totals = history_counts(is_buy, sorted_categories, 'categories')
 
     # Apply EMA scaling to purchase vector
-    scaled_purchase_vector = 1 - np.exp(-alpha * purchase_vector)
-    scaled_category_vector = 1 - np.exp(-alpha * category_vector)
-
-    # Diagnostic check for values exceeding 1 in scaled_purchase_vector
-    if np.any(scaled_purchase_vector > 1):
-        count_exceeds_one += np.sum(scaled_purchase_vector > 1)
-
-    # Step 4: Filter past 'rate' interactions for the rate history vector
-    past_rates = out_interactions[
-        (out_interactions['customer_num_id'] == row['customer_num_id']) &
-        (out_interactions['type'] == 'rate') &
-        (out_interactions['timestamp'] < row['timestamp'])
-    ]
-
-    # Replace rate history vector elements with the most recent review_score, scaled to [0, 1]
-    for product_id in past_rates['product_num_id'].unique():
-        most_recent_rate = past_rates[past_rates['product_num_id'] == product_id].sort_values('timestamp').iloc[-1]
-        rate_history_vector[product_id] = most_recent_rate['review_score'] / review_score_max
-
-    # Append the scaled purchase and rate vectors to their respective lists
-    hist_purchase_list.append(scaled_purchase_vector)
-    hist_rate_list.append(rate_history_vector)
-    hist_category_list.append(scaled_category_vector)
-
-# Add the purchase and rate history vectors as new columns in out_interactions
-out_customer_interactions['product_purchase_history'] = hist_purchase_list
-out_customer_interactions['category_purchase_history'] = hist_category_list
-out_customer_interactions['rate_history'] = hist_rate_list
-
-# Print diagnostic result
-print(f"Number of instances where scaled_purchase_vector elements exceeded 1: {count_exceeds_one}")
-
+    scaled_purchase = 1 - np.exp(-alpha * purchase_counts)
+    scaled_category = 1 - np.exp(-alpha * category_counts)
+
+    count_exceeds_one += np.sum(scaled_purchase > 1)
+
+    # Most recent review_score per product, scaled to [0, 1]: carry the sorted row of each customer's latest rate
+    # of every product forward, then read it at the row before the timestamp group
+    is_rate   = sorted_types == 'rate'
+    last_rate = np.full((row_count, product_count), -1)
+    last_rate[positions[is_rate], sorted_products[is_rate]] = positions[is_rate]
+    last_rate = np.maximum.accumulate(last_rate, axis=0)
+    last_rate[last_rate < customer_start[:, None]] = -1  # rates of the previous customers
+    rate_totals = np.where(last_rate >= 0, sorted_scores[np.maximum(last_rate, 0)] / review_score_max, carried['rates'][sorted_customers])
+    last_rate = np.where(has_history[:, None], last_rate[previous_row], -1)
+    last_rate[last_rate < customer_start[:, None]] = -1
+    carried_rates = np.where(tied_with_carried[:, None], carried['rates_before_last'][sorted_customers], carried['rates'][sorted_customers])
+    rate_history = np.where(last_rate >= 0, sorted_scores[np.maximum(last_rate, 0)] / review_score_max, np.nan_to_num(carried_rates, nan=0.0))
+
+    # State after these rows for the next run or chunk, from each customer's last sorted row
+    last_rows = positions[customer_end == positions]
+    last_customers = sorted_customers[last_rows]
+    for name, history, totals in (('purchases', purchase_counts, purchase_totals), ('categories', category_counts, category_totals),
+                                  ('rates', np.where(last_rate >= 0, rate_history, carried_rates), rate_totals)):
+        carried[name][last_customers] = totals[last_rows]
+        carried[f'{name}_before_last'][last_customers] = history[last_rows]
+    carried['last_timestamp'][last_customers] = sorted_timestamps[last_rows]
+
+    # Back to the row order of interactions
+    unsorted = np.empty_like(order)
+    unsorted[order] = positions
+    hist_purchase_list = list(scaled_purchase[unsorted])
+    hist_category_list = list(scaled_category[unsorted])
+    hist_rate_list     = list(rate_history[unsorted])
+
+    # Add the purchase and rate history vectors as new columns in out_interactions
+    interactions['product_purchase_history'] = hist_purchase_list
+    interactions['category_purchase_history'] = hist_category_list
+    interactions['rate_history'] = hist_rate_list
+    return interactions
+
+# A streaming run computes the histories chunk by chunk as Customer_Interactions is written, carrying the
+# per-customer state from one chunk to the next. The chunk is sized to the working arrays of add_histories,
+# about 16 vectors per row as wide as the product and category counts.
+if streaming:
+    history_row_bytes = 16 * 8 * (product_count + category_count)
+    history_chunk_rows = max(1, chunk_bytes // history_row_bytes)
+else:
+    out_customer_interactions = add_histories(out_customer_interactions)
 
 #%% ===========================================================================
 # 10) Rename columns to align to data model requirements
 # =============================================================================
-out_interactions.rename(columns={'interaction_id':'idx',
-                                 'timestamp':'timestamp',
-                                 'customer_num_id':'customer_idx',
-                                 'product_num_id':'product_idx',
-                                 'type':'type',
-                                 'value':'value',
-                                 'review_score':'review_score',
-                                 }
-                        ,inplace=True)
+interaction_columns = {'interaction_id':'idx',
+                       'timestamp':'timestamp',
+                       'customer_num_id':'customer_idx',
+                       'product_num_id':'product_idx',
+                       'type':'type',
+                       'value':'value',
+                       'review_score':'review_score',
+                       }
 
-out_customer_interactions.rename(columns={'interaction_id':'idx',
-                                 'timestamp':'timestamp',
-                                 'customer_num_id':'customer_idx',
-                                 'product_num_id':'product_idx',
-                                 'type':'type',
-                                 'value':'value',
-                                 'review_score':'review_score',
-                                 }
-                        ,inplace=True)
+out_interactions.rename(columns=interaction_columns, inplace=True)
+
+# A streaming run renames Customer_Interactions chunk by chunk, once add_histories has run on it
+if not streaming:
+    out_customer_interactions.rename(columns=interaction_columns, inplace=True)
 
 out_customers.rename(columns={'customer_num_id':'idx',
                               'city':'city',
@@ -406,8 +738,88 @@ out_products.rename(columns={'product_num_id':'idx',
 #%% ===========================================================================
 # 11) Output transformed datasets files
 # =============================================================================
-out_interactions.to_csv(target_path.joinpath('Interaction.csv'))
-out_customer_interactions.to_csv(target_path.joinpath('Customer_Interactions.csv'))
-out_customers.to_csv(target_path.joinpath('Customer.csv'))
-out_category.to_csv(target_path.joinpath('Category.csv'))
-out_products.to_csv(target_path.joinpath('Product.csv'))
\ No newline at end of file
+# Every table is written as typed, compressed Parquet by the app's columnar.to_arrow: vectors as fixed-size
+# lists and repeated strings as dictionaries. The app tables also keep their CSVs, which the loader falls back
+# to without pyarrow. Customer_Interactions is Parquet only, its vectors would otherwise be stringified into
+# CSV cells; read it with pd.read_parquet.
+vector_types = {'city_embedding'           : pa.int8(),
+                'state_embedding'          : pa.int8(),
+                'zip_code_embedding'       : pa.int8(),
+                'product_purchase_history' : pa.float64(),
+                'category_purchase_history': pa.float64(),
+                'rate_history'             : pa.float64(),
+                }
+
+os.makedirs(state_path, exist_ok=True)
+
+out_tables = {'Interaction'          : out_interactions,
+              'Customer'             : out_customers,
+              'Category'             : out_category,
+              'Product'              : out_products,
+              }
+
+# An incremental run appends its interactions and rewrites the small customer, category and product tables
+for name, df in out_tables.items():
+    table = to_arrow(df, vector_types=vector_types)
+    if incremental and name == 'Interaction':
+        previous = pq.read_table(target_path.joinpath(f'{name}.parquet'), memory_map=True)
+        table = pa.concat_tables([previous, table.cast(previous.schema)])
+        # appended to a copy, the previous CSV stays as it is until every output is complete
+        csv_path = staged_path(f'{name}.csv')
+        shutil.copyfile(target_path.joinpath(f'{name}.csv'), csv_path)
+        df.set_axis(np.arange(len(df)) + state['interaction_rows']).to_csv(csv_path, mode='a', header=False)
+    else:
+        df.to_csv(staged_path(f'{name}.csv'))
+    pq.write_table(table, staged_path(f'{name}.parquet'), compression='zstd')
+
+# Customer_Interactions is written chunk by chunk, after the previous run's rows when incremental
+if streaming:
+    customer_interaction_chunks = (add_histories(out_customer_interactions.iloc[start:start + history_chunk_rows].copy()).rename(columns=interaction_columns)
+                                   for start in range(0, len(out_customer_interactions), history_chunk_rows))
+else:
+    customer_interaction_chunks = [out_customer_interactions]
+
+customer_interactions_path = target_path.joinpath('Customer_Interactions.parquet')
+previous_batches = pq.ParquetFile(customer_interactions_path).iter_batches() if incremental else []
+writer = None
+for chunk in customer_interaction_chunks:
+    table = to_arrow(chunk, vector_types=vector_types)
+    if writer is None:
+        schema = pq.read_schema(customer_interactions_path) if incremental else table.schema
+        writer = pq.ParquetWriter(staged_path('Customer_Interactions.parquet'), schema, compression='zstd')
+        for batch in previous_batches:
+            writer.write_batch(batch)
+    writer.write_table(table.cast(schema))
+    check_memory('writing Customer_Interactions')
+if writer is not None:
+    writer.close()
+
+# Print diagnostic result
+print(f"Number of instances where scaled_purchase_vector elements exceeded 1: {count_exceeds_one}")
+
+
+#%% ===========================================================================
+# 12) Save mappings, history and watermark for the next incremental run
+# =============================================================================
+top_customers[['customer_num_id','customer_unique_id','zip_code','city','state']].to_parquet(staged_path('etl_state/customers.parquet'))
+products_unique.to_parquet(staged_path('etl_state/products.parquet'))
+category_unique.to_parquet(staged_path('etl_state/categories.parquet'))
+unique_order_products.to_parquet(staged_path('etl_state/order_products.parquet'))
+pd.concat([processed_reviews, top_reviews[['review_id','order_id']].drop_duplicates()], ignore_index=True).to_parquet(staged_path('etl_state/reviews.parquet'))
+with open(staged_path('etl_state/history.npz'), 'wb') as f:  # np.savez would add .npz to a file name
+    np.savez(f, **carried)
+
+previous_state = state if incremental else {'watermark': None, 'next_order_num': 0, 'next_review_num': 0, 'interaction_rows': 0}
+# the latest purchase timestamp read, orders before it are either processed or belong to other customers
+order_watermark = pd.Series(latest_purchases + [pd.Timestamp(previous_state['watermark'])]).max()
+with open(staged_path('etl_state/state.json'), 'w') as f:
+    json.dump({'watermark'       : str(order_watermark),
+               'next_order_num'  : previous_state['next_order_num'] + len(top_order_items),
+               'next_review_num' : previous_state['next_review_num'] + len(top_reviews),
+               'interaction_rows': previous_state['interaction_rows'] + len(out_interactions),
+               'location_embeddings': not streaming,
+               }, f, indent=2)
+
+# Move every output and the state into place
+check_memory('saving the state')
+commit_staged()
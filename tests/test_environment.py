@@ -0,0 +1,177 @@
+# test_environment.py
+
+import random
+import numpy as np
+import pytest
+from datetime import datetime
+from app.src.spark.agent.environment import RecommendationEnv
+from app.src.spark.agent.vec_environment import RecommendationVecEnv
+from app.src.spark.data.models import Customer, Product, Category, Interaction, InteractionType
+from app.src.spark import utils
+
+NUM_USERS = 6
+NUM_PRODUCTS = 40
+NUM_CATEGORIES = 5
+STEPS = 300
+
+# interaction types that change the counters, and the ones that do not
+COUNTED_TYPES = (InteractionType.VIEW, InteractionType.LIKE, InteractionType.BUY, InteractionType.RATE)
+OTHER_TYPES = (InteractionType.NONE, InteractionType.SESSION_START, InteractionType.SESSION_CLOSE)
+
+
+def make_env(rng: random.Random, **kwargs) -> RecommendationEnv:
+    """Small env with uneven categories and a few seed interactions per user."""
+    categories = [Category(idx, f"category {idx}", "") for idx in range(NUM_CATEGORIES)]
+    products = [Product(idx, f"product {idx}", "", "", categories[rng.randrange(NUM_CATEGORIES)], 1.0) for idx in range(NUM_PRODUCTS)]
+    users = []
+    for idx in range(NUM_USERS):
+        interactions = [random_interaction(rng, idx) for _ in range(rng.randrange(10))]
+        users.append(Customer(idx, 1000 + idx, "city", "state", interactions))
+    return RecommendationEnv(users, products, categories, top_k=4, **kwargs)
+
+
+def random_interaction(rng: random.Random, user_idx: int) -> Interaction:
+    inter_type = rng.choice(COUNTED_TYPES * 3 + OTHER_TYPES)
+    value = rng.randrange(1, 6) if inter_type == InteractionType.RATE else 0
+    return Interaction("", datetime(2024, 1, 1), user_idx, rng.randrange(NUM_PRODUCTS), inter_type, value)
+
+
+def assert_preferences_match_counters(env: RecommendationEnv):
+    """The cached preferences must equal a full recompute from the counters, bit for bit, and every counted product be indexed."""
+    product_prefs = RecommendationEnv._product_preferences(env.views, env.buys, env.likes, env.ratings)
+    np.testing.assert_array_equal(env.product_prefs, product_prefs)
+    for row, user in enumerate(env.users):
+        np.testing.assert_array_equal(env.category_prefs[row], env._get_category_preferences(user, product_prefs[row]))
+    for row in range(len(env.users)):
+        counted = (env.views[row] != 0) | (env.likes[row] != 0) | (env.buys[row] != 0) | (env.ratings[row] != 0)
+        assert set(np.flatnonzero(counted).tolist()) <= env.interacted_products[row]
+
+
+class ReferenceEnv:
+    """The observation code as it was before the env kept counter matrices and cached preferences: per-user counters
+    and preferences recomputed with a loop over the catalog on every observation. Kept verbatim as the oracle."""
+
+    def __init__(self, users, products, categories):
+        self.products = products
+        self.categories = categories
+        self.counters = {}
+        for user in users:
+            counters = {name: np.zeros(len(products), dtype=np.int16) for name in ('views', 'likes', 'buys', 'ratings')}
+            for interaction in user.interactions:
+                i_type = interaction.type.value
+                product_idx = interaction.product_idx
+                if i_type == InteractionType.VIEW.value:
+                    counters['views'][product_idx] += 1
+                elif i_type == InteractionType.LIKE.value:
+                    counters['likes'][product_idx] += 1
+                elif i_type == InteractionType.BUY.value:
+                    counters['buys'][product_idx] += 1
+                elif i_type == InteractionType.RATE.value:
+                    counters['ratings'][product_idx] = interaction.value
+            self.counters[user.idx] = counters
+
+    def update_observation(self, user_idx, interaction):
+        user = self.counters[user_idx]
+        if interaction.type == InteractionType.VIEW:
+            user['views'][interaction.product_idx] += 1
+        elif interaction.type == InteractionType.LIKE:
+            user['likes'][interaction.product_idx] += 1
+        elif interaction.type == InteractionType.BUY:
+            user['buys'][interaction.product_idx] += 1
+        elif interaction.type == InteractionType.RATE:
+            user['ratings'][interaction.product_idx] = interaction.value
+
+        product_obs = np.zeros(len(self.products), dtype=np.int16)
+        if interaction.type in (InteractionType.VIEW, InteractionType.LIKE, InteractionType.BUY, InteractionType.RATE):
+            product_obs = utils.one_hot_encode(interaction.product_idx, len(self.products))
+
+        return {
+            'pref_prod': self.product_preferences(user_idx),
+            'pref_cat': self.category_preferences(user_idx),
+            'buys': user['buys'],
+            'views': user['views'],
+            'likes': user['likes'],
+            'ratings': user['ratings'],
+            'product': product_obs,
+            'interaction': utils.one_hot_encode(list(InteractionType).index(interaction.type), len(InteractionType)),
+            'rating': interaction.value if interaction.type == InteractionType.RATE else 0,
+        }
+
+    def observation(self, user_idx):
+        user = self.counters[user_idx]
+        return {
+            'pref_prod': self.product_preferences(user_idx),
+            'pref_cat': self.category_preferences(user_idx),
+            'buys': user['buys'],
+            'views': user['views'],
+            'likes': user['likes'],
+            'ratings': user['ratings'],
+            'product': np.zeros(len(self.products)),
+            'interaction': np.zeros(len(list(InteractionType))),
+            'rating': 0,
+        }
+
+    def product_preferences(self, user_idx):
+        user = self.counters[user_idx]
+        rating_prefs = user['ratings'].copy()
+        rating_prefs[rating_prefs > 0] -= 2
+        return user['views'] / 20 + user['buys'] + user['likes'] / 15 + rating_prefs
+
+    def category_preferences(self, user_idx):
+        cat_prefs = np.zeros(len(self.categories), np.float32)
+        for idx, prod_pref in enumerate(self.product_preferences(user_idx)):
+            if prod_pref > 0:
+                cat_prefs[self.products[idx].category.idx] += prod_pref
+        return cat_prefs / 5
+
+
+def assert_same_observation(obs, expected):
+    """Same keys, dtypes and values. The reference adds each product preference into a float32 category total, the env
+    sums in float64 and rounds once, so pref_cat may differ in the last float32 bits; everything else is exact."""
+    assert obs.keys() == expected.keys()
+    for key, value in expected.items():
+        assert np.asarray(obs[key]).dtype == np.asarray(value).dtype, key
+        if key == 'pref_cat':
+            np.testing.assert_allclose(obs[key], value, rtol=1e-6, err_msg=key)
+        else:
+            np.testing.assert_array_equal(obs[key], value, err_msg=key)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_step_keeps_preferences_in_step_with_counters(seed):
+    rng = random.Random(seed)
+    env = make_env(rng)
+    assert_preferences_match_counters(env)
+    for _ in range(STEPS):
+        user_idx = rng.randrange(NUM_USERS)
+        env.step([0], random_interaction(rng, user_idx))
+        assert_preferences_match_counters(env)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_batched_refresh_keeps_preferences_in_step_with_counters(seed):
+    rng = random.Random(seed)
+    env = make_env(rng)
+    vec_env = RecommendationVecEnv(env, num_envs=4, seed=seed)
+    vec_env.reset()
+    for _ in range(STEPS // 4):
+        vec_env.step(np.array([[rng.randrange(NUM_PRODUCTS) for _ in range(env.top_k)] for _ in range(vec_env.num_envs)]))
+        assert_preferences_match_counters(env)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_observations_match_the_reference_implementation(seed):
+    rng = random.Random(seed)
+    env = make_env(rng)
+    reference = ReferenceEnv(env.users, env.products, env.categories)
+    for user in env.users:
+        assert_same_observation(env._get_observation(user), reference.observation(user.idx))
+    for _ in range(STEPS):
+        user = env.users[rng.randrange(NUM_USERS)]
+        interaction = random_interaction(rng, user.idx)
+        if rng.random() < 0.5:
+            obs = env.step([0], interaction)[0]
+        else:
+            obs = env.update_observation(user, interaction)
+        assert_same_observation(obs, reference.update_observation(user.idx, interaction))
+        assert_same_observation(env._get_observation(user), reference.observation(user.idx))
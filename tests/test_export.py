@@ -0,0 +1,80 @@
+# test_export.py
+
+import random
+import numpy as np
+import pytest
+from datetime import datetime
+from stable_baselines3 import A2C, PPO
+from app.src.spark.agent.environment import RecommendationEnv
+from app.src.spark.agent.export import export_policy
+from app.src.spark.agent.features import CompactFeaturesExtractor
+from app.src.spark.agent.ranking import product_scores, top_k_batch
+from app.src.spark.data.models import Customer, Product, Category, Interaction, InteractionType
+
+NUM_USERS = 16
+NUM_PRODUCTS = 40
+NUM_CATEGORIES = 5
+TOP_K = 4
+
+
+def make_env(rng: random.Random, observation_mode: str) -> RecommendationEnv:
+    """Small env whose users have a few random interactions each."""
+    categories = [Category(idx, f"category {idx}", "") for idx in range(NUM_CATEGORIES)]
+    products = [Product(idx, f"product {idx}", "", "", categories[rng.randrange(NUM_CATEGORIES)], 1.0) for idx in range(NUM_PRODUCTS)]
+    users = [Customer(idx, 1000 + idx, "city", "state", [random_interaction(rng, idx) for _ in range(rng.randrange(1, 20))]) for idx in range(NUM_USERS)]
+    return RecommendationEnv(users, products, categories, top_k=TOP_K, observation_mode=observation_mode, top_n=8)
+
+
+def random_interaction(rng: random.Random, user_idx: int) -> Interaction:
+    inter_type = rng.choice(list(InteractionType))
+    value = rng.randrange(1, 6) if inter_type == InteractionType.RATE else 0
+    return Interaction("", datetime(2024, 1, 1), user_idx, rng.randrange(NUM_PRODUCTS), inter_type, value)
+
+
+def make_model(algorithm, env: RecommendationEnv, seed: int):
+    policy_kwargs = dict(net_arch=[32, 32])
+    if env.observation_mode == "compact":
+        policy_kwargs.update(features_extractor_class=CompactFeaturesExtractor, features_extractor_kwargs=dict(embed_dim=8))
+    return algorithm("MultiInputPolicy", env, policy_kwargs=policy_kwargs, seed=seed, device="cpu")
+
+
+def slot_log_probs(model, obs) -> np.ndarray:
+    import torch
+
+    with torch.no_grad():
+        obs_tensor, _ = model.policy.obs_to_tensor(obs)
+        distribution = model.policy.get_distribution(obs_tensor)
+        return torch.stack([slot.logits for slot in distribution.distribution], dim=1).cpu().numpy()
+
+
+@pytest.mark.parametrize("observation_mode", ["compact", "dense"])
+@pytest.mark.parametrize("algorithm", [PPO, A2C])
+def test_exported_policy_matches_the_model(tmp_path, algorithm, observation_mode):
+    rng = random.Random(0)
+    env = make_env(rng, observation_mode)
+    model = make_model(algorithm, env, seed=0)
+    policy = export_policy(model, str(tmp_path / "policy.npz"))
+    assert policy.matches(env.observation_space)
+
+    # the observations served for every user after a random last interaction
+    obs = env.get_observations(env.users, [random_interaction(rng, user.idx) for user in env.users])
+
+    log_probs = np.stack(policy._slot_log_probs(policy.logits(obs)), axis=1)
+    expected_log_probs = slot_log_probs(model, obs)
+    np.testing.assert_allclose(log_probs, expected_log_probs, atol=1e-5)
+
+    scores = product_scores(policy, obs)
+    expected_scores = product_scores(model, obs)
+    np.testing.assert_allclose(scores, expected_scores, atol=1e-5)
+    np.testing.assert_array_equal(top_k_batch(scores, TOP_K), top_k_batch(expected_scores, TOP_K))
+
+    # deterministic actions agree with model.predict up to ties decided by float rounding
+    actions, _ = policy.predict(obs, deterministic=True)
+    expected_actions, _ = model.predict(obs, deterministic=True)
+    gap = np.take_along_axis(expected_log_probs, expected_actions[..., None], axis=2) - np.take_along_axis(expected_log_probs, actions[..., None], axis=2)
+    assert (gap <= 1e-5).all()
+
+    # a single observation, as served to one user
+    single = {key: value[0] for key, value in obs.items()}
+    single_actions, _ = policy.predict(single, deterministic=True)
+    np.testing.assert_array_equal(single_actions, actions[0])